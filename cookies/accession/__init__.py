@@ -3,13 +3,13 @@ from django.core.files import File
 from  django.core.exceptions import ObjectDoesNotExist
 from django.db.models import QuerySet
 from django.db import transaction
-from django.utils import timezone
 
-import importlib, mimetypes, copy, os, logging, requests, urllib
+import importlib, mimetypes, copy, os, logging, urllib
 from cookies.models import *
 from uuid import uuid4
 from cookies import metadata
-from datetime import datetime, timedelta
+from cookies.sessions import Client
+from datetime import datetime
 
 
 logger = settings.LOGGER
@@ -44,29 +44,15 @@ def access_token_generator(user, fallback):
     str
         Authorization token for ``user``.
     """
-
-    try:
-        ex = timezone.now() - timedelta(minutes=settings.GILES_TOKEN_EXPIRATION)
-        if user.giles_token.created > ex:
-            return user.giles_token.token
-    except (AttributeError, ObjectDoesNotExist):    # RelatedObjectDoesNotExist.
-        pass    # Will proceed to retrieve token.
-
-
-    try:    # Delete the old token first.
-        user.giles_token.delete()
-    except (AssertionError, ObjectDoesNotExist):
-        pass
-
-    token = fallback()
-    user.giles_token = GilesToken.objects.create(for_user=user, token=token)
-    user.save()
-    return user.giles_token.token
+    from cookies.tokens import giles_tokens
+    return giles_tokens.get(user, fallback)
 
 
 class WebRemote(object):
+    session = Client('web')
+
     def get(self, uri, raw=False):
-        response = requests.get(uri)
+        response = self.session.get(uri)
         if raw:
             return response
         return response.content
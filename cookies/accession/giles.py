@@ -1,6 +1,10 @@
-import requests, urllib, urlparse
+import urllib, urlparse
 from requests.packages.urllib3.exceptions import NewConnectionError
 
+from cookies.sessions import Client
+
+session = Client('giles')
+
 
 class GilesRemote(object):
     def __init__(self, giles_token, giles_endpoint, giles_provider,
@@ -32,7 +36,7 @@ class GilesRemote(object):
         headers = {'Authorization': 'token %s' % self.giles_token}
         data = {'providerToken': provider_token}
         try:
-            response = requests.post(path, data=data, headers=headers)
+            response = session.post(path, data=data, headers=headers)
         except NewConnectionError as E:
             raise IOError('Could not contact Giles at %s' % path)
         if response.status_code != 200:
@@ -60,7 +64,7 @@ class GilesRemote(object):
         # Giles doesn't return images if 'dw' parameter is missing
         params = {'dw': 500}
 
-        response = requests.get(self.sign_uri(target), params=params, headers=headers)
+        response = session.get(self.sign_uri(target), params=params, headers=headers)
         if response.status_code != 200:
             raise IOError('Giles responded with %i: %s' % (response.status_code, response.content))
         if raw:
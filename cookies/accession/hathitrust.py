@@ -2,11 +2,15 @@
 Accession manager for HathiTrust resources in the public domain.
 """
 
-import oauthlib, requests
+import oauthlib
 from itertools import groupby
 
 from oauthlib import oauth1
 
+from cookies.sessions import Client
+
+session = Client('hathitrust')
+
 
 numeral_map = zip(
     (1000, 900, 500, 400, 100, 90, 50, 40, 10, 9, 5, 4, 1),
@@ -52,7 +56,7 @@ class HathiTrustRemote(object):
     def get(self, target, sign=True, raw=False):
         if sign:
             target = self.sign_uri(target)
-        response = requests.get(target)
+        response = session.get(target)
         if response.status_code != 200:
             raise IngestError(response.content)
         if raw:
@@ -17,24 +17,34 @@ later on, e.g. if we decide to use S3 to serve large downloads.
 For performance sake, we should take full advantage of the content cache.
 """
 
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.conf import settings
 from django.core.cache import caches
+from django.db import connection
 from django.utils import timezone
-from itertools import chain
+from django.utils.encoding import force_bytes
+from itertools import chain, islice
 from cookies.accession import get_remote
-import smart_open, zipfile, logging, cStringIO, mimetypes
+from cookies.contentcache import get_or_fetch
+from cookies.exceptions import RemoteUnavailable
+from cookies.zipstream import ZipStream, ChunkBuffer
+import smart_open
 import os, urlparse, mimetypes
 import unicodecsv as csv
 import posixpath
+import threading, time, sys, Queue, tempfile, hashlib
+from collections import deque, defaultdict
 
 from django.utils.text import slugify
 from cookies import authorization as auth
-from cookies.models import Resource, Value
+from cookies.models import Resource, Value, Relation, ContentRelation
 from cookies.models import ResourceAuthorization, CollectionAuthorization
-from cookies.models import ResourceContainer, Collection
+from cookies.models import ResourceContainer, Collection, Dataset
+from cookies.filters import apply_dataset_filters
 
 cache = caches['remote_content']
+failure_cache = caches['default']    # Recently failed locations.
 
 logger = settings.LOGGER
 
@@ -54,6 +64,9 @@ METADATA_CSV_HEADER = [
     'target_uri',
 ]
 
+METADATA_BATCH_SIZE = 500
+"""Resources for which metadata rows are loaded together."""
+
 CONTENT_TYPE_EXTENSIONS = {
     'text/plain'      : '.txt',
     'text/csv'        : '.csv',
@@ -74,23 +87,203 @@ def get_filename(resource):
     else:
         return os.path.basename(resource.file.path)
 
+class SourceThrottle(object):
+    """
+    Limits the number of simultaneous requests to an external source, and the
+    rate at which they are made.
+
+    Use as a context manager around each request.
+
+    Parameters
+    ----------
+    concurrency : int
+        Maximum number of requests in flight at once.
+    rate : float
+        (optional) Maximum number of requests per second.
+    """
+    def __init__(self, concurrency, rate=None):
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.interval = 1./rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next_request = 0.
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.interval:
+            with self.lock:
+                now = time.time()
+                wait = self.next_request - now
+                self.next_request = max(now, self.next_request) + self.interval
+            if wait > 0:
+                time.sleep(wait)
+        return self
+
+    def __exit__(self, *args):
+        self.semaphore.release()
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+def get_throttle(external_source):
+    """
+    Get the (process-wide) :class:`.SourceThrottle` for an external source,
+    configured by ``CONTENT_FETCH_CONCURRENCY`` and
+    ``CONTENT_FETCH_RATE_LIMIT``\.
+    """
+    with _throttles_lock:
+        if external_source not in _throttles:
+            concurrency = getattr(settings, 'CONTENT_FETCH_CONCURRENCY', {})\
+                .get(external_source, getattr(settings, 'CONTENT_FETCH_WORKERS', 1))
+            rate = getattr(settings, 'CONTENT_FETCH_RATE_LIMIT', {}).get(external_source)
+            _throttles[external_source] = SourceThrottle(max(concurrency, 1), rate)
+        return _throttles[external_source]
+
+class CircuitBreaker(object):
+    """
+    Stops requests to an external source for a while once too many of them
+    are failing, so that callers fail fast instead of waiting on timeouts.
+
+    After ``cooldown`` seconds a single trial request is let through; if it
+    succeeds the breaker closes again, otherwise it stays open for another
+    ``cooldown``\.
+
+    Parameters
+    ----------
+    threshold : float
+        Fraction of failed requests (within ``window`` seconds) at which the
+        breaker opens.
+    min_requests : int
+        The breaker won't open until at least this many requests have been
+        made within ``window``\.
+    window : float
+        Seconds.
+    cooldown : float
+        Seconds.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=0.5, min_requests=10, window=60., cooldown=30.):
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.open_until = 0.
+        self.outcomes = deque()    # (time, failed)
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a request should be made now.
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.time() < self.open_until:
+                    return False
+                self.state = self.HALF_OPEN
+                return True    # The caller makes the trial request.
+            return self.state == self.CLOSED
+
+    def retry_after(self):
+        return max(self.open_until - time.time(), 0.)
+
+    def record(self, failed):
+        """
+        Record the outcome of a request that was allowed.
+        """
+        with self.lock:
+            now = time.time()
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self.state, self.open_until = self.OPEN, now + self.cooldown
+                else:
+                    self.state = self.CLOSED
+                return
+
+            self.outcomes.append((now, failed))
+            while self.outcomes and self.outcomes[0][0] < now - self.window:
+                self.outcomes.popleft()
+            failures = sum(1 for _, failed in self.outcomes if failed)
+            if len(self.outcomes) >= self.min_requests \
+                    and float(failures) / len(self.outcomes) >= self.threshold:
+                logger.warning('Too many failed requests; not contacting'
+                               ' this source for %i seconds' % self.cooldown)
+                self.state, self.open_until = self.OPEN, now + self.cooldown
+                self.outcomes.clear()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(external_source):
+    """
+    Get the (process-wide) :class:`.CircuitBreaker` for an external source,
+    configured by ``CONTENT_BREAKER_THRESHOLD``\, ``CONTENT_BREAKER_MIN_REQUESTS``\,
+    ``CONTENT_BREAKER_WINDOW`` and ``CONTENT_BREAKER_COOLDOWN``\.
+    """
+    with _breakers_lock:
+        if external_source not in _breakers:
+            _breakers[external_source] = CircuitBreaker(
+                getattr(settings, 'CONTENT_BREAKER_THRESHOLD', 0.5),
+                getattr(settings, 'CONTENT_BREAKER_MIN_REQUESTS', 10),
+                getattr(settings, 'CONTENT_BREAKER_WINDOW', 60),
+                getattr(settings, 'CONTENT_BREAKER_COOLDOWN', 30))
+        return _breakers[external_source]
+
+
+def _failure_key(location):
+    return 'remote-content-failure:' + hashlib.sha1(force_bytes(location)).hexdigest()
+
+
+def fetch_remote_content(content_resource):
+    """
+    Retrieve the content for an external content resource from its source,
+    bypassing the content cache.
+
+    Requests are limited by the :class:`.SourceThrottle` for the source.
+    If the location failed within the last ``CONTENT_FAILURE_TTL`` seconds,
+    or the :class:`.CircuitBreaker` for the source is open, raises
+    :class:`.RemoteUnavailable` without making a request.
+    """
+    source, location = content_resource.external_source, content_resource.location
+    failure = failure_cache.get(_failure_key(location))
+    if failure is not None:
+        raise RemoteUnavailable('Retrieving %s failed recently: %s' % (location, failure),
+                                retry_after=getattr(settings, 'CONTENT_FAILURE_TTL', 60))
+    breaker = get_breaker(source)
+    if not breaker.allow():
+        raise RemoteUnavailable('%s is unavailable' % content_resource.get_external_source_display(),
+                                retry_after=breaker.retry_after())
+
+    failed = True
+    try:
+        remote = get_remote(source, content_resource.created_by)
+        with get_throttle(source):
+            content = remote.get(location)
+        failed = False
+    except Exception as E:
+        failure_cache.set(_failure_key(location), repr(E)[:500],
+                          getattr(settings, 'CONTENT_FAILURE_TTL', 60))
+        raise
+    finally:
+        breaker.record(failed)
+    return content
+
+
 def get_content(content_resource):
     """
     Retrieve the raw content for a content resource.
     """
     logger.debug('aggregate.get_content for %i' % content_resource.id)
     if content_resource.is_external:
-        content = cache.get(content_resource.location)
-        if content is None:
-            remote = get_remote(content_resource.external_source,
-                                content_resource.created_by)
-            try:
-                content = remote.get(content_resource.location)
-                if content is not None:
-                    cache.set(content_resource.location, content, None)
-            except Exception as E:
-                content = E
-                logger.debug('encounted exception while exporting %s: %s' % (str(content_resource), E.message))
+        try:
+            # Concurrent misses for the same location share a single fetch.
+            content = get_or_fetch(cache, content_resource.location,
+                                   lambda: fetch_remote_content(content_resource))
+        except Exception as E:
+            content = E
+            logger.debug('encounted exception while exporting %s: %s' % (str(content_resource), E.message))
         return content
     elif content_resource.file:
         with open(content_resource.file.path) as f:
@@ -99,116 +292,216 @@ def get_content(content_resource):
 
 def get_collection_containers(user, collection):
     """
-    Yield containers recursively for the supplied collection object.
+    Yield containers for the supplied collection object, and for all of the
+    (non-hidden) subcollections beneath it that ``user`` is allowed to view.
     """
+    # Hidden or unauthorized subcollections are pruned along with everything
+    #  beneath them. Sorting by path puts parents ahead of their children.
+    descendants = collection.descendants.exclude(pk=collection.id)
+    authorized = set(auth.apply_filter(CollectionAuthorization.VIEW, user,
+                                       descendants.filter(hidden=False))\
+                         .values_list('id', flat=True))
+    visible = {collection.id}
+    for pk, part_of_id in descendants.order_by('path').values_list('id', 'part_of_id'):
+        if part_of_id in visible and pk in authorized:
+            visible.add(pk)
+
     containers = auth.apply_filter(ResourceAuthorization.VIEW,
                                    user,
-                                   ResourceContainer.active.filter(part_of=collection.id))
-    for container in containers:
+                                   ResourceContainer.active.filter(part_of_id__in=visible))
+    for container in containers.order_by('part_of__path', 'id'):
         yield container
 
-    subcollections = auth.apply_filter(CollectionAuthorization.VIEW,
-                                       user,
-                                       Collection.objects.filter(part_of=collection.id,
-                                                                 hidden=False))
-    for subcollection in subcollections:
-        for container in get_collection_containers(user, subcollection):
-            yield container
 
+def get_dataset_containers(user, dataset):
+    """
+    Yield the containers in a :class:`.Dataset` that ``user`` is allowed to
+    view, including those in any of its collections.
+    """
+    if dataset.dataset_type == Dataset.EXPLICIT:
+        containers = auth.apply_filter(ResourceAuthorization.VIEW, user,
+                                       dataset.resources.all())
+        collections = Collection.objects.none()
+    else:
+        collections, containers = apply_dataset_filters(user, dataset.filter_parameters)
+    return chain(containers, (container for collection in collections
+                              for container in get_collection_containers(user, collection)))
+
+
+def metadata_rows(resources, batch_size=METADATA_BATCH_SIZE):
+    """
+    Generate rows for a metadata CSV (see ``METADATA_CSV_HEADER``), one per
+    relation from each resource.
+
+    Resources are processed in batches. For each batch the resources, their
+    relations, predicates, collections and creators are loaded in a fixed
+    number of queries, plus one query per type of relation target.
 
-def write_metadata_csv(filehandle, resource=None, write_header=False):
+    Parameters
+    ----------
+    resources : iterable
+        Should yield :class:`cookies.models.Resource` instances, or their ids.
+    batch_size : int
+
+    Returns
+    -------
+    generator
+        Yields lists of values in the order of ``METADATA_CSV_HEADER``\.
+    """
+    resources = iter(resources)
+    source_type = ContentType.objects.get_for_model(Resource)
+    while True:
+        batch = [getattr(resource, 'id', resource)
+                 for resource in islice(resources, batch_size)]
+        if not batch:
+            return
+
+        loaded = Resource.objects.filter(pk__in=batch)\
+                                 .select_related('entity_type__schema',
+                                                 'container__part_of',
+                                                 'created_by')\
+                                 .in_bulk()
+        relations = defaultdict(list)
+        qs = Relation.objects.filter(source_type=source_type,
+                                     source_instance_id__in=batch)\
+                             .select_related('predicate__schema')\
+                             .prefetch_related('target')
+        for relation in qs:
+            relations[relation.source_instance_id].append(relation)
+
+        for pk in batch:
+            resource = loaded.get(pk)
+            if resource is None:
+                continue
+            collection = resource.container.part_of if resource.container else None
+            for relation in relations[pk]:
+                row = {
+                    'resource_name'     : resource.name,
+                    'resource_uri'      : resource.uri,
+                    'resource_type'     : str(resource.entity_type),
+                    'resource_type_uri' : getattr(resource.entity_type, 'uri', None),
+                    'collection_name'   : getattr(collection, 'name', None),
+                    'collection_uri'    : getattr(collection, 'uri', None),
+                    'creator_name'      : getattr(resource.created_by, 'username', None),
+                    'creator_id'        : resource.created_by_id,
+                    'date_created'      : resource.created.isoformat(),
+                    'predicate'         : str(relation.predicate),
+                    'predicate_uri'     : relation.predicate.uri,
+                    'target'            : getattr(relation.target, "name", None),
+                    'target_uri'        : None
+                }
+                if relation.target and not isinstance(relation.target, Value):
+                    row['target_uri'] = relation.target.uri
+
+                yield [row[c] for c in METADATA_CSV_HEADER]
+
+
+def write_metadata_csv(filehandle, resource=None, write_header=False,
+                       resources=None):
+    """
+    Write metadata CSV rows for ``resource`` (or for each of ``resources``)
+    to ``filehandle``\. See :func:`.metadata_rows`\.
+    """
     writer = csv.writer(filehandle)
 
     if write_header:
         writer.writerow(METADATA_CSV_HEADER)
 
-    if not resource:
+    if resource is not None:
+        resources = [resource]
+    if not resources:
         return
+    writer.writerows(metadata_rows(resources))
 
-    for relation in resource.relations_from.all():
-        row = {
-            'resource_name'     : resource.name,
-            'resource_uri'      : resource.uri,
-            'resource_type'     : str(resource.entity_type),
-            'resource_type_uri' : resource.entity_type.uri,
-            'collection_name'   : resource.container.part_of.name,
-            'collection_uri'    : resource.container.part_of.uri,
-            'creator_name'      : resource.created_by.username,
-            'creator_id'        : resource.created_by_id,
-            'date_created'      : resource.created.isoformat(),
-            'predicate'         : str(relation.predicate),
-            'predicate_uri'     : relation.predicate.uri,
-            'target'            : getattr(relation.target, "name", None),
-            'target_uri'        : None
-        }
-        if relation.target and not isinstance(relation.target, Value):
-            row['target_uri'] = relation.target.uri
 
-        writer.writerow([row[c] for c in METADATA_CSV_HEADER])
+def _content_type_q(content_type):
+    """
+    Filter for :class:`.ContentRelation`\s matching ``content_type`` (a str or
+    a list), either on the relation or on the content resource itself.
+    """
+    if content_type is None or '__all__' in content_type:
+        return Q()
+    if not type(content_type) is list:
+        content_type = [content_type]
+    return Q(content_type__in=content_type) | Q(content_resource__content_type__in=content_type)
 
 
-def aggregate_content_resources_fast(container, content_type=None, part_uri='http://purl.org/dc/terms/isPartOf'):
-    return Resource.objects.filter(content_resource=True, container=container).order_by('parent__for_resource__relations_from_resource__sort_order')
+def _aggregate_batch(resources, content_type=None,
+                     part_uri='http://purl.org/dc/terms/isPartOf'):
+    """
+    Load the content for a batch of resources and all of their parts. Parts
+    are always in the same container as the resource of which they are a
+    part, so this takes two queries no matter how many parts there are.
 
+    Returns
+    -------
+    generator
+        Yields content :class:`cookies.models.Resource`\s: for each resource,
+        its own content followed by that of each of its parts (by
+        ``sort_order``), recursively.
+    """
+    container_ids = {resource.container_id for resource in resources}
+    relations = ContentRelation.objects.filter(container_id__in=container_ids,
+                                               is_deleted=False,
+                                               content_resource__content_resource=True)\
+                                       .filter(_content_type_q(content_type))\
+                                       .select_related('content_resource')\
+                                       .order_by('id')
+    content = defaultdict(list)
+    for relation in relations:
+        content[relation.for_resource_id].append(relation.content_resource)
+
+    resource_type = ContentType.objects.get_for_model(Resource)
+    parts = defaultdict(list)
+    for target_id, source_id in Relation.objects.filter(container_id__in=container_ids,
+                                                        predicate__uri=part_uri,
+                                                        source_type=resource_type,
+                                                        target_type=resource_type)\
+                                                .order_by('sort_order', 'id')\
+                                                .values_list('target_instance_id', 'source_instance_id'):
+        parts[target_id].append(source_id)
+
+    for resource in resources:
+        stack, seen = [resource.id], set()
+        while stack:
+            pk = stack.pop()
+            if pk in seen:    # Guard against isPartOf cycles.
+                continue
+            seen.add(pk)
+            for content_resource in content[pk]:
+                yield content_resource
+            stack.extend(reversed(parts[pk]))
 
 
 def aggregate_content_resources(queryset, content_type=None,
-                                part_uri='http://purl.org/dc/terms/isPartOf'):
+                                part_uri='http://purl.org/dc/terms/isPartOf',
+                                batch_size=100):
     """
     Given a queryset of :class:`cookies.models.Resource` instances, return a
     generator that yields associated :class:`cookies.models.ContentResource`
     instances.
+
+    Resources are processed in batches of ``batch_size``\, each of which
+    takes a constant number of queries (see :func:`._aggregate_batch`\).
     """
-    from cookies.models import Resource
     logger.debug('aggregate_content_resources:: with content type %s' % str(content_type))
-    # TODO: Ok, this was a nice little excercise with generators. But since we
-    #  already have content encapsulated with their uber-parent's container,
-    #  can we leverage that relation to cut down on database calls? This may not
-    #  matter so long as the rate-limiting factor is content-retrieval.
     queryset = iter(queryset)
-    current = None
-    current_parts = None
-    current_content = None
-    q = Q(predicate__uri=part_uri)
-    content_q = Q(content_resource=True)
-    content_q |= Q(content_resource__content_resource=True)
-    if content_type is not None and '__all__' not in content_type:
-        if not type(content_type) is list:
-            content_type = [content_type]
-
-        content_type_q = None
-        for ctype in content_type:
-            if not content_type_q:
-                content_type_q = Q(content_type=ctype)
-            else:
-                content_type_q |= Q(content_type=ctype)
-            content_type_q |= Q(content_resource__content_type=ctype)
-
-        content_q &= content_type_q
+    while True:
+        batch = list(islice(queryset, batch_size))
+        if not batch:
+            break
+        for content_resource in _aggregate_batch(batch, content_type, part_uri):
+            yield content_resource
 
-    def get_parts(resource):
-        return (o for rel in resource.relations_to.filter(q).order_by('sort_order')
-                    for o in chain((crel.content_resource for crel
-                                    in rel.source.content.filter(content_q)),
-                                   get_parts(rel.source)))
 
-    while True:
-        if current is None:
-            try:
-                current = queryset.next()
-                for crel in current.content.filter(content_q & Q(is_deleted=False)):
-                    yield crel.content_resource
-                current_content = get_parts(current)
-
-            except StopIteration:
-                break
-        try:
-            this = current_content.next()
-        except StopIteration:
-            current = None
-            continue
-        logging.debug('aggregate.aggregate_content_resources: current %s' % str(current))
-        yield this
+def aggregate_content_resources_fast(container, content_type=None,
+                                     part_uri='http://purl.org/dc/terms/isPartOf'):
+    """
+    All of the content for the primary resource in ``container``, in order.
+    """
+    if container.primary is None:
+        return []
+    return list(_aggregate_batch([container.primary], content_type, part_uri))
 
 
 def aggregate_content(queryset, proc=lambda content, rsrc: content, **kwargs):
@@ -235,7 +528,130 @@ def aggregate_content(queryset, proc=lambda content, rsrc: content, **kwargs):
         at a time.
     """
     aggregator = aggregate_content_resources(queryset, **kwargs)
-    return (proc(get_content(resource), resource) for resource in aggregator)
+    return (proc(content, resource) for content, resource in prefetch_content(aggregator))
+
+
+def prefetch_content(content_resources, workers=None):
+    """
+    Retrieve content for a sequence of content resources using a pool of
+    worker threads, so that up to ``workers`` items are fetched ahead of the
+    one being consumed.
+
+    Parameters
+    ----------
+    content_resources : iterable
+        Should yield :class:`cookies.models.Resource` instances.
+    workers : int
+        (optional) Defaults to ``settings.CONTENT_FETCH_WORKERS``\.
+
+    Returns
+    -------
+    generator
+        Yields ``(content, resource)`` tuples, in the same order as
+        ``content_resources``\. See :func:`.get_content`\.
+    """
+    if workers is None:
+        workers = getattr(settings, 'CONTENT_FETCH_WORKERS', 1)
+    if workers <= 1:
+        for resource in content_resources:
+            yield get_content(resource), resource
+        return
+
+    tasks = Queue.Queue()
+    cancelled = threading.Event()
+
+    def work():
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                resource, result = task
+                if cancelled.is_set():
+                    continue
+                try:
+                    result.put((get_content(resource), None))
+                except Exception:
+                    result.put((None, sys.exc_info()))
+        finally:
+            connection.close()    # Each thread has its own connection.
+
+    threads = [threading.Thread(target=work) for i in xrange(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = deque()
+    def next_result():
+        resource, result = pending.popleft()
+        content, exc_info = result.get()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return content, resource
+
+    try:
+        for resource in content_resources:
+            result = Queue.Queue(maxsize=1)
+            tasks.put((resource, result))
+            pending.append((resource, result))
+            if len(pending) > workers:
+                yield next_result()
+        while pending:
+            yield next_result()
+    finally:
+        cancelled.set()
+        for thread in threads:
+            tasks.put(None)
+
+def warm_collection(user, collection, workers=None, callback=None):
+    """
+    Fetch the external content for everything in ``collection`` (and the
+    subcollections that ``user`` can see) that isn't already in the content
+    cache, so that later exports and page views are served from disk.
+
+    Requests to each external source are limited by its
+    :class:`.SourceThrottle` (see :func:`.get_throttle`\).
+
+    Parameters
+    ----------
+    user : :class:`django.contrib.auth.models.User`
+    collection : :class:`.Collection`
+    workers : int
+        (optional) Number of concurrent fetches. Defaults to
+        ``settings.CONTENT_FETCH_WORKERS``\.
+    callback : callable
+        (optional) Called with ``(done, total)`` after each fetch.
+
+    Returns
+    -------
+    dict
+        Number of content resources found (``total``), already ``cached``,
+        ``fetched``, and ``failed``\.
+    """
+    primaries = (container.primary for container
+                 in get_collection_containers(user, collection)
+                 if container.primary_id)
+    total, uncached, seen = 0, [], set()
+    for resource in aggregate_content_resources(primaries):
+        if not (resource.is_external and resource.location) \
+                or resource.location in seen:
+            continue
+        seen.add(resource.location)
+        total += 1
+        if not cache.has_key(resource.location):
+            uncached.append(resource)
+
+    result = {'total': total, 'cached': total - len(uncached),
+              'fetched': 0, 'failed': 0}
+    for i, (content, resource) in enumerate(prefetch_content(uncached, workers)):
+        if content is None or isinstance(content, Exception):
+            result['failed'] += 1
+        else:
+            result['fetched'] += 1
+        if callback is not None:
+            callback(i + 1, len(uncached))
+    return result
+
 
 def aggregate_part_resources(queryset):
     part_uri = 'http://purl.org/dc/terms/isPartOf'
@@ -270,78 +686,204 @@ def manifest(log):
            "Finished at at %s" % timezone.now().strftime('%Y-%m-%d at %H:%m:%s')
 
 
-def export_zip(queryset, target_path, fname=get_filename, **kwargs):
+def spooled_file():
     """
-    Stream content into a zip archive at ``target_path``.
+    A temporary file for side files (e.g. ``index.csv``) that are built up
+    during an export. It stays in memory until it grows beyond
+    ``settings.EXPORT_SPOOL_MAX_SIZE`` bytes, and is then moved to disk.
     """
-    logger.debug('aggregate.export_zip: target: %s' % (target_path))
-    if not target_path.endswith('.zip'):
-        target_path += '.zip'
+    return tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE,
+                                         dir=settings.EXPORT_SPOOL_DIR)
 
+
+def iter_file(fileobj, chunk_size=64 * 1024):
+    """
+    Rewind ``fileobj`` and read it in chunks.
+    """
+    fileobj.seek(0)
+    return iter(lambda: fileobj.read(chunk_size), '')
+
+
+def _open_target(target):
+    """
+    ``target`` may be a path (``.zip`` is appended if necessary) or a
+    file-like object. Returns ``(target, fileobj)``\.
+    """
+    if isinstance(target, basestring):
+        if not target.endswith('.zip'):
+            target += '.zip'
+        return target, open(target, 'wb')
+    return target, target
+
+
+def _write_export_zip(archive, queryset, fname=get_filename, **kwargs):
+    """
+    Write content (and the index, manifest, and optionally metadata) into a
+    :class:`.ZipStream`\. This is a generator that yields after each entry
+    is written, so that the caller can pass on the archive as it grows.
+    """
     has_metadata = kwargs.pop('has_metadata', False)
     proc = kwargs.pop('proc', lambda content, resource: content)
-    export_proc = lambda content, resource: (content, resource)
     base = 'amphora/'
     log = []
-    index = cStringIO.StringIO()
-    metadata = cStringIO.StringIO()
-    index_writer = csv.writer(index)
-    index_writer.writerow(['ID', 'Name', 'PrimaryID', 'PrimaryURI', 'PrimaryName', 'Location', 'CollectionID', 'CollectionName'])
-
-    # Write header only
-    write_metadata_csv(metadata, resource=None, write_header=True)
-
-    files_in_zip = set()
-    with zipfile.ZipFile(target_path, 'w', allowZip64=True) as target:
-        for queryset_resource in queryset:
-            for content, resource in aggregate_content([queryset_resource], proc=export_proc, **kwargs):
-                if content is None:
-                    log.append('No content for resource %i (%s)' % (resource.id, resource.name))
-                elif isinstance(content, Exception):
-                    log.append('Encountered exception while retrieving content for: ')
-                    log.append(resource.id)
-                    log.append(resource.name)
-                    log.append(content.message)
-                else:
-                    filepath = fname(resource)
-                    if filepath in files_in_zip:
-                        filename, ext = os.path.splitext(os.path.basename(filepath))
-                        filepath = os.path.join(os.path.dirname(filepath),
-                                                '{}_{}{}'.format(filename,
-                                                                 resource.id,
-                                                                 ext))
-                    files_in_zip.add(filepath)
-                    target.writestr(base + filepath, content)
-                    index_writer.writerow([resource.id, resource.name,
-                                           resource.container.primary.id,
-                                           resource.container.primary.uri,
-                                           resource.container.primary.name,
-                                           filepath,
-                                           resource.container.part_of.id,
-                                           get_collection_name(resource, concat_fn=posixpath.join),
-                                          ])
-                    write_metadata_csv(metadata, resource, write_header=False)
-
-            #if has_metadata:
-            #    for resource in aggregate_part_resources([queryset_resource]):
-            #        write_metadata_csv(metadata, resource, write_header=False)
-
-        target.writestr(base + 'MANIFEST.txt', manifest(log))
-        target.writestr(base + 'index.csv', index.getvalue())
+    index = spooled_file()
+    metadata = spooled_file()
+    try:
+        index_writer = csv.writer(index)
+        index_writer.writerow(['ID', 'Name', 'PrimaryID', 'PrimaryURI', 'PrimaryName', 'Location', 'CollectionID', 'CollectionName'])
         if has_metadata:
-            target.writestr(base + 'metadata.csv', metadata.getvalue())
-
+            write_metadata_csv(metadata, write_header=True)
+
+        files_in_zip = set()
+        exported = []    # Ids awaiting metadata; written a batch at a time.
+        content_resources = aggregate_content_resources(queryset, **kwargs)
+        for content, resource in prefetch_content(content_resources):
+            if content is None:
+                log.append('No content for resource %i (%s)' % (resource.id, resource.name))
+            elif isinstance(content, Exception):
+                log.append('Encountered exception while retrieving content for: ')
+                log.append(resource.id)
+                log.append(resource.name)
+                log.append(content.message)
+            else:
+                filepath = fname(resource)
+                if filepath in files_in_zip:
+                    filename, ext = os.path.splitext(os.path.basename(filepath))
+                    filepath = os.path.join(os.path.dirname(filepath),
+                                            '{}_{}{}'.format(filename,
+                                                             resource.id,
+                                                             ext))
+                files_in_zip.add(filepath)
+                archive.writestr(base + filepath, content)
+                index_writer.writerow([resource.id, resource.name,
+                                       resource.container.primary.id,
+                                       resource.container.primary.uri,
+                                       resource.container.primary.name,
+                                       filepath,
+                                       resource.container.part_of.id,
+                                       get_collection_name(resource, concat_fn=posixpath.join),
+                                      ])
+                if has_metadata:
+                    exported.append(resource.id)
+                    if len(exported) >= METADATA_BATCH_SIZE:
+                        write_metadata_csv(metadata, resources=exported)
+                        exported = []
+                yield
+
+        archive.writestr(base + 'MANIFEST.txt', manifest(log))
+        yield
+        archive.write_iter(base + 'index.csv', iter_file(index))
+        yield
+        if has_metadata:
+            write_metadata_csv(metadata, resources=exported)
+            archive.write_iter(base + 'metadata.csv', iter_file(metadata))
+            yield
+    finally:
+        # Also if the client goes away before the archive is finished.
         metadata.close()
         index.close()
+
+
+def export_zip(queryset, target_path, fname=get_filename, **kwargs):
+    """
+    Stream content into a zip archive at ``target_path``.
+
+    ``target_path`` may also be a writable file-like object (e.g. a file
+    opened from a storage backend), which need not be seekable.
+    """
+    logger.debug('aggregate.export_zip: target: %s' % (target_path))
+    target_path, fileobj = _open_target(target_path)
+    try:
+        with ZipStream(fileobj) as archive:
+            for _ in _write_export_zip(archive, queryset, fname=fname, **kwargs):
+                pass
+    finally:
+        if fileobj is not target_path:
+            fileobj.close()
     return target_path
 
+
+def stream_zip(queryset, fname=get_filename, has_content=True, **kwargs):
+    """
+    Generate a zip archive of content on the fly, e.g. for a
+    :class:`django.http.StreamingHttpResponse`\. Only one content item is held
+    in memory at a time.
+
+    Parameters
+    ----------
+    queryset : iterable
+        Should yield :class:`cookies.models.Resource` instances.
+    fname : callable
+        See :func:`.export_zip`\.
+    has_content : bool
+        If False, the archive only contains metadata (as with
+        :func:`.export_metadata`\).
+    kwargs : kwargs
+        See :func:`.export_zip`\.
+
+    Returns
+    -------
+    generator
+        Yields chunks of the archive (str).
+    """
+    buffer = ChunkBuffer()
+    archive = ZipStream(buffer)
+    if has_content:
+        entries = _write_export_zip(archive, queryset, fname=fname, **kwargs)
+    else:
+        entries = _write_metadata_zip(archive, queryset)
+    try:
+        for _ in entries:
+            yield buffer.drain()
+    finally:
+        entries.close()
+    archive.close()
+    yield buffer.drain()
+
 def get_collection_name(resource, concat_fn=os.path.join):
-    def recursive_collection_name(collection):
-        if not collection:
+    collection = resource.container.part_of
+    if not collection:
+        return ''
+    ancestor_ids = collection.ancestor_ids
+    names = dict(Collection.objects.filter(pk__in=ancestor_ids).values_list('id', 'name'))
+    return reduce(concat_fn, [names[pk] for pk in ancestor_ids], '')
+
+def collection_structure_filename(resource):
+    """
+    Path within an archive based on the collection(s) to which ``resource``
+    belongs.
+    """
+    return os.path.join(get_collection_name(resource), get_filename(resource))
+
+
+def resource_structure_filename(resource):
+    """
+    Path within an archive based on the resources of which ``resource`` is a
+    part.
+    """
+    def get_parent_resource(collection):
+        if resource is None:
             return ''
-        return concat_fn(recursive_collection_name(collection.part_of),
-                         collection.name)
-    return recursive_collection_name(resource.container.part_of)
+        part_of = resource.relations_from.filter(predicate__uri='http://purl.org/dc/terms/isPartOf').first()
+        if part_of:
+            return get_parent_resource(part_of.target) + '/' + str(resource.id)
+        return str(resource.id)
+
+    filename = get_filename(resource)
+
+    name = get_parent_resource(resource) + '/' + filename
+    if name.startswith('/'):
+        name = name[1:]
+    return name
+
+
+EXPORT_STRUCTURES = {
+    'flat': get_filename,
+    'collection': collection_structure_filename,
+    'parts': resource_structure_filename,
+}
+"""Archive path functions for each export structure option."""
+
 
 def export_with_collection_structure(queryset, target_path, **kwargs):
     """
@@ -349,8 +891,8 @@ def export_with_collection_structure(queryset, target_path, **kwargs):
     collection structure. Collection names are used to build file paths within
     the archive.
     """
-    fname = lambda r: os.path.join(get_collection_name(r), get_filename(r))
-    return export_zip(queryset, target_path, fname=fname, **kwargs)
+    return export_zip(queryset, target_path,
+                      fname=collection_structure_filename, **kwargs)
 
 
 def export_with_resource_structure(queryset, target_path, **kwargs):
@@ -359,41 +901,36 @@ def export_with_resource_structure(queryset, target_path, **kwargs):
     resource structure. Resource relations are used to build file paths within
     the archive.
     """
-
-    def recursive_filename(resource):
-        def get_parent_resource(collection):
-            if resource is None:
-                return ''
-            part_of = resource.relations_from.filter(predicate__uri='http://purl.org/dc/terms/isPartOf').first()
-            if part_of:
-                return get_parent_resource(part_of.target) + '/' + str(resource.id)
-            return str(resource.id)
-
-        filename = get_filename(resource)
-
-        name = get_parent_resource(resource) + '/' + filename
-        if name.startswith('/'):
-            name = name[1:]
-        return name
-    return export_zip(queryset, target_path, fname=recursive_filename, **kwargs)
+    return export_zip(queryset, target_path,
+                      fname=resource_structure_filename, **kwargs)
 
 def export_metadata(queryset, target_path):
     """
-    Stream metadata into a zip archive at ``target_path``.
+    Stream metadata into a zip archive at ``target_path`` (a path or a
+    writable file-like object).
     """
     logger.debug('aggregate.export_metadata: target: %s' % (target_path))
-    if not target_path.endswith('.zip'):
-        target_path += '.zip'
+    target_path, fileobj = _open_target(target_path)
+    try:
+        with ZipStream(fileobj) as archive:
+            for _ in _write_metadata_zip(archive, queryset):
+                pass
+    finally:
+        if fileobj is not target_path:
+            fileobj.close()
+    return target_path
 
-    aggregator = aggregate_part_resources(queryset)
 
-    base = 'amphora/'
-    log = []
-    metadata = cStringIO.StringIO()
-    with zipfile.ZipFile(target_path, 'w', allowZip64=True) as target:
-        write_metadata_csv(metadata, aggregator.next(), write_header=True)
-        for resource in aggregator:
-            write_metadata_csv(metadata, resource, write_header=False)
-        target.writestr(base + 'metadata.csv', metadata.getvalue())
+def _write_metadata_zip(archive, queryset):
+    """
+    Write metadata for ``queryset`` and its parts into a :class:`.ZipStream`\.
+    Yields once the entry is written, like :func:`._write_export_zip`\.
+    """
+    metadata = spooled_file()
+    try:
+        write_metadata_csv(metadata, write_header=True,
+                           resources=aggregate_part_resources(queryset))
+        archive.write_iter('amphora/metadata.csv', iter_file(metadata))
+        yield
+    finally:
         metadata.close()
-    return target_path
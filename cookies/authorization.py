@@ -2,6 +2,7 @@ from functools import wraps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from django.http import HttpResponseForbidden
 from django.utils.decorators import available_attrs
@@ -58,6 +59,15 @@ def _get_auth_model(obj):
         return CollectionAuthorization
 
 
+def _effective_target(obj):
+    """
+    Lookup kwargs for the :class:`.EffectiveAuthorization` records of ``obj``.
+    """
+    if isinstance(obj, ResourceContainer):
+        return {'for_container': obj}
+    return {'for_collection': obj}
+
+
 def allowed(auth, user, obj):
     auth_model = _get_auth_model(obj)
     return auth_model.objects.filter(
@@ -94,10 +104,49 @@ def anonymous_is_denied(auth, user, obj):
         policy=auth_model.DENY).count() > 0
 
 
+def effective_authorization(auth, user, obj):
+    """
+    Look up the materialized outcome of the policies that apply to ``user``
+    for ``auth`` on ``obj``. Ownership and superuser status are not taken into
+    account here; see :func:`.check_authorization`\.
+
+    Parameters
+    ----------
+    auth : str
+    user : :class:`.User`
+    obj : :class:`.ResourceContainer` or :class:`.Collection`
+
+    Returns
+    -------
+    bool
+    """
+    qs = EffectiveAuthorization.objects.filter(_principal_q(user), action=auth,
+                                               **_effective_target(obj))
+    records = list(qs.values_list('granted_to_id', 'policy'))
+    for granted_to_id, policy in records:
+        if granted_to_id is not None:    # User-specific records take precedence.
+            return policy == EffectiveAuthorization.ALLOW
+    return len(records) > 0
+
+
+def _principal_q(user):
+    """
+    Selects the :class:`.EffectiveAuthorization` records that may apply to
+    ``user``\.
+    """
+    if isinstance(user, AnonymousUser):
+        return Q(granted_to__isnull=True, anonymous=True)
+    return Q(granted_to=user.id) | Q(granted_to__isnull=True, anonymous=False)
+
+
 def check_authorization(auth, user, obj):
     """
     Check whether ``user`` is authorized to perform ``auth`` on ``obj``.
 
+    Policies on ``obj`` and on all of the collections of which it is a part
+    are resolved ahead of time into :class:`.EffectiveAuthorization` records,
+    so this requires at most a single query.
+
     Parameters
     ----------
     auth : str
@@ -120,17 +169,255 @@ def check_authorization(auth, user, obj):
 
     if not isinstance(obj, ResourceContainer) and not isinstance(obj, Collection):
         obj = obj.container
+        if obj is None:
+            return False
+    return effective_authorization(auth, user, obj)
 
-    if isinstance(user, AnonymousUser):
-        _allow = anonymous_is_allowed(auth, user, obj)
-        _deny = anonymous_is_denied(auth, user, obj)
+
+def check_many(auth, user, objs):
+    """
+    Check whether ``user`` is authorized to perform ``auth`` on each of
+    ``objs``\, using a single query.
+
+    Use this instead of calling :func:`.check_authorization` for each item in
+    a list (e.g. a page of API results).
+
+    Parameters
+    ----------
+    auth : str
+    user : :class:`.User`
+    objs : iterable
+        Model instances; usually :class:`.Resource`\, :class:`.ResourceContainer`
+        or :class:`.Collection`\.
+
+    Returns
+    -------
+    dict
+        Maps each object in ``objs`` onto a bool.
+    """
+    objs = [obj for obj in objs if obj]
+    if auth == 'is_owner':
+        return {obj: is_owner(user, obj) for obj in objs}
+    if user.is_superuser:
+        return {obj: True for obj in objs}
+
+    results = {}
+    targets = {}
+    for obj in objs:
+        if user.id is not None and getattr(obj, 'created_by_id', None) == user.id:
+            results[obj] = True
+        elif isinstance(obj, Collection):
+            targets[obj] = ('for_collection_id', obj.id)
+        elif isinstance(obj, ResourceContainer):
+            targets[obj] = ('for_container_id', obj.id)
+        elif getattr(obj, 'container_id', None) is not None:
+            targets[obj] = ('for_container_id', obj.container_id)
+        else:
+            results[obj] = False
+
+    if not targets:
+        return results
+
+    container_ids = {pk for field, pk in targets.values() if field == 'for_container_id'}
+    collection_ids = {pk for field, pk in targets.values() if field == 'for_collection_id'}
+    fields = ('for_container_id', 'for_collection_id', 'granted_to_id', 'policy')
+    qs = EffectiveAuthorization.objects.filter(_principal_q(user), action=auth)\
+            .filter(Q(for_container_id__in=container_ids) | Q(for_collection_id__in=collection_ids))
+
+    specific = {}
+    default = set()
+    for container_id, collection_id, granted_to_id, policy in qs.values_list(*fields):
+        key = ('for_container_id', container_id) if container_id is not None \
+              else ('for_collection_id', collection_id)
+        if granted_to_id is not None:
+            specific[key] = policy == EffectiveAuthorization.ALLOW
+        else:
+            default.add(key)
+
+    for obj, key in targets.items():
+        results[obj] = specific.get(key, key in default)
+    return results
+
+
+# Every action that may be checked against a container or a collection. Since
+#  checks on a container fall through to its collection using the same action
+#  code, we resolve all of them for both kinds of objects.
+EFFECTIVE_ACTIONS = tuple(sorted(set(AUTHORIZATIONS_MAP.values())))
+
+
+def _compute_effective_state(policies, owner_id, parent_state):
+    """
+    Resolve the policies on a single object, given the resolved state of the
+    collection of which it is a part.
+
+    A user is authorized if they own the object, or if they (or everyone) are
+    allowed on the object or on its parent, and they are not denied on the
+    object itself. Anonymous users are treated the same way, except that only
+    public policies apply to them.
+
+    Parameters
+    ----------
+    policies : list
+        ``(action, granted_to_id, policy)`` tuples for the object.
+    owner_id : int or None
+    parent_state : dict
+        State of the parent collection, as returned by this function.
+
+    Returns
+    -------
+    dict
+        Keys are actions, values are ``(users, authenticated, anonymous)``,
+        where ``users`` maps user ids onto the outcome for those users where
+        it differs from the outcome for authenticated users in general.
+    """
+    state = {}
+    for action in EFFECTIVE_ACTIONS:
+        p_users, p_authenticated, p_anonymous = parent_state.get(action, ({}, False, False))
+        allows = {granted_to for _action, granted_to, policy in policies
+                  if _action == action and policy == ResourceAuthorization.ALLOW}
+        denies = {granted_to for _action, granted_to, policy in policies
+                  if _action == action and policy == ResourceAuthorization.DENY}
+        public = None in allows
+        authenticated = public or p_authenticated
+        anonymous = (public or p_anonymous) and None not in denies
+
+        users = {}
+        candidates = (set(p_users) | allows | denies | {owner_id}) - {None}
+        for user_id in candidates:
+            if user_id == owner_id:
+                outcome = True
+            else:
+                outcome = (user_id in allows or public or p_users.get(user_id, p_authenticated)) \
+                          and user_id not in denies
+            if outcome != authenticated:
+                users[user_id] = outcome
+        state[action] = (users, authenticated, anonymous)
+    return state
+
+
+def _load_effective_state(obj):
+    """
+    Reconstruct the resolved state of ``obj`` from its
+    :class:`.EffectiveAuthorization` records.
+    """
+    state = {}
+    if obj is None:
+        return state
+    fields = ('action', 'granted_to_id', 'anonymous', 'policy')
+    qs = EffectiveAuthorization.objects.filter(**_effective_target(obj))
+    for action, granted_to_id, anonymous, policy in qs.values_list(*fields):
+        users, authenticated, is_anonymous = state.get(action, ({}, False, False))
+        if granted_to_id is not None:
+            users[granted_to_id] = policy == EffectiveAuthorization.ALLOW
+        elif anonymous:
+            is_anonymous = True
+        else:
+            authenticated = True
+        state[action] = (users, authenticated, is_anonymous)
+    return state
+
+
+def _effective_records(state, **target):
+    records = []
+    for action, (users, authenticated, anonymous) in state.items():
+        base = dict(action=action, **target)
+        if authenticated:
+            records.append(EffectiveAuthorization(policy=EffectiveAuthorization.ALLOW, **base))
+        if anonymous:
+            records.append(EffectiveAuthorization(policy=EffectiveAuthorization.ALLOW, anonymous=True, **base))
+        for user_id, outcome in users.items():
+            policy = EffectiveAuthorization.ALLOW if outcome else EffectiveAuthorization.DENY
+            records.append(EffectiveAuthorization(granted_to_id=user_id, policy=policy, **base))
+    return records
+
+
+def _update_containers(containers, parent_state):
+    """
+    Resolve and store policies for a set of sibling containers.
+
+    Parameters
+    ----------
+    containers : list
+        ``(id, created_by_id)`` tuples.
+    parent_state : dict
+    """
+    if not containers:
+        return
+    container_ids = [pk for pk, _ in containers]
+    policies = defaultdict(list)
+    fields = ('for_resource_id', 'action', 'granted_to_id', 'policy')
+    qs = ResourceAuthorization.objects.filter(for_resource_id__in=container_ids)
+    for container_id, action, granted_to_id, policy in qs.values_list(*fields):
+        policies[container_id].append((action, granted_to_id, policy))
+
+    records = []
+    for container_id, owner_id in containers:
+        state = _compute_effective_state(policies[container_id], owner_id, parent_state)
+        records += _effective_records(state, for_container_id=container_id)
+
+    EffectiveAuthorization.objects.filter(for_container_id__in=container_ids).delete()
+    EffectiveAuthorization.objects.bulk_create(records)
+
+
+def _update_collection(collection_id, owner_id, parent_state, recursive=True):
+    fields = ('action', 'granted_to_id', 'policy')
+    policies = CollectionAuthorization.objects.filter(for_resource_id=collection_id)\
+                                              .values_list(*fields)
+    state = _compute_effective_state(list(policies), owner_id, parent_state)
+    EffectiveAuthorization.objects.filter(for_collection_id=collection_id).delete()
+    EffectiveAuthorization.objects.bulk_create(_effective_records(state, for_collection_id=collection_id))
+    if not recursive:
+        return
+
+    containers = ResourceContainer.objects.filter(part_of_id=collection_id)\
+                                          .values_list('id', 'created_by_id')
+    _update_containers(list(containers), state)
+
+    subcollections = Collection.objects.filter(part_of_id=collection_id)\
+                                       .values_list('id', 'created_by_id')
+    for subcollection_id, subcollection_owner_id in subcollections:
+        _update_collection(subcollection_id, subcollection_owner_id, state)
+
+
+def update_effective_authorizations(obj, recursive=True):
+    """
+    Re-resolve the policies that apply to ``obj``, and store the outcome as
+    :class:`.EffectiveAuthorization` records.
+
+    Should be called whenever the policies on ``obj`` change, or ``obj`` is
+    moved to a different collection.
+
+    Parameters
+    ----------
+    obj : :class:`.ResourceContainer` or :class:`.Collection`
+    recursive : bool
+        If ``True`` (default) and ``obj`` is a :class:`.Collection`\, all of
+        the containers and collections beneath it are updated as well.
+    """
+    parent_state = _load_effective_state(obj.part_of)
+    if isinstance(obj, ResourceContainer):
+        _update_containers([(obj.id, obj.created_by_id)], parent_state)
     else:
-        _allow = allowed(auth, user, obj) or anonymous_is_allowed(auth, user, obj)
-        _deny = denied(auth, user, obj)
+        _update_collection(obj.id, obj.created_by_id, parent_state,
+                           recursive=recursive)
+
+
+@transaction.atomic
+def rebuild_effective_authorizations():
+    """
+    Discard and re-resolve all :class:`.EffectiveAuthorization` records.
+    """
+    EffectiveAuthorization.objects.all().delete()
+    roots = Collection.objects.filter(part_of__isnull=True)\
+                              .values_list('id', 'created_by_id')
+    for collection_id, owner_id in roots:
+        _update_collection(collection_id, owner_id, {})
 
-    if obj.part_of is not None:
-        _allow = _allow or check_authorization(auth, user, obj.part_of)
-    return _allow and not _deny
+    orphans = ResourceContainer.objects.filter(part_of__isnull=True)\
+                                       .values_list('id', 'created_by_id')
+    orphans = list(orphans)
+    for i in xrange(0, len(orphans), 500):
+        _update_containers(orphans[i:i + 500], {})
 
 
 def auth_model_for_obj(klass):
@@ -139,42 +426,63 @@ def auth_model_for_obj(klass):
     return ResourceAuthorization
 
 
+def _authorized_q(auth, user, lookup, target_field):
+    """
+    Build a semi-join on :class:`.EffectiveAuthorization` that selects objects
+    on which ``user`` is authorized to perform ``auth``\.
+
+    Parameters
+    ----------
+    auth : str
+    user : :class:`.User`
+    lookup : str
+        Field on the filtered model that refers to the container or collection,
+        e.g. ``'pk'`` or ``'container'``.
+    target_field : str
+        Either ``'for_container_id'`` or ``'for_collection_id'``.
+
+    Returns
+    -------
+    :class:`django.db.models.Q`
+    """
+    records = EffectiveAuthorization.objects.filter(**{
+        'action': auth,
+        target_field + '__isnull': False,    # NULLs would spoil NOT IN.
+    })
+    _in = lambda qs: Q(**{lookup + '__in': qs.values(target_field)})
+    if isinstance(user, AnonymousUser):
+        return _in(records.filter(granted_to__isnull=True, anonymous=True))
+
+    allow = records.filter(granted_to=user.id, policy=EffectiveAuthorization.ALLOW)
+    deny = records.filter(granted_to=user.id, policy=EffectiveAuthorization.DENY)
+    default = records.filter(granted_to__isnull=True, anonymous=False)
+    return _in(allow) | (_in(default) & ~_in(deny))
+
+
 def apply_filter(auth, user, qs):
     """
     Filter a :class:`.QuerySet` using registered authorization policies.
 
-    The presence of a DENY policy will override any ALLOW policies.
-
-    Heritable policies on a Collection will override policies on constitutent
-    resources. (TODO: Is that what we want? Maybe the opposite?)
+    This agrees with :func:`.check_authorization`\: policies are resolved
+    along the whole ``part_of`` chain, and a DENY policy on an object
+    overrides any ALLOW policies that it inherits. The filter is expressed as
+    semi-joins on :class:`.EffectiveAuthorization`\, so it does not duplicate
+    rows in ``qs``\.
     """
     if user.is_superuser:    # Superusers can see _everything_. Spoooooky.
         return qs
 
-    if qs.model is Collection:
-        public = dict(authorizations__action=auth, authorizations__granted_to__isnull=True, authorizations__policy=ResourceAuthorization.ALLOW)
-        if isinstance(user, AnonymousUser):
-            allow = public
-            deny = dict(authorizations__action=auth, authorizations__granted_to__isnull=True, authorizations__policy=ResourceAuthorization.DENY)
-        else:
-            allow = dict(authorizations__action=auth, authorizations__granted_to=user.id, authorizations__policy=ResourceAuthorization.ALLOW)
-            deny = dict(authorizations__action=auth, authorizations__granted_to=user.id, authorizations__policy=ResourceAuthorization.DENY)
-
-        q = Q(created_by=user.id) | ((Q(**public) | Q(**allow)) & ~Q(**deny))
+    if qs.model is GilesUpload:
+        return qs.filter(created_by=user.id)
+    elif qs.model is Collection:
+        q = _authorized_q(auth, user, 'pk', 'for_collection_id')
     elif qs.model is ResourceContainer:
-        q = Q(created_by=user.id) | \
-            ((Q(authorizations__action=auth, authorizations__granted_to=user.id, authorizations__policy=ResourceAuthorization.ALLOW) \
-              | Q(part_of__authorizations__action=auth, part_of__authorizations__granted_to=user.id, part_of__authorizations__policy=ResourceAuthorization.ALLOW, part_of__authorizations__heritable=True)) \
-             & ~(Q(authorizations__action=auth, authorizations__granted_to=user.id, authorizations__policy=ResourceAuthorization.DENY) \
-                 | Q(part_of__authorizations__action=auth, part_of__authorizations__granted_to=user.id, part_of__authorizations__policy=ResourceAuthorization.DENY, part_of__authorizations__heritable=True)))
-    elif qs.model is GilesUpload:
-        q = Q(created_by=user.id)
+        q = _authorized_q(auth, user, 'pk', 'for_container_id')
     else:
-        q = Q(created_by=user.id) | \
-            ((Q(container__authorizations__action=auth, container__authorizations__granted_to=user.id, container__authorizations__policy=ResourceAuthorization.ALLOW) \
-              | Q(container__part_of__authorizations__action=auth, container__part_of__authorizations__granted_to=user.id, container__part_of__authorizations__policy=ResourceAuthorization.ALLOW, container__part_of__authorizations__heritable=True)) \
-             & ~(Q(container__authorizations__action=auth, container__authorizations__granted_to=user.id, container__authorizations__policy=ResourceAuthorization.DENY) \
-                 | Q(container__part_of__authorizations__action=auth, container__part_of__authorizations__granted_to=user.id, container__part_of__authorizations__policy=ResourceAuthorization.DENY, container__part_of__authorizations__heritable=True)))
+        q = _authorized_q(auth, user, 'container', 'for_container_id')
+
+    if user.id is not None:
+        q |= Q(created_by=user.id)
     return qs.filter(q)
 
 
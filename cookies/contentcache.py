@@ -0,0 +1,587 @@
+"""
+Cache backend for remote content (page images, PDFs, plain text).
+
+:class:`.TieredContentCache` keeps a small, size-bounded LRU in process memory
+in front of a content-addressed store on disk. Each entry is a plain file
+named by the SHA-256 hash of its key, so it can be served directly (e.g. by
+path via X-Accel-Redirect, or memory-mapped) instead of being copied through
+the database.
+
+Configure it in ``CACHES``:
+
+.. code-block:: python
+
+   'remote_content': {
+       'BACKEND': 'cookies.contentcache.TieredContentCache',
+       'LOCATION': '/var/cache/amphora/content',
+       'TIMEOUT': None,
+       'OPTIONS': {
+           'MAX_SIZE': 10 * 1024 ** 3,              # Bytes on disk.
+           'MEMORY_MAX_SIZE': 64 * 1024 ** 2,       # Bytes in memory.
+           'MEMORY_MAX_ITEM_SIZE': 1024 ** 2,
+           'EVICTION_POLICY': 'lru',                # Or 'lfu'.
+           'LOCK_TIMEOUT': 60,                      # Seconds.
+       },
+   }
+
+Only byte strings can be stored. Content at a location doesn't change, so
+entries don't expire; the cache is bounded by size instead.
+
+The size, hit count and last access time of each entry, along with overall
+hit and miss counts, are tracked in a small SQLite index alongside the
+entries (see :class:`._Index`). That index is used to choose entries for
+eviction, and by the ``content_cache`` management command.
+
+Use :meth:`.TieredContentCache.get_or_fetch` (or :func:`.get_or_fetch`\, which
+also works with other backends) to fill the cache on a miss: concurrent
+misses for the same key, in this process or in another process sharing the
+cache directory, wait for a single fetch rather than each going upstream.
+"""
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.files.move import file_move_safe
+from django.utils.encoding import force_bytes
+
+from collections import OrderedDict
+import errno, fcntl, hashlib, io, mmap, os, shutil, sqlite3, tempfile, threading, time
+
+
+class _MemoryLRU(object):
+    """
+    Thread-safe least-recently-used mapping, bounded by the total size (in
+    bytes) of its values.
+    """
+    def __init__(self, max_size, max_item_size):
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value    # Most recently used goes last.
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_item_size:
+            self.delete(key)
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+class _Index(object):
+    """
+    Accounting for the entries in a :class:`.TieredContentCache`\, kept in
+    SQLite so that it can be shared by all of the processes using the same
+    cache directory.
+
+    Hits are counted in memory and written out in batches (see
+    :meth:`.flush`), so that reads don't each require a write.
+    """
+    FLUSH_EVERY = 100       # Operations.
+    FLUSH_INTERVAL = 30     # Seconds.
+
+    POLICIES = {
+        'lru': 'accessed ASC',
+        'lfu': 'hits ASC, accessed ASC',
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._misses = 0
+        self._pending = 0
+        self._last_flush = time.time()
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                       ' digest TEXT PRIMARY KEY, key TEXT, size INTEGER,'
+                       ' hits INTEGER DEFAULT 0, accessed REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS stats ('
+                       ' name TEXT PRIMARY KEY, value INTEGER)')
+            self._local.db = db
+        return db
+
+    def hit(self, digest):
+        with self._lock:
+            self._hits[digest] = self._hits.get(digest, 0) + 1
+            self._pending += 1
+        self._maybe_flush()
+
+    def miss(self):
+        with self._lock:
+            self._misses += 1
+            self._pending += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self._pending >= self.FLUSH_EVERY \
+                or time.time() - self._last_flush > self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out buffered hit and miss counts.
+        """
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            self._hits, self._misses, self._pending = {}, 0, 0
+            self._last_flush = time.time()
+        if not hits and not misses:
+            return
+        now = time.time()
+        db = self.db
+        with db:
+            db.execute('BEGIN')
+            db.executemany('UPDATE entries SET hits = hits + ?, accessed = ?'
+                           ' WHERE digest = ?',
+                           [(n, now, digest) for digest, n in hits.items()])
+            for name, value in [('hits', sum(hits.values())), ('misses', misses)]:
+                db.execute('INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)', (name,))
+                db.execute('UPDATE stats SET value = value + ? WHERE name = ?', (value, name))
+
+    def add(self, digest, key, size):
+        """
+        Returns the change in the total size of the entries.
+        """
+        db = self.db
+        row = db.execute('SELECT size FROM entries WHERE digest = ?', (digest,)).fetchone()
+        db.execute('INSERT OR REPLACE INTO entries (digest, key, size, hits, accessed)'
+                   ' VALUES (?, ?, ?, 0, ?)', (digest, key, size, time.time()))
+        return size - (row[0] if row else 0)
+
+    def remove(self, digests):
+        """
+        Returns the total size of the entries that were removed.
+        """
+        digests = list(digests)
+        db = self.db
+        removed = 0
+        for i in xrange(0, len(digests), 500):    # SQLite limits parameters.
+            chunk = digests[i:i + 500]
+            removed += db.execute('SELECT COALESCE(SUM(size), 0) FROM entries'
+                                  ' WHERE digest IN (%s)' % ','.join('?' * len(chunk)),
+                                  chunk).fetchone()[0]
+        db.executemany('DELETE FROM entries WHERE digest = ?',
+                       [(digest,) for digest in digests])
+        return removed
+
+    def total_size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def victims(self, policy):
+        """
+        Yield ``(digest, size)`` for all entries, in the order in which they
+        should be evicted.
+        """
+        order = self.POLICIES[policy]
+        return self.db.execute('SELECT digest, size FROM entries ORDER BY ' + order)
+
+    def largest(self, n):
+        return self.db.execute('SELECT key, size, hits, accessed FROM entries'
+                               ' ORDER BY size DESC LIMIT ?', (n,)).fetchall()
+
+    def stats(self):
+        self.flush()
+        stats = dict(self.db.execute('SELECT name, value FROM stats').fetchall())
+        entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0)'
+                                        ' FROM entries').fetchone()
+        return {
+            'entries': entries,
+            'size': size,
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+        }
+
+    def digests(self):
+        return {digest for digest, in self.db.execute('SELECT digest FROM entries')}
+
+    def clear(self):
+        with self._lock:
+            self._hits, self._misses, self._pending = {}, 0, 0
+        db = self.db
+        with db:
+            db.execute('BEGIN')
+            db.execute('DELETE FROM entries')
+            db.execute('DELETE FROM stats')
+
+
+class _KeyLocks(object):
+    """
+    Process-local locks, one per key, that are discarded once nobody is
+    holding or waiting for them.
+    """
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def release(self, key):
+        with self._lock:
+            entry = self._locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class TieredContentCache(BaseCache):
+    INDEX_NAME = 'index.sqlite3'
+    LOCK_DIR = 'locks'
+    LOCK_POLL_INTERVAL = 0.05    # Seconds.
+
+    def __init__(self, location, params):
+        super(TieredContentCache, self).__init__(params)
+        self._dir = os.path.abspath(location)
+        options = params.get('OPTIONS', {})
+        self.max_size = int(options.get('MAX_SIZE', 10 * 1024 ** 3))
+        self.policy = options.get('EVICTION_POLICY', 'lru')
+        if self.policy not in _Index.POLICIES:
+            raise ValueError('Unknown EVICTION_POLICY: %s' % self.policy)
+        self._memory = _MemoryLRU(int(options.get('MEMORY_MAX_SIZE', 64 * 1024 ** 2)),
+                                  int(options.get('MEMORY_MAX_ITEM_SIZE', 1024 ** 2)))
+        self._index = _Index(os.path.join(self._dir, self.INDEX_NAME))
+        self._lock = threading.Lock()
+        self._size = None    # Running total; read from the index when needed.
+        self._size_lock = threading.Lock()
+        self._key_locks = _KeyLocks()
+        self.lock_timeout = float(options.get('LOCK_TIMEOUT', 60))
+
+    def _digest(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return hashlib.sha256(force_bytes(key)).hexdigest()
+
+    def _digest_to_file(self, digest):
+        """
+        Entries are sharded by the first two bytes of their hash, e.g.
+        ``<LOCATION>/ab/cd/abcd1234...``\.
+        """
+        return os.path.join(self._dir, digest[:2], digest[2:4], digest)
+
+    def _key_to_file(self, key, version=None):
+        return self._digest_to_file(self._digest(key, version))
+
+    def path(self, key, version=None):
+        """
+        Path to the file containing the content for ``key``, or ``None`` if it
+        isn't cached.
+        """
+        fname = self._key_to_file(key, version)
+        return fname if os.path.exists(fname) else None
+
+    def open(self, key, version=None):
+        """
+        Open the cached content for ``key`` for reading (in binary mode), or
+        return ``None`` if it isn't cached.
+        """
+        digest = self._digest(key, version)
+        try:
+            f = io.open(self._digest_to_file(digest), 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._index.miss()
+            return None
+        self._index.hit(digest)
+        return f
+
+    def mmap(self, key, version=None):
+        """
+        Memory-map the cached content for ``key`` (read-only), or return
+        ``None`` if it isn't cached. Empty entries can't be mapped, and are
+        also returned as ``None``\.
+        """
+        f = self.open(key, version)
+        if f is None:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, key, default=None, version=None):
+        digest = self._digest(key, version)
+        value = self._memory.get(digest)
+        if value is not None:
+            self._index.hit(digest)
+            return value
+        try:
+            with io.open(self._digest_to_file(digest), 'rb') as f:
+                value = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._index.miss()
+            return default
+        self._index.hit(digest)
+        self._memory.set(digest, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not isinstance(value, str):
+            raise TypeError('TieredContentCache can only store byte strings')
+        digest = self._digest(key, version)
+        fname = self._digest_to_file(digest)
+        directory = os.path.dirname(fname)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Write to a temporary file first, so that readers never see a
+        #  partially-written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        renamed = False
+        try:
+            with io.open(fd, 'wb') as f:
+                f.write(value)
+            file_move_safe(tmp_path, fname, allow_overwrite=True)
+            renamed = True
+        finally:
+            if not renamed:
+                os.remove(tmp_path)
+        self._memory.set(digest, value)
+        added = self._index.add(digest, key, len(value))
+        with self._size_lock:
+            if self._size is None:
+                self._size = self._index.total_size()    # Includes this entry.
+            else:
+                self._size += added
+            full = self._size > self.max_size
+        if full:
+            self.trim(self.max_size * 0.9)
+
+    def _sync_size(self):
+        with self._size_lock:
+            self._size = self._index.total_size()
+
+    @staticmethod
+    def _try_lock(f):
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        return True
+
+    def _acquire_file_lock(self, digest):
+        """
+        Take an exclusive lock that is shared by all processes using this
+        cache directory. Locks are striped over 4096 files by the first three
+        characters of ``digest``\, so that lock files don't accumulate.
+
+        Returns the locked file, or ``None`` if the lock could not be taken
+        within :attr:`.lock_timeout` seconds.
+        """
+        directory = os.path.join(self._dir, self.LOCK_DIR)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        f = open(os.path.join(directory, digest[:3] + '.lock'), 'a')
+        deadline = time.time() + self.lock_timeout
+        while not self._try_lock(f):
+            if time.time() > deadline:
+                f.close()
+                return None
+            time.sleep(self.LOCK_POLL_INTERVAL)
+        return f
+
+    def get_or_fetch(self, key, fetch, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Get the value for ``key``; on a miss, call ``fetch()`` and cache its
+        return value (unless it is ``None``).
+
+        Only one caller fetches a given key at a time. Callers that miss while
+        a fetch is in progress, whether in this process or another, wait for
+        it and then read the value from the cache. If the holder of the lock
+        takes longer than ``LOCK_TIMEOUT`` seconds, waiters give up and fetch
+        for themselves. Exceptions raised by ``fetch`` are propagated, and
+        the next caller in line tries again.
+        """
+        value = self.get(key, version=version)
+        if value is not None:
+            return value
+
+        digest = self._digest(key, version)
+        self._key_locks.acquire(digest)
+        try:
+            lock_file = self._acquire_file_lock(digest)
+            try:
+                # Someone else may have filled the cache while we waited.
+                value = self.get(key, version=version)
+                if value is None:
+                    value = fetch()
+                    if value is not None:
+                        self.set(key, value, timeout, version)
+                return value
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    lock_file.close()
+        finally:
+            self._key_locks.release(digest)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.has_key(key, version):
+            return False
+        self.set(key, value, timeout, version)
+        return True
+
+    def delete(self, key, version=None):
+        self._remove([self._digest(key, version)])
+
+    def has_key(self, key, version=None):
+        return self.path(key, version) is not None
+
+    def clear(self):
+        self._memory.clear()
+        if os.path.exists(self._dir):
+            for name in os.listdir(self._dir):
+                path = os.path.join(self._dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+        self._index.clear()
+        with self._size_lock:
+            self._size = 0
+
+    def _remove(self, digests):
+        for digest in digests:
+            self._memory.delete(digest)
+            try:
+                os.remove(self._digest_to_file(digest))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        removed = self._index.remove(digests)
+        with self._size_lock:
+            if self._size is not None:
+                self._size -= removed
+
+    def trim(self, max_size, policy=None):
+        """
+        Evict entries (least recently or least frequently used first,
+        depending on ``policy``) until the cache is no larger than
+        ``max_size`` bytes.
+
+        Returns
+        -------
+        tuple
+            Number of entries and bytes evicted.
+        """
+        with self._lock:
+            self._index.flush()    # So that recent hits count.
+            size = self._index.total_size()
+            victims = []
+            evicted = 0
+            for digest, entry_size in self._index.victims(policy or self.policy):
+                if size - evicted <= max_size:
+                    break
+                victims.append(digest)
+                evicted += entry_size
+            self._remove(victims)
+            # Other processes sharing the directory also add entries.
+            self._sync_size()
+            return len(victims), evicted
+
+    def stats(self):
+        """
+        Number of entries, total size, and overall hit and miss counts.
+        """
+        stats = self._index.stats()
+        stats['max_size'] = self.max_size
+        stats['policy'] = self.policy
+        return stats
+
+    def largest(self, n=10):
+        """
+        The ``n`` largest entries, as ``(key, size, hits, last accessed)``\.
+        """
+        return self._index.largest(n)
+
+    def sync(self):
+        """
+        Reconcile the index with the files on disk, e.g. after files were
+        removed by hand or written by an older version.
+
+        Returns
+        -------
+        tuple
+            Number of entries added to and removed from the index.
+        """
+        indexed = self._index.digests()
+        found = set()
+        for root, dirs, files in os.walk(self._dir):
+            if root == self._dir:
+                continue    # The index itself.
+            for name in files:
+                if len(name) != 64:    # e.g. a temporary file.
+                    continue
+                found.add(name)
+                if name not in indexed:
+                    try:
+                        size = os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    self._index.add(name, None, size)
+        missing = indexed - found
+        self._index.remove(missing)
+        self._sync_size()
+        return len(found - indexed), len(missing)
+
+
+def get_or_fetch(cache, key, fetch):
+    """
+    Get the value for ``key`` from ``cache``\, calling ``fetch()`` to fill it
+    on a miss. Concurrent misses are coalesced if the backend supports it
+    (see :meth:`.TieredContentCache.get_or_fetch`\).
+    """
+    if hasattr(cache, 'get_or_fetch'):
+        return cache.get_or_fetch(key, fetch, None)
+    value = cache.get(key)
+    if value is None:
+        value = fetch()
+        if value is not None:
+            cache.set(key, value, None)
+    return value
@@ -1 +1,12 @@
 from redis.exceptions import ConnectionError
+
+
+class RemoteUnavailable(Exception):
+    """
+    Raised instead of contacting an external source that is failing (see
+    :class:`cookies.aggregate.CircuitBreaker`\), or for a location that
+    failed recently.
+    """
+    def __init__(self, message, retry_after=None):
+        super(RemoteUnavailable, self).__init__(message)
+        self.retry_after = retry_after
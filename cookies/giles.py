@@ -4,23 +4,30 @@ This module provides methods for interacting with Giles.
 
 
 from django.conf import settings
-from django.core.files import File
 from  django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Case, IntegerField, Max, Q, Sum, When
 
 from cookies.models import *
 from cookies import models    # TODO: wtf.
 from cookies.exceptions import *
+from cookies import uploadwindow, operations
+from cookies.tokens import giles_tokens
+from cookies.sessions import Client
+from cookies.multipart import MultipartEncoder
 
-import requests, os, jsonpickle, urllib, urlparse
-from datetime import datetime, timedelta
+import requests, os, jsonpickle, urllib, urlparse, time, mimetypes, hashlib
+from datetime import timedelta
 from django.utils import timezone
-from collections import defaultdict
+from collections import Counter, defaultdict
+from uuid import uuid4
 from jars.settings import GILES_RESPONSE_CREATOR_MAP
 
 import django.db.utils
 
-GET = requests.get
-POST = requests.post
+GET = Client('giles').get
+POST = Client('giles').post
 ACCEPTED = 202
 
 logger = settings.LOGGER
@@ -46,21 +53,16 @@ def handle_status_exception(func):
     and raises a :class:`.StatusException` for non-200-series HTTP status codes.
     """
     def wrapper(user, *args, **kwargs):
+        started = time.time()
         response = func(user, *args, **kwargs)
 
         if type(user) in [str, unicode]:    # May be a username, rather than a User.
             user = User.objects.get(username=user)
 
         if response.status_code == 401:    # Auth token expired.
-            try:
-                user.giles_token.delete()
-            except (AssertionError, ObjectDoesNotExist):
-                pass
-            except Exception as E:
-                raise
-
-            get_user_auth_token(user, fresh=True, **kwargs)
-            user.refresh_from_db()
+            # Any token obtained since the request was made will do; there's
+            #  no need for every worker that got a 401 to fetch a new one.
+            get_user_auth_token(user, newer_than=started, **kwargs)
             response  = func(user, *args, **kwargs)
             logger.debug('response %s: %s' % (response.status_code, response.content))
             return response
@@ -95,12 +97,15 @@ def _create_auth_header(user, **kwargs):
 def get_user_auth_token(user, **kwargs):
     """
     Get the current auth token for a :class:`.User`\. If the user has no auth
-    token, retrieves one and stores it.
+    token, or it is about to expire, retrieves one and stores it (see
+    :class:`cookies.tokens.TokenStore`\).
 
     Parameters
     ----------
     user : :class:`django.contrib.auth.User`
     kwargs : kwargs
+        ``fresh=True`` forces a new token; ``newer_than`` (a Unix timestamp)
+        only accepts tokens obtained after that time.
 
     Returns
     -------
@@ -108,31 +113,21 @@ def get_user_auth_token(user, **kwargs):
         Giles authorization token for ``user``.
     """
     fresh = kwargs.pop('fresh', False)
+    newer_than = kwargs.pop('newer_than', time.time() if fresh else None)
     logger.debug('get_user_auth_token:: for %s' % user.username)
 
-    try:
-        _expiry = timezone.now() - timedelta(minutes=settings.GILES_TOKEN_EXPIRATION)
-        if not fresh and user.giles_token.created > _expiry:
-            return user.giles_token.token
-    except (AttributeError, ObjectDoesNotExist):    # RelatedObjectDoesNotExist.
-        pass    # Will proceed to retrieve token.
+    data = {}
+    def fetch():
+        status_code, data['response'] = get_auth_token(user, **kwargs)
+        return data['response']["token"]
 
-    data = None
     try:
-        try:    # Delete the old token first.
-            user.giles_token.delete()
-        except (AssertionError, ObjectDoesNotExist):
-            pass
-
-        status_code, data = get_auth_token(user, **kwargs)
-        user.giles_token = GilesToken.objects.create(for_user=user, token=data["token"])
-        user.save()
-        return user.giles_token.token
+        return giles_tokens.get(user, fetch, newer_than=newer_than)
     except Exception as E:
         logger.error("Failed to retrieve access token for %s: %s" % \
                      (user.username, str(E)))
         import json
-        logger.error(json.dumps(data))
+        logger.error(json.dumps(data.get('response')))
         if kwargs.get('raise_exception', False):
             raise E
 
@@ -179,6 +174,10 @@ def send_to_giles(username, file_name, public=False, **kwargs):
         current approach is to set all files to private, and then provide
         paths with short-lived Giles tokens to individual users on a
         case-by-case basis.
+    kwargs : kwargs
+        Can inject ``content_type`` (guessed from ``file_name`` if not
+        provided) and ``progress`` (called with the number of bytes sent so
+        far and the total size of the request body).
 
     Returns
     -------
@@ -188,27 +187,33 @@ def send_to_giles(username, file_name, public=False, **kwargs):
     user = User.objects.get(username=username)
     giles = kwargs.get('giles', settings.GILES)
     post = kwargs.get('post', POST)
+    content_type = kwargs.get('content_type') or guess_content_type(file_name)
 
     path = '/'.join([giles, 'rest', 'files', 'upload'])
     headers = _create_auth_header(user, **kwargs)
-    # headers.update({ 'Content-Type': 'multipart/form-data', })
 
-    data = {'access': 'PUBLIC' if public else 'PRIVATE',}
     _full_path = os.path.join(settings.MEDIA_ROOT, file_name.encode('utf-8'))
-    # POST payload.
-    files = {
-        'files': ( file_name, File(open(_full_path, 'rb')), 'application/pdf')
-    }
+    # The body is streamed from disk, rather than built up in memory.
+    with open(_full_path, 'rb') as f:
+        body = MultipartEncoder(
+            fields=[('access', 'PUBLIC' if public else 'PRIVATE')],
+            files=[('files', file_name, f, content_type)],
+            callback=kwargs.get('progress'))
+        headers.update({'Content-Type': body.content_type})
+
+        # Giles should respond with a token for each upload, which we should
+        #  check periodically for completion (OCR takes longer than the Apache
+        #  timeout).
+        return post(path, headers=headers, data=body)
 
-    # Giles should respond with a token for each upload, which we should
-    #  check periodically for completion (OCR takes longer than the Apache
-    #  timeout).
-    # import httplib as http_client
-    # http_client.HTTPConnection.debuglevel = 1
-    # requests_log = logging.getLogger("requests.packages.urllib3")
-    # requests_log.setLevel(logging.DEBUG)
-    # requests_log.propagate = True
-    return post(path, headers=headers, files=files, data=data)
+
+def guess_content_type(file_name):
+    """
+    Guess the MIME type of a file from its name, falling back to
+    ``application/octet-stream``\.
+    """
+    content_type, _ = mimetypes.guess_type(file_name)
+    return content_type or 'application/octet-stream'
 
 
 def create_giles_upload(resource_id, content_relation_id, username,
@@ -249,6 +254,10 @@ def create_giles_upload(resource_id, content_relation_id, username,
     data = {
         'resource':resource,
         'file_path': content_resource.file.name,
+        'content_type': content_relation.content_type \
+                        or content_resource.content_type \
+                        or guess_content_type(content_resource.file.name),
+        'content_sha256': content_resource.content_sha256,    # If known.
         'state': GilesUpload.PENDING,
         'created_by': user,
         'priority': priority,
@@ -266,6 +275,117 @@ def create_giles_upload(resource_id, content_relation_id, username,
 
 
 
+def file_sha256(file_path, chunk_size=64 * 1024):
+    """
+    Hex SHA-256 digest of a file, read in chunks.
+
+    Parameters
+    ----------
+    file_path : str
+        Relative to MEDIA_ROOT.
+
+    Returns
+    -------
+    str
+        Or None, if the file can't be read.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(os.path.join(settings.MEDIA_ROOT, file_path.encode('utf-8')), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except (IOError, OSError, AttributeError):
+        return None
+    return digest.hexdigest()
+
+
+def _file_size(file_path):
+    try:
+        return os.path.getsize(os.path.join(settings.MEDIA_ROOT, file_path))
+    except (OSError, TypeError, AttributeError):
+        return None
+
+
+def estimate_processing_time(size):
+    """
+    Estimate how long (in seconds) Giles will take to process a file of
+    ``size`` bytes, based on the processing rate of uploads processed in the
+    last ``GILES_POLL_ESTIMATE_PERIOD`` seconds.
+
+    Falls back to ``GILES_POLL_DEFAULT`` if the size isn't known or there is
+    no recent history. The estimate is kept between ``GILES_POLL_MIN`` and
+    ``GILES_POLL_MAX``\.
+    """
+    estimate = settings.GILES_POLL_DEFAULT
+    if size:
+        since = timezone.now() \
+            - timedelta(seconds=settings.GILES_POLL_ESTIMATE_PERIOD)
+        rate = GilesObservation.objects.filter(kind=GilesObservation.PROCESSED,
+                                               size__gt=0, created__gte=since)\
+                                       .aggregate(duration=Sum('duration'),
+                                                  size=Sum('size'))
+        if rate['size']:
+            estimate = size * rate['duration'] / rate['size']
+    return min(max(estimate, settings.GILES_POLL_MIN), settings.GILES_POLL_MAX)
+
+
+def processing_time(sent, busy, done):
+    """
+    How long (in seconds) Giles took to process an upload.
+
+    We only know that Giles finished some time after it last said that it was
+    still processing the upload (or after it was sent), and before the poll
+    that found it done. That poll may have been late (e.g. because the upload
+    was expected to take longer), which shouldn't count against Giles; so we
+    take the middle of that interval.
+
+    Parameters
+    ----------
+    sent : :class:`datetime.datetime`
+    busy : :class:`datetime.datetime`
+        When Giles last said that it was still processing the upload, or None.
+    done : :class:`datetime.datetime`
+        When Giles said that it was done.
+
+    Returns
+    -------
+    float
+    """
+    finished_after = max(sent, busy) if busy else sent
+    return ((finished_after - sent) + (done - sent)).total_seconds() / 2.
+
+
+def poll_interval(check_count):
+    """
+    Seconds to wait before polling again for an upload that was still
+    processing the last ``check_count`` times. Doubles with each check,
+    from ``GILES_POLL_MIN`` up to ``GILES_POLL_MAX``\.
+    """
+    return min(settings.GILES_POLL_MIN * 2 ** check_count, settings.GILES_POLL_MAX)
+
+
+def _upload_progress(upload, steps=50):
+    """
+    Progress callback for :func:`.send_to_giles` that records the bytes sent
+    so far on ``upload``\, at most ``steps`` times.
+
+    The request body is a little larger than the file itself, so progress is
+    scaled to ``upload.file_size``\.
+    """
+    state = {'last': 0}
+
+    def _progress(sent, total):
+        if not total:
+            return
+        if sent < total and sent - state['last'] < total / steps:
+            return
+        state['last'] = sent
+        upload.bytes_sent = (upload.file_size or total) * sent / total
+        GilesUpload.objects.filter(pk=upload.pk)\
+                           .update(bytes_sent=upload.bytes_sent)
+    return _progress
+
+
 def send_giles_upload(upload_pk, username):
     """
     Send data for a pending :class:`.GilesUpload`\.
@@ -284,12 +404,29 @@ def send_giles_upload(upload_pk, username):
     if not upload.state in [GilesUpload.PENDING, GilesUpload.ENQUEUED]:
         return
 
+    if not upload.content_sha256:
+        upload.content_sha256 = upload_sha256(upload)
+    previous = find_processed_duplicate(upload)
+    if previous is not None and reuse_giles_upload(upload, previous):
+        return
+
+    upload.file_size = _file_size(upload.file_path)
+    upload.bytes_sent = 0
     try:
-        code, result = send_to_giles(username, upload.file_path, public=False)
+        with uploadwindow.observe(GilesObservation.SEND) as observation:
+            code, result = send_to_giles(username, upload.file_path,
+                                         public=False,
+                                         content_type=upload.content_type,
+                                         progress=_upload_progress(upload))
+            observation['status_code'] = code
         if code != 200:
             raise RuntimeError('Giles returned HTTP {}'.format(code))
         upload.upload_id = result['id']
         upload.state = GilesUpload.SENT
+        upload.sent = timezone.now()
+        upload.bytes_sent = upload.file_size or 0
+        upload.next_check_at = upload.sent \
+            + timedelta(seconds=estimate_processing_time(upload.file_size))
     except AttributeError as E:
         message = str(result)
         logger.error("Giles returned an uninterpretable message when sending"
@@ -304,6 +441,91 @@ def send_giles_upload(upload_pk, username):
     upload.save()
 
 
+def upload_sha256(upload):
+    """
+    Hex SHA-256 digest of the file for a :class:`.GilesUpload`\.
+
+    The digest is stored on the content :class:`.Resource`\, so that the file
+    is only read once if it is uploaded again.
+
+    Returns
+    -------
+    str
+        Or None, if the file can't be read.
+    """
+    content = Resource.objects.filter(file=upload.file_path, content_resource=True)
+    digest = content.exclude(content_sha256__isnull=True)\
+                    .values_list('content_sha256', flat=True).first()
+    if digest is None:
+        digest = file_sha256(upload.file_path)
+        if digest is not None:
+            content.update(content_sha256=digest)
+    return digest
+
+
+def find_processed_duplicate(upload):
+    """
+    Find an earlier :class:`.GilesUpload` of the same file (by the user who
+    created ``upload``\) that Giles has already processed.
+
+    Uploads are only matched with those of the same user, since files in
+    Giles belong to the user on whose behalf they were sent.
+
+    Returns
+    -------
+    :class:`.GilesUpload` or None
+    """
+    if not upload.content_sha256:
+        return None
+    return GilesUpload.objects.filter(content_sha256=upload.content_sha256,
+                                      created_by_id=upload.created_by_id,
+                                      state=GilesUpload.DONE,
+                                      duplicate_of__isnull=True)\
+                              .exclude(pk=upload.pk)\
+                              .order_by('-updated').first()
+
+
+def reuse_giles_upload(upload, previous):
+    """
+    Process the Giles response for ``previous`` as though it were the
+    response for ``upload``\, rather than sending the same file again.
+
+    Transitions state to DONE. If the response can't be used, ``upload`` is
+    left as it was so that the file can be sent as usual.
+
+    Parameters
+    ----------
+    upload : :class:`.GilesUpload`
+    previous : :class:`.GilesUpload`
+        Must be DONE.
+
+    Returns
+    -------
+    bool
+        True if the response was reused.
+    """
+    if upload.resource is None:
+        return False
+    try:
+        data = jsonpickle.decode(previous.message)
+        if isinstance(data, list):
+            data = data[0]
+        with transaction.atomic():
+            _GilesDetailsProcessor(upload, upload.resource, upload.created_by,
+                                   data).process()
+            if upload.on_complete:
+                process_on_complete(jsonpickle.decode(upload.on_complete))
+            upload.duplicate_of = previous
+            upload.state = GilesUpload.DONE
+            upload.message = previous.message
+            upload.save()
+    except Exception as E:
+        logger.exception('Could not reuse upload %i for upload %i; sending'
+                         ' it instead' % (previous.id, upload.id))
+        return False
+    return True
+
+
 @api_request
 @handle_status_exception
 def check_upload_status(username, upload_id , **kwargs):
@@ -379,7 +601,7 @@ def process_upload(upload_id, username, reprocess=False):
         before. Default behavior (reprocess=False) is to do nothing if the
         upload is in one of the error states or Done.
     """
-    import datetime, jsonpickle
+    import jsonpickle
     from django.utils import timezone
 
     user = User.objects.get(username=username)
@@ -392,9 +614,14 @@ def process_upload(upload_id, username, reprocess=False):
     if not _created and upload.created_by != user:
         raise RuntimeError('Upload was made on behalf of a different user')
 
+    # If Giles already said that it was still processing, it finished after
+    #  that check.
+    busy = upload.last_checked if upload.check_count else None
     upload.last_checked = timezone.now()    # TODO: this is probably redundant.
     try:
-        code, data = check_upload_status(username, upload_id)
+        with uploadwindow.observe(GilesObservation.POLL) as observation:
+            code, data = check_upload_status(username, upload_id)
+            observation['status_code'] = code
     except Exception as E:
         upload.message = str(E)
         upload.state = GilesUpload.GILES_ERROR
@@ -403,6 +630,9 @@ def process_upload(upload_id, username, reprocess=False):
 
     if code == ACCEPTED:    # Giles is still processing the upload.
         upload.state = GilesUpload.SENT
+        upload.next_check_at = upload.last_checked \
+            + timedelta(seconds=poll_interval(upload.check_count))
+        upload.check_count += 1
         upload.save()
         return
 
@@ -450,12 +680,148 @@ def process_upload(upload_id, username, reprocess=False):
                 return
 
         # Woohoo!
+        if upload.sent:
+            uploadwindow.record(GilesObservation.PROCESSED,
+                                processing_time(upload.sent, busy,
+                                                upload.last_checked),
+                                size=upload.file_size)
         upload.state = GilesUpload.DONE
         upload.message = jsonpickle.encode(data)
         upload.save()
 
 
+def _reserve_ids(model, n):
+    """
+    Reserve ``n`` primary keys for ``model``\, so that rows can refer to each
+    other (and be given URIs) before they are inserted.
+
+    Parameters
+    ----------
+    model : :class:`django.db.models.Model`
+    n : int
+
+    Returns
+    -------
+    list
+    """
+    if n == 0:
+        return []
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))"
+                           " FROM generate_series(1, %s)", [table, n])
+            return [row[0] for row in cursor.fetchall()]
+
+        # There are no sequences to draw from in SQLite (i.e. in development),
+        #  but it only allows one writer at a time anyway.
+        start = model.objects.aggregate(Max('id'))['id__max'] or 0
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            start = max(start, row[0] if row else 0)
+    return range(start + 1, start + n + 1)
+
+
+class _GilesBulkWriter(object):
+    """
+    Collects the rows created while processing a Giles response, and writes
+    them with a handful of ``bulk_create()`` calls in :meth:`.flush`\.
+
+    Primary keys (and, for :class:`.Entity` instances, URIs) are assigned
+    before anything is inserted, so each row is written exactly once.
+    ``bulk_create()`` doesn't send ``post_save``\, so :meth:`.flush` updates
+    the :class:`.CollectionCount`\s itself. Content from Giles has no local
+    file, so there is nothing to send back to Giles.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self):
+        self._resources = []
+        self._values = []
+        self._relations = []
+        self._content_relations = []
+
+    def resource(self, **kwargs):
+        resource = Resource(**kwargs)
+        self._resources.append(resource)
+        return resource
+
+    def value(self, value, **kwargs):
+        value = Value(name=value, **kwargs)
+        self._values.append(value)
+        return value
+
+    def relation(self, source, predicate, target=None, **kwargs):
+        relation = Relation(predicate=predicate, **kwargs)
+        self._relations.append((relation, source, target))
+        return relation
+
+    def content_relation(self, for_resource, content_resource, **kwargs):
+        content_relation = ContentRelation(**kwargs)
+        self._content_relations.append((content_relation, for_resource,
+                                        content_resource))
+        return content_relation
+
+    def _assign_ids(self, model, instances):
+        instances = [instance for instance in instances if instance.id is None]
+        for instance, pk in zip(instances, _reserve_ids(model, len(instances))):
+            instance.id = pk
+            if hasattr(instance, 'generate_uri') and not instance.uri:
+                instance.uri = instance.generate_uri()
+
+    def assign_ids(self):
+        """
+        Assign primary keys to the :class:`.Resource`\s and :class:`.Value`\s
+        collected so far, e.g. so that they can refer to each other.
+        """
+        self._assign_ids(Resource, self._resources)
+        self._assign_ids(Value, self._values)
+
+    def flush(self):
+        """
+        Write everything that has been collected so far.
+        """
+        self.assign_ids()
+
+        relations = []
+        for relation, source, target in self._relations:
+            relation.source_type = ContentType.objects.get_for_model(source)
+            relation.source_instance_id = source.id
+            if target is not None:
+                relation.target_type = ContentType.objects.get_for_model(target)
+                relation.target_instance_id = target.id
+            relation.name = uuid4()    # See Relation.save().
+            relations.append(relation)
+        self._assign_ids(Relation, relations)
+
+        content_relations = []
+        counts = defaultdict(Counter)
+        for content_relation, for_resource, content_resource in self._content_relations:
+            content_relation.for_resource_id = for_resource.id
+            content_relation.content_resource_id = content_resource.id
+            content_relations.append(content_relation)
+            if content_relation.content_type and not content_relation.is_deleted:
+                counts[content_relation.container_id][content_relation.content_type] += 1
+
+        Resource.objects.bulk_create(self._resources, batch_size=self.BATCH_SIZE)
+        Value.objects.bulk_create(self._values, batch_size=self.BATCH_SIZE)
+        Relation.objects.bulk_create(relations, batch_size=self.BATCH_SIZE)
+        ContentRelation.objects.bulk_create(content_relations,
+                                            batch_size=self.BATCH_SIZE)
+
+        # These would otherwise be updated as each ContentRelation is saved.
+        for container_id, deltas in counts.items():
+            collection_id = ResourceContainer.objects.filter(pk=container_id)\
+                                                     .values_list('part_of_id', flat=True)\
+                                                     .first()
+            operations.adjust_collection_counts(collection_id, deltas)
+
+        self.__init__()
+
+
 class _GilesDetailsProcessor(object):
+    LINK_BATCH_SIZE = 250
 
     def __init__(self, upload, resource, user, data):
         self.__creator__ = Field.objects.get(uri='http://purl.org/dc/elements/1.1/creator')
@@ -475,19 +841,42 @@ class _GilesDetailsProcessor(object):
         self._resource = resource
         self._user = user
         self._data = data
-        content_filter = dict(is_deleted=False, content_resource__is_external=True,
-            content_resource__external_source=Resource.GILES)
+        self._writer = _GilesBulkWriter()
+
+        # Look up what we already have for this resource (e.g. if Giles has
+        #  reprocessed it) in a few queries, rather than a few per page.
+        parts = list(self._resource.parts.values_list('sort_order', 'source_instance_id'))
+        pages = Resource.objects.in_bulk([pk for _, pk in parts])
+        self._pages = {
+            int(sort_order): pages[pk] for sort_order, pk in parts if pk in pages
+        }
+        page_ids = self._resource.parts.order_by().values('source_instance_id')
+        existing = ContentRelation.objects.filter(
+            Q(for_resource=resource) | Q(for_resource_id__in=page_ids),
+            is_deleted=False, content_resource__is_external=True,
+            content_resource__external_source=Resource.GILES
+        ).select_related('content_resource__entity_type')\
+         .order_by(Case(When(for_resource=resource, then=0), default=1,
+                        output_field=IntegerField()))
         self._existing_giles_resources = {
             crel.content_resource.location: (crel, crel.content_resource)
-                for crel in resource.content.filter(**content_filter)
+                for crel in existing
         }
-        self._pages = {
-            int(rel.sort_order): rel.source
-                for rel in self._resource.parts.order_by('sort_order')
-        }
-        for page in self._pages.values():
-            for crel in page.content.filter(**content_filter):
-                self._existing_giles_resources[crel.content_resource.location] = (crel, crel.content_resource)
+        creator_relations = list(Relation.objects.filter(
+            predicate=self.__creator__,
+            source_type=ContentType.objects.get_for_model(Resource),
+            source_instance_id__in=existing.order_by().values('content_resource_id')
+        ))
+        creator_values = Value.objects.in_bulk([
+            relation.target_instance_id for relation in creator_relations
+        ])
+        creators = defaultdict(list)
+        for relation in creator_relations:
+            creators[relation.source_instance_id].append(
+                creator_values.get(relation.target_instance_id)
+            )
+        for _, content_resource in self._existing_giles_resources.values():
+            content_resource._creators = creators[content_resource.pk]
 
     def _process_uploaded_file(self):
         upload_data = self._data.get('uploadedFile')
@@ -565,14 +954,60 @@ class _GilesDetailsProcessor(object):
                                            page_resource,
                                            name_fn=name_fn)
 
-            # Populate the ``next_page`` field for pages, and for their content
-            #  resources.
-            for i in sorted(pages.keys())[:-1]:
-                for fmt in ['resource', 'image', 'text', 'ocr',]:
-                    if fmt not in pages[i]:
-                        continue
-                    pages[i][fmt].next_page = pages[i + 1][fmt]
-                    pages[i][fmt].save()
+        return pages
+
+    def _link_pages(self, pages):
+        """
+        Point each page (and each of its content resources) at the next one.
+        Pages that haven't been written yet are simply written that way; the
+        links that need to be updated are returned, for
+        :meth:`._update_links`\.
+
+        Parameters
+        ----------
+        pages : dict
+            Maps page numbers onto dicts of ``'resource'`` and (if available)
+            ``'image'``\, ``'text'`` and ``'ocr'`` :class:`.Resource`\s.
+
+        Returns
+        -------
+        dict
+            Maps ids of written :class:`.Resource`\s onto their new
+            ``next_page_id``\.
+        """
+        links = {}
+        for fmt in ['resource', 'image', 'text', 'ocr',]:
+            sequence = [pages[nr][fmt] for nr in sorted(pages.keys())
+                        if fmt in pages[nr]]
+            for resource, next_resource in zip(sequence[:-1], sequence[1:]):
+                if resource.next_page_id == next_resource.id:
+                    continue
+                # Links between new records are written along with them. Since
+                #  ``next_page`` is one-to-one, links to or from existing
+                #  records are updated afterwards.
+                if resource._state.adding and next_resource._state.adding:
+                    resource.next_page = next_resource
+                else:
+                    links[resource.id] = next_resource.id
+        return links
+
+    def _update_links(self, links):
+        """
+        Set ``next_page`` for written :class:`.Resource`\s, using a handful of
+        bulk updates rather than a ``save()`` per record.
+        """
+        # Keep well within the limit on query parameters (999, in SQLite).
+        ids = sorted(links.keys())
+        for i in xrange(0, len(ids), self.LINK_BATCH_SIZE):
+            batch = ids[i:i + self.LINK_BATCH_SIZE]
+            # ``next_page`` is one-to-one, so a page that has moved (e.g. if
+            #  Giles reprocessed the document) must first give up its place.
+            Resource.objects.filter(next_page_id__in=[links[pk] for pk in batch])\
+                            .update(next_page=None)
+            Resource.objects.filter(pk__in=batch).update(next_page=Case(
+                *[When(pk=pk, then=links[pk]) for pk in batch],
+                output_field=IntegerField()
+            ))
 
     def _process_additional_files(self, additional_files, parent_resource,
                                   name_fn=lambda x:x['url']):
@@ -638,8 +1073,15 @@ class _GilesDetailsProcessor(object):
                                        self._resource,
                                        name_fn=name_fn)
 
-        self._process_pages()
+        pages = self._process_pages()
 
+        # Populate the ``next_page`` field for pages, and for their content
+        #  resources, now that they are all in place. New pages are linked as
+        #  they are written.
+        self._writer.assign_ids()
+        links = self._link_pages(pages)
+        self._writer.flush()
+        self._update_links(links)
         return self._resource
 
     def _save_content_resource(self, parent_resource, resource_type, uri, url,
@@ -678,19 +1120,6 @@ class _GilesDetailsProcessor(object):
         """
         try:
             content_rel, content_resource = self._existing_giles_resources[url]
-            content_resource.entity_type = resource_type
-            for key, value in meta.items():
-                try:
-                    setattr(content_resource, key, value)
-                except AttributeError, e:
-                    logger.warning(e)
-
-            content_resource.save()
-
-            if 'content_type' in meta.keys():
-                content_rel.content_type = meta.get('content_type')
-                content_rel.save()
-
         except KeyError:
             kwargs = {
                 'name': meta.get('name', url),
@@ -703,25 +1132,46 @@ class _GilesDetailsProcessor(object):
                 'is_external': True,
                 'external_source': Resource.GILES,
                 'uri': uri,
-                'container': parent_resource.container,
+                'container_id': parent_resource.container_id,
             }
             try:
                 kwargs['location_id'] = meta['file_id']
             except KeyError:
                 kwargs['location'] = url
 
-            content_resource = Resource.objects.create(**kwargs)
-            content_rel = ContentRelation.objects.create(**{
-                'for_resource': parent_resource,
-                'content_resource': content_resource,
-                'content_type': meta.get('content_type', None),
-                'container': parent_resource.container,
-            })
+            content_resource = self._writer.resource(**kwargs)
+            content_rel = self._writer.content_relation(
+                parent_resource, content_resource,
+                content_type=meta.get('content_type', None),
+                container_id=parent_resource.container_id,
+            )
             self._existing_giles_resources[url] = (content_rel,
                                                    content_resource)
+        else:
+            meta['entity_type'] = resource_type
+            self._update(content_resource, **meta)
+            if 'content_type' in meta.keys():
+                self._update(content_rel, content_type=meta.get('content_type'))
 
         return content_resource
 
+    def _update(self, instance, **values):
+        """
+        Set ``values`` on ``instance``\, and save it if it has already been
+        written and any of its fields have changed.
+        """
+        fields = {field.name for field in instance._meta.concrete_fields}
+        changed = False
+        for key, value in values.items():
+            if key in fields and getattr(instance, key) != value:
+                changed = True
+            try:
+                setattr(instance, key, value)
+            except AttributeError, e:
+                logger.warning(e)
+        if changed and instance.pk is not None:
+            instance.save()
+
     def _save_page_resource(self, parent_resource, page_nr, resource_type, uri,
                             url, public=False, **meta):
         """
@@ -749,7 +1199,7 @@ class _GilesDetailsProcessor(object):
         except KeyError:
             pass
 
-        resource = Resource.objects.create(**{
+        resource = self._writer.resource(**{
             'name': '%s, page %i' % (parent_resource.name, page_nr),
             'created_by_id': self._user.id,
             'created_through': parent_resource.created_through,
@@ -759,33 +1209,33 @@ class _GilesDetailsProcessor(object):
             'is_part': True,
             'is_external': True,
             'external_source': Resource.GILES,
-            'container': parent_resource.container,
+            'container_id': parent_resource.container_id,
         })
 
-        Relation.objects.create(**{
-            'source': resource,
-            'target': parent_resource,
-            'predicate': self.__part__,
-            'container': parent_resource.container,
-            'sort_order': int(page_nr),
-        })
+        self._writer.relation(resource, self.__part__, parent_resource,
+                              container_id=parent_resource.container_id,
+                              sort_order=int(page_nr))
         self._pages[page_nr] = resource
         return resource
 
     def _save_resource_creator(self, resource, predicate, value):
-        existing_relations = resource.relations_from.filter(predicate=predicate)
-        rel_count = existing_relations.count()
-        if rel_count == 0:
-            Relation.objects.create(
-                source=resource,
-                predicate=predicate,
-                target=Value.objects.create(name=value),
-                container=resource.container,
-            )
-        elif rel_count == 1:
-            target = existing_relations[0].target
-            target.name = value
-            target.save()
+        # Creators of existing resources are looked up in advance (see
+        #  ``__init__``); new resources don't have any yet.
+        if not hasattr(resource, '_creators'):
+            resource._creators = []
+        existing = resource._creators
+
+        if len(existing) == 0:
+            target = self._writer.value(value)
+            self._writer.relation(resource, predicate, target,
+                                  container_id=resource.container_id)
+            existing.append(target)
+        elif len(existing) == 1:
+            target = existing[0]
+            if target is not None and target.name != value:
+                target.name = value
+                if target.pk is not None:
+                    target.save()
         else:
             logger.warning('Multiple creator relations for Resource {}'.format(resource))
 
@@ -1,6 +1,11 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import http_date
+from django.views.static import was_modified_since
 from rest_framework.negotiation import BaseContentNegotiation
 
+import os, re
+
 
 class IgnoreClientContentNegotiation(BaseContentNegotiation):
     """
@@ -23,3 +28,105 @@ class IgnoreClientContentNegotiation(BaseContentNegotiation):
 
 class HttpResponseUnacceptable(HttpResponse):
     status_code = 406
+
+
+class HttpResponseRangeNotSatisfiable(HttpResponse):
+    status_code = 416
+
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _parse_range(header, size):
+    """
+    Parse a single byte range (``bytes=start-end``\, ``bytes=start-``, or
+    ``bytes=-suffix``\) into an inclusive ``(start, end)``\.
+
+    Returns ``None`` if the header should be ignored (e.g. multiple ranges,
+    or ``end`` before ``start``\), or ``False`` if the range can't be
+    satisfied.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':    # The last ``end`` bytes.
+        start, end = max(size - int(end), 0), size - 1
+    elif end and int(end) < int(start):    # Invalid, rather than unsatisfiable.
+        return None
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _iter_range(fileobj, start, length):
+    try:
+        fileobj.seek(start)
+        while length > 0:
+            chunk = fileobj.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def serve_file(request, fileobj, content_type):
+    """
+    Stream a local file, honoring conditional (``If-None-Match``\,
+    ``If-Modified-Since``\) and single-range requests.
+
+    Parameters
+    ----------
+    request : :class:`django.http.HttpRequest`
+    fileobj : file
+        Open in binary mode. It is closed once the response has been sent.
+    content_type : str
+
+    Returns
+    -------
+    :class:`django.http.HttpResponse`
+    """
+    stat = os.fstat(fileobj.fileno())
+    size = stat.st_size
+    etag = '"%x-%x"' % (int(stat.st_mtime), size)
+    last_modified = http_date(stat.st_mtime)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if (if_none_match and (if_none_match == '*' or etag in [tag.strip() for tag in if_none_match.split(',')])) \
+            or (not if_none_match and not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                                                             stat.st_mtime, size)):
+        fileobj.close()
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        byte_range = _parse_range(range_header, size)
+
+    if byte_range is False:
+        fileobj.close()
+        response = HttpResponseRangeNotSatisfiable()
+        response['Content-Range'] = 'bytes */%i' % size
+        return response
+    elif byte_range is None:
+        response = FileResponse(fileobj, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_range(fileobj, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %i-%i/%i' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
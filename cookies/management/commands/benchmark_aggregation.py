@@ -0,0 +1,108 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+
+from cookies.aggregate import aggregate_content_resources
+from cookies.models import *
+
+from itertools import chain
+import time
+
+
+PART_URI = 'http://purl.org/dc/terms/isPartOf'
+
+
+def legacy_aggregate_content_resources(queryset, content_type=None,
+                                       part_uri=PART_URI):
+    """
+    The original generator-based implementation, which recurses through
+    ``isPartOf`` relations one resource at a time. Kept here for comparison.
+    """
+    content_q = Q(content_resource__content_resource=True)
+    if content_type is not None:
+        content_q &= Q(content_type=content_type) | Q(content_resource__content_type=content_type)
+    q = Q(predicate__uri=part_uri)
+
+    def get_parts(resource):
+        return (o for rel in resource.relations_to.filter(q).order_by('sort_order')
+                    for o in chain((crel.content_resource for crel
+                                    in rel.source.content.filter(content_q)),
+                                   get_parts(rel.source)))
+
+    for resource in queryset:
+        for crel in resource.content.filter(content_q & Q(is_deleted=False)):
+            yield crel.content_resource
+        for content in get_parts(resource):
+            yield content
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare container-scoped content aggregation with the legacy' \
+           ' recursive generator, using synthetic data that is rolled back' \
+           ' afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resources', type=int, default=20)
+        parser.add_argument('--parts', type=int, default=50,
+                            help='Parts (e.g. pages) per resource.')
+
+    def _create_data(self, n_resources, n_parts):
+        user = User.objects.create(username='benchmark-aggregation')
+        part_of, _ = Field.objects.get_or_create(uri=PART_URI)
+        collection = Collection.objects.create(name='benchmark', created_by=user)
+        resources = []
+        for i in xrange(n_resources):
+            container = ResourceContainer.objects.create(created_by=user,
+                                                         part_of=collection)
+            resource = Resource.objects.create(name='resource %i' % i,
+                                               container=container,
+                                               created_by=user)
+            container.primary = resource
+            container.save()
+            for j in xrange(n_parts):
+                part = Resource.objects.create(name='part %i' % j,
+                                               container=container,
+                                               created_by=user)
+                Relation.objects.create(source=part, predicate=part_of,
+                                        target=resource, container=container,
+                                        sort_order=j)
+                content = Resource.objects.create(content_resource=True,
+                                                  is_external=True,
+                                                  external_source=Resource.WEB,
+                                                  location='http://example.com/%i/%i.txt' % (i, j),
+                                                  content_type='text/plain',
+                                                  container=container)
+                ContentRelation.objects.create(for_resource=part,
+                                               content_resource=content,
+                                               content_type='text/plain',
+                                               container=container)
+            resources.append(resource)
+        return resources
+
+    def _run(self, label, func, resources):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            result = [content.id for content in func(resources, content_type='text/plain')]
+            elapsed = time.time() - start
+        self.stdout.write('%-10s %8.3fs %8i queries %8i items' % (label, elapsed,
+                                                                 len(queries.captured_queries),
+                                                                 len(result)))
+        return result
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                resources = self._create_data(options['resources'], options['parts'])
+                legacy = self._run('legacy', legacy_aggregate_content_resources, resources)
+                current = self._run('container', aggregate_content_resources, resources)
+                if legacy != current:
+                    self.stderr.write('Results differ!')
+                raise _Rollback()
+        except _Rollback:
+            pass
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from cookies.giles import _GilesDetailsProcessor
+from cookies.models import *
+
+from collections import Counter, deque
+import time
+
+
+TYPES = [
+    'http://purl.org/dc/dcmitype/Text',
+    'http://purl.org/dc/dcmitype/Image',
+    'http://xmlns.com/foaf/0.1/Document',
+    'http://purl.org/dc/dcmitype/Dataset',
+]
+FIELDS = [
+    'http://purl.org/dc/elements/1.1/creator',
+    'http://purl.org/dc/terms/isPartOf',
+]
+
+
+def synthetic_giles_response(document_id, n_pages):
+    """
+    A Giles document response (see :func:`cookies.giles.process_details`)
+    with ``n_pages`` pages, each of which has an image, text and OCR file.
+    """
+    def _file(name, content_type):
+        file_id = 'FILE%s' % name
+        return {
+            'id': file_id,
+            'filename': name,
+            'url': settings.GILES_CONTENT_FORMAT_STRING.format(giles_file_id=file_id),
+            'content-type': content_type,
+            'size': 1024,
+        }
+
+    return {
+        'documentId': document_id,
+        'uploadId': 'UP%s' % document_id,
+        'uploadedFile': _file('%s.pdf' % document_id, 'application/pdf'),
+        'extractedText': _file('%s.txt' % document_id, 'text/plain'),
+        'pages': [{
+            'nr': nr,
+            'image': _file('%s.%i.tiff' % (document_id, nr), 'image/tiff'),
+            'text': _file('%s.%i.txt' % (document_id, nr), 'text/plain'),
+            'ocr': _file('%s.%i.ocr.txt' % (document_id, nr), 'text/plain'),
+        } for nr in xrange(n_pages)],
+    }
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time the processing of a synthetic Giles document response, in' \
+           ' a transaction that is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000)
+
+    def _create_data(self):
+        for uri in TYPES:
+            Type.objects.get_or_create(uri=uri)
+        for uri in FIELDS:
+            Field.objects.get_or_create(uri=uri)
+        user = User.objects.create(username='benchmark-giles-pages')
+        resource = Resource.objects.create(name='benchmark', created_by=user)
+        container = ResourceContainer.objects.create(primary=resource,
+                                                     created_by=user)
+        resource.container = container
+        resource.save()
+        upload = GilesUpload.objects.create(upload_id='UPbenchmark',
+                                            resource=resource,
+                                            created_by=user)
+        return upload, resource, user
+
+    def handle(self, *args, **options):
+        data = synthetic_giles_response('DOCbenchmark', options['pages'])
+        try:
+            with transaction.atomic():
+                upload, resource, user = self._create_data()
+                # The query log is capped at 9,000 queries by default.
+                connection.queries_log = deque(maxlen=None)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.time()
+                    _GilesDetailsProcessor(upload, resource, user, data).process()
+                    elapsed = time.time() - start
+                statements = Counter(query['sql'].split(' ', 1)[0]
+                                     for query in queries.captured_queries)
+                self.stdout.write('%i pages: %.3fs, %i queries (%s)' % (
+                    options['pages'], elapsed, len(queries.captured_queries),
+                    ', '.join('%i %s' % (count, statement) for statement, count
+                              in sorted(statements.items()))))
+                raise _Rollback()
+        except _Rollback:
+            pass
@@ -0,0 +1,79 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+import datetime
+
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """
+    Parse a size like ``500M`` or ``10G`` into bytes.
+    """
+    value = value.strip().upper().rstrip('B')
+    multiplier = 1
+    if value and value[-1] in UNITS:
+        multiplier = UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise CommandError('Invalid size: %s' % value)
+
+
+def format_size(size):
+    for unit in ['', 'K', 'M', 'G']:
+        if size < 1024:
+            return '%.1f%sB' % (size, unit)
+        size /= 1024.
+    return '%.1fTB' % size
+
+
+class Command(BaseCommand):
+    help = 'Report on the remote content cache (size, hit rate, largest' \
+           ' entries), and optionally trim it to a given size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cache', default='remote_content')
+        parser.add_argument('--largest', type=int, default=10,
+                            help='Number of largest entries to list.')
+        parser.add_argument('--trim', default=None,
+                            help='Evict entries until the cache is no larger'
+                                 ' than this, e.g. 5G.')
+        parser.add_argument('--policy', choices=['lru', 'lfu'], default=None,
+                            help='Eviction policy for --trim (defaults to'
+                                 ' the configured policy).')
+        parser.add_argument('--sync', action='store_true',
+                            help='Reconcile the index with the files on disk.')
+
+    def handle(self, *args, **options):
+        cache = caches[options['cache']]
+        if not hasattr(cache, 'stats'):
+            raise CommandError('The %s cache does not support accounting' % options['cache'])
+
+        if options['sync']:
+            added, removed = cache.sync()
+            self.stdout.write('Index synced: %i added, %i removed' % (added, removed))
+
+        if options['trim'] is not None:
+            count, size = cache.trim(parse_size(options['trim']), policy=options['policy'])
+            self.stdout.write('Evicted %i entries (%s)' % (count, format_size(size)))
+
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        self.stdout.write('Entries:   %i' % stats['entries'])
+        self.stdout.write('Size:      %s of %s (%s)' % (format_size(stats['size']),
+                                                        format_size(stats['max_size']),
+                                                        stats['policy']))
+        self.stdout.write('Hit rate:  %s (%i hits, %i misses)' % (
+            '%.1f%%' % (100. * stats['hits'] / lookups) if lookups else 'n/a',
+            stats['hits'], stats['misses']))
+
+        largest = cache.largest(options['largest'])
+        if largest:
+            self.stdout.write('\nLargest entries:')
+            for key, size, hits, accessed in largest:
+                accessed = datetime.datetime.fromtimestamp(accessed).strftime('%Y-%m-%d %H:%M')
+                self.stdout.write('%10s %6i hits  %s  %s' % (format_size(size), hits,
+                                                             accessed, key or '(unknown)'))
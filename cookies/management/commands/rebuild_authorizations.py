@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from cookies.authorization import rebuild_effective_authorizations
+
+
+class Command(BaseCommand):
+    help = 'Re-resolve all authorization policies into EffectiveAuthorization records.'
+
+    def handle(self, *args, **options):
+        rebuild_effective_authorizations()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from cookies.operations import rebuild_collection_counts
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized resource and content-type counts for all collections.'
+
+    def handle(self, *args, **options):
+        rebuild_collection_counts()
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cookies.aggregate import warm_collection
+from cookies.models import Collection, UserJob
+from cookies.tasks import warm_collection_cache
+
+
+class Command(BaseCommand):
+    help = 'Fetch the external content for a collection (and its' \
+           ' subcollections) into the remote content cache, e.g. ahead of a' \
+           ' large snapshot or a workshop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection_id', type=int)
+        parser.add_argument('--user', default=None,
+                            help='Fetch only content that this user can view.'
+                                 ' Defaults to the owner of the collection.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of concurrent fetches.')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Run as a Celery task, with progress tracked'
+                                 ' in a job for the user.')
+
+    def handle(self, *args, **options):
+        try:
+            collection = Collection.objects.get(pk=options['collection_id'])
+        except Collection.DoesNotExist:
+            raise CommandError('No such collection: %i' % options['collection_id'])
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('No such user: %s' % options['user'])
+        else:
+            user = collection.created_by
+
+        if options['run_async']:
+            job = UserJob.objects.create(created_by=user)
+            result = warm_collection_cache.delay(collection.id, user.id, job,
+                                                 workers=options['workers'])
+            self.stdout.write('Started job %s' % result.id)
+            return
+
+        def progress(done, total):
+            if done % 100 == 0 or done == total:
+                self.stdout.write('%i/%i' % (done, total))
+
+        result = warm_collection(user, collection, workers=options['workers'],
+                                 callback=progress)
+        self.stdout.write('%(total)i content resources: %(cached)i already'
+                          ' cached, %(fetched)i fetched, %(failed)i failed' % result)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 12:28
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+
+ALLOW, DENY = 'AL', 'DY'
+
+# Every resource and collection action, as of this migration.
+ACTIONS = ('AD', 'DL', 'ED', 'RM', 'SH', 'VW')
+
+
+def _resolve(policies, owner_id, parent_state):
+    """
+    Resolve the ``(action, granted_to_id, policy)`` tuples on one object,
+    given the resolved state of its parent collection (as in
+    :func:`cookies.authorization._compute_effective_state`\).
+    """
+    state = {}
+    for action in ACTIONS:
+        p_users, p_authenticated, p_anonymous = parent_state.get(action, ({}, False, False))
+        allows = {granted_to for _action, granted_to, policy in policies
+                  if _action == action and policy == ALLOW}
+        denies = {granted_to for _action, granted_to, policy in policies
+                  if _action == action and policy == DENY}
+        public = None in allows
+        authenticated = public or p_authenticated
+        anonymous = (public or p_anonymous) and None not in denies
+
+        users = {}
+        for user_id in (set(p_users) | allows | denies | {owner_id}) - {None}:
+            if user_id == owner_id:
+                outcome = True
+            else:
+                outcome = (user_id in allows or public or p_users.get(user_id, p_authenticated)) \
+                          and user_id not in denies
+            if outcome != authenticated:
+                users[user_id] = outcome
+        state[action] = (users, authenticated, anonymous)
+    return state
+
+
+def _records(EffectiveAuthorization, state, **target):
+    records = []
+    for action, (users, authenticated, anonymous) in state.items():
+        if authenticated:
+            records.append(EffectiveAuthorization(action=action, policy=ALLOW, **target))
+        if anonymous:
+            records.append(EffectiveAuthorization(action=action, policy=ALLOW,
+                                                  anonymous=True, **target))
+        for user_id, outcome in users.items():
+            records.append(EffectiveAuthorization(action=action, granted_to_id=user_id,
+                                                  policy=ALLOW if outcome else DENY,
+                                                  **target))
+    return records
+
+
+def populate_effective_authorizations(apps, schema_editor):
+    """
+    Resolve existing policies, since authorization checks only look at
+    :class:`.EffectiveAuthorization` records.
+    """
+    Collection = apps.get_model('cookies', 'Collection')
+    CollectionAuthorization = apps.get_model('cookies', 'CollectionAuthorization')
+    ResourceContainer = apps.get_model('cookies', 'ResourceContainer')
+    ResourceAuthorization = apps.get_model('cookies', 'ResourceAuthorization')
+    EffectiveAuthorization = apps.get_model('cookies', 'EffectiveAuthorization')
+
+    fields = ('for_resource_id', 'action', 'granted_to_id', 'policy')
+    policies = defaultdict(list)
+    for pk, action, granted_to_id, policy in CollectionAuthorization.objects.values_list(*fields):
+        policies[pk].append((action, granted_to_id, policy))
+
+    # Collections are resolved from the top down, since each depends on its
+    #  parent.
+    children = defaultdict(list)
+    for pk, part_of_id, owner_id in Collection.objects.values_list('id', 'part_of_id', 'created_by_id'):
+        children[part_of_id].append((pk, owner_id))
+    states = {}
+    records = []
+    stack = [(pk, owner_id, {}) for pk, owner_id in children[None]]
+    while stack:
+        pk, owner_id, parent_state = stack.pop()
+        states[pk] = _resolve(policies[pk], owner_id, parent_state)
+        records += _records(EffectiveAuthorization, states[pk], for_collection_id=pk)
+        stack += [(child, child_owner_id, states[pk]) for child, child_owner_id in children[pk]]
+    EffectiveAuthorization.objects.bulk_create(records, batch_size=500)
+
+    containers = ResourceContainer.objects.order_by('id')\
+                                  .values_list('id', 'part_of_id', 'created_by_id')
+    last = 0
+    while True:
+        batch = list(containers.filter(id__gt=last)[:500])
+        if not batch:
+            break
+        last = batch[-1][0]
+        policies = defaultdict(list)
+        qs = ResourceAuthorization.objects.filter(for_resource_id__in=[row[0] for row in batch])
+        for pk, action, granted_to_id, policy in qs.values_list(*fields):
+            policies[pk].append((action, granted_to_id, policy))
+        records = []
+        for pk, part_of_id, owner_id in batch:
+            state = _resolve(policies[pk], owner_id, states.get(part_of_id, {}))
+            records += _records(EffectiveAuthorization, state, for_container_id=pk)
+        EffectiveAuthorization.objects.bulk_create(records, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cookies', '0025_merge_20181105_1812'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectiveAuthorization',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anonymous', models.BooleanField(default=False)),
+                ('action', models.CharField(max_length=2)),
+                ('policy', models.CharField(choices=[(b'AL', b'Allow'), (b'DY', b'Deny')], max_length=2)),
+                ('for_collection', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='effective_authorizations', to='cookies.Collection')),
+                ('for_container', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='effective_authorizations', to='cookies.ResourceContainer')),
+                ('granted_to', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='effective_authorizations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='effectiveauthorization',
+            index_together=set([('for_container', 'action', 'granted_to'), ('for_collection', 'action', 'granted_to')]),
+        ),
+        migrations.RunPython(populate_effective_authorizations, migrations.RunPython.noop),
+    ]
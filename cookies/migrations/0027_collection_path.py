@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 12:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    """
+    Assign materialized paths top-down, one level of the collection tree at a
+    time.
+    """
+    Collection = apps.get_model('cookies', 'Collection')
+    qs = Collection.objects.filter(part_of__isnull=True)
+    paths = {}
+    while True:
+        level = {}
+        for pk, part_of_id in qs.values_list('id', 'part_of_id'):
+            level[pk] = paths.get(part_of_id, '') + '%i/' % pk
+            Collection.objects.filter(pk=pk).update(path=level[pk])
+        if not level:
+            break
+        paths.update(level)
+        qs = Collection.objects.filter(part_of_id__in=list(level.keys()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookies', '0026_effectiveauthorization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default=b'', editable=False, max_length=2000),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 12:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+from collections import Counter
+
+
+def populate_counts(apps, schema_editor):
+    """
+    Count containers and content directly in each collection, and roll those
+    counts up through the materialized paths.
+    """
+    Collection = apps.get_model('cookies', 'Collection')
+    CollectionCount = apps.get_model('cookies', 'CollectionCount')
+    ResourceContainer = apps.get_model('cookies', 'ResourceContainer')
+    ContentRelation = apps.get_model('cookies', 'ContentRelation')
+
+    direct = Counter()
+    containers = ResourceContainer.objects.filter(part_of__isnull=False)
+    for pk, n in containers.values_list('part_of_id').annotate(n=Count('id')):
+        direct[(pk, '')] = n
+    relations = ContentRelation.objects.filter(is_deleted=False, container__part_of__isnull=False)\
+                                       .exclude(content_type__isnull=True)\
+                                       .exclude(content_type='')
+    for pk, content_type, n in relations.values_list('container__part_of_id', 'content_type')\
+                                        .annotate(n=Count('id')):
+        direct[(pk, content_type)] = n
+
+    paths = dict(Collection.objects.values_list('id', 'path'))
+    subtree = Counter()
+    for (pk, content_type), n in direct.items():
+        for ancestor_id in paths[pk].split('/'):
+            if ancestor_id:
+                subtree[(int(ancestor_id), content_type)] += n
+
+    CollectionCount.objects.bulk_create([
+        CollectionCount(collection_id=pk, content_type=content_type,
+                        direct_count=direct[(pk, content_type)], count=n)
+        for (pk, content_type), n in subtree.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookies', '0027_collection_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_type', models.CharField(blank=True, default=b'', max_length=100)),
+                ('direct_count', models.IntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='cookies.Collection')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='collectioncount',
+            unique_together=set([('collection', 'content_type')]),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
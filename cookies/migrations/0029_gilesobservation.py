@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 12:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookies', '0028_collectioncount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GilesObservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[(b'SE', b'Send'), (b'PO', b'Poll'), (b'PR', b'Processed')], max_length=2)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('duration', models.FloatField()),
+                ('status_code', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='gilesupload',
+            name='sent',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 13:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cookies', '0030_gilesupload_next_check_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gilesupload',
+            name='bytes_sent',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gilesupload',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models, IntegrityError, transaction
 from django.db.models.query import Q
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericRelation
@@ -109,15 +110,21 @@ class Entity(models.Model):
     def save(self, *args, **kwargs):
         super(Entity, self).save(*args, **kwargs)
         # Generate a URI if one has not already been assigned.
-        #  TODO: this should call a method to generate a URI, to allow for more
-        #        flexibility (e.g. calling a Handle server).
         if not self.uri:
-            ns = settings.URI_NAMESPACE
-            if ns.endswith('/'):
-                ns = ns[:-1]
-            self.uri = '/'.join([ns, self.__class__.__name__.lower(), str(self.id)])
+            self.uri = self.generate_uri()
         super(Entity, self).save()
 
+    def generate_uri(self):
+        """
+        The URI for an entity that wasn't given one. Requires a primary key.
+        """
+        #  TODO: this should allow for more flexibility (e.g. calling a Handle
+        #        server).
+        ns = settings.URI_NAMESPACE
+        if ns.endswith('/'):
+            ns = ns[:-1]
+        return '/'.join([ns, self.__class__.__name__.lower(), str(self.id)])
+
     def __unicode__(self):
         return unicode(self.id)
 
@@ -196,6 +203,9 @@ class Resource(ResourceBase):
 
     description = models.TextField(blank=True, null=True)
 
+    content_sha256 = models.CharField(max_length=64, blank=True, null=True)
+    """Hex digest of ``file``\, computed when it is first sent to Giles."""
+
     name_index = TSVectorField(('name',), dictionary='simple')
     location_id = models.CharField(
         max_length=255, blank=True, null=True,
@@ -327,8 +337,60 @@ class Collection(ResourceBase):
 
     part_of = models.ForeignKey('Collection', blank=True, null=True)
 
+    path = models.CharField(max_length=2000, db_index=True, blank=True,
+                            default='', editable=False)
+    """
+    Materialized path, e.g. ``'1/5/9/'`` for collection 9 in collection 5 in
+    collection 1. Maintained by :meth:`.save`\, so that whole subtrees and
+    ancestor chains can be retrieved with a single query.
+    """
+
     description = models.TextField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        # Our copy of the path may be stale if an ancestor was moved.
+        if self.pk:
+            self.path = Collection.objects.filter(pk=self.pk)\
+                                          .values_list('path', flat=True)\
+                                          .first() or ''
+        super(Collection, self).save(*args, **kwargs)
+
+        path = str(self.id) + '/'
+        if self.part_of_id:
+            parent_path = Collection.objects.filter(pk=self.part_of_id)\
+                                            .values_list('path', flat=True)\
+                                            .first()
+            path = (parent_path or '') + path
+        if path == self.path:
+            return
+
+        # Moving a collection moves everything beneath it, too.
+        if self.path:
+            descendants = Collection.objects.filter(path__startswith=self.path)
+            descendants.update(path=Concat(models.Value(path),
+                                           Substr('path', len(self.path) + 1),
+                                           output_field=models.CharField()))
+        else:
+            Collection.objects.filter(pk=self.id).update(path=path)
+        self.path = path
+
+    @property
+    def ancestor_ids(self):
+        """
+        IDs of the collections of which this collection is a part, starting
+        with the outermost collection and ending with this collection.
+        """
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    @property
+    def descendants(self):
+        """
+        This collection and all of the collections beneath it.
+        """
+        if not self.path:    # Not saved yet; every path starts with ''.
+            return Collection.objects.none()
+        return Collection.objects.filter(path__startswith=self.path)
+
     def get_number_of_conceptentities(self):
         """
         Count all of the :class:`.ConceptEntity` instances associated with
@@ -348,21 +410,40 @@ class Collection(ResourceBase):
 
     @property
     def children(self):
-        children_ids = []
-        def _decomp(obj):
-            for item in obj:
-                if isinstance(item, list):
-                    _decomp(item)
-                else:
-                    children_ids.append(item)
-        def _get_children(collection_id):
-            return [collection_id] + map(_get_children, filter(lambda pk: pk is not None, Collection.objects.filter(part_of_id=collection_id).values_list('id', flat=True)))
-        _decomp(_get_children(self))
-        return children_ids
+        return list(self.descendants.values_list('id', flat=True))
+
+    def _get_count(self, content_type=''):
+        # Iterating over counts.all() lets callers prefetch_related('counts').
+        for count in self.counts.all():
+            if count.content_type == content_type:
+                return count
+        return None
 
     @property
     def size(self):
-        return ResourceContainer.objects.filter(part_of_id__in=self.children).count()
+        """
+        Number of :class:`.ResourceContainer`\s in this collection and all of
+        its subcollections.
+        """
+        count = self._get_count(CollectionCount.RESOURCES)
+        return count.count if count else 0
+
+    @property
+    def resource_count(self):
+        """
+        Number of :class:`.ResourceContainer`\s directly in this collection.
+        """
+        count = self._get_count(CollectionCount.RESOURCES)
+        return count.direct_count if count else 0
+
+    @property
+    def content_type_counts(self):
+        """
+        Number of (non-deleted) content resources of each content type in this
+        collection and all of its subcollections.
+        """
+        return {count.content_type: count.count for count in self.counts.all()
+                if count.content_type != CollectionCount.RESOURCES and count.count}
 
     @property
     def resources(self):
@@ -370,6 +451,32 @@ class Collection(ResourceBase):
                                        is_deleted=False)
 
 
+class CollectionCount(models.Model):
+    """
+    Denormalized count of the :class:`.ResourceContainer`\s (``content_type``
+    is blank) or of the content resources with a particular ``content_type``
+    in a :class:`.Collection`\.
+
+    These records are maintained by signal handlers (see
+    :mod:`cookies.signals`) and can be rebuilt from scratch with the
+    ``rebuild_collection_counts`` management command. They should never be
+    edited directly.
+    """
+    RESOURCES = ''
+
+    collection = models.ForeignKey('Collection', related_name='counts')
+    content_type = models.CharField(max_length=100, blank=True, default=RESOURCES)
+
+    direct_count = models.IntegerField(default=0)
+    """Count for the collection itself."""
+
+    count = models.IntegerField(default=0)
+    """Count for the collection and all of its subcollections."""
+
+    class Meta:
+        unique_together = (('collection', 'content_type'),)
+
+
 ### Types and Fields ###
 
 
@@ -614,6 +721,35 @@ class GilesUpload(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     last_checked = models.DateTimeField(blank=True, null=True)
+    sent = models.DateTimeField(blank=True, null=True)
+    """When the file was sent to Giles."""
+
+    file_size = models.BigIntegerField(blank=True, null=True)
+    """Bytes."""
+
+    content_type = models.CharField(max_length=255, blank=True, null=True)
+    """Sent to Giles along with the file."""
+
+    bytes_sent = models.BigIntegerField(default=0)
+    """Progress of the upload; compare with ``file_size``\."""
+
+    content_sha256 = models.CharField(max_length=64, blank=True, null=True,
+                                      db_index=True)
+    """Hex digest of the file, used to avoid sending the same file twice."""
+
+    duplicate_of = models.ForeignKey('GilesUpload', related_name='duplicates',
+                                     blank=True, null=True,
+                                     on_delete=models.SET_NULL)
+    """
+    If the same file was already processed by Giles, that upload's response
+    is reused rather than sending the file again.
+    """
+
+    next_check_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    """Giles won't be polled for this upload until this time."""
+
+    check_count = models.IntegerField(default=0)
+    """Number of times Giles said that this upload was still processing."""
 
     PENDING = 'PD'
     ENQUEUED = 'EQ'
@@ -659,6 +795,33 @@ class GilesUpload(models.Model):
     """Relative to MEDIA_ROOT."""
 
 
+class GilesObservation(models.Model):
+    """
+    The outcome of a request to Giles, or the time that Giles took to process
+    an upload. Used to adjust the number of outstanding uploads (see
+    :mod:`cookies.uploadwindow`\).
+    """
+    SEND = 'SE'
+    POLL = 'PO'
+    PROCESSED = 'PR'
+    KINDS = (
+        (SEND, 'Send'),
+        (POLL, 'Poll'),
+        (PROCESSED, 'Processed'),    # From SENT to DONE.
+    )
+    kind = models.CharField(max_length=2, choices=KINDS)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    duration = models.FloatField()
+    """Seconds."""
+
+    status_code = models.IntegerField(blank=True, null=True)
+    """HTTP status code of the response, or 0 if there was no response."""
+
+    size = models.BigIntegerField(blank=True, null=True)
+    """Size of the uploaded file (for ``PROCESSED``\), in bytes."""
+
+
 class GilesToken(models.Model):
     """
     A short-lived auth token for sending content to Giles on behalf of a user.
@@ -750,6 +913,50 @@ class ResourceAuthorization(models.Model):
     policy = models.CharField(choices=POLICIES, max_length=2)
 
 
+class EffectiveAuthorization(models.Model):
+    """
+    Materialized outcome of the :class:`.ResourceAuthorization` and
+    :class:`.CollectionAuthorization` policies that apply to a
+    :class:`.ResourceContainer` or :class:`.Collection`\, including those
+    inherited through ``part_of``.
+
+    These records are maintained by signal handlers (see
+    :mod:`cookies.signals`) and can be rebuilt from scratch with the
+    ``rebuild_authorizations`` management command. They should never be edited
+    directly.
+    """
+    granted_to = models.ForeignKey(User, related_name='effective_authorizations',
+                                   blank=True, null=True)
+    anonymous = models.BooleanField(default=False)
+    """
+    Only meaningful if ``granted_to`` is null. If ``True``, the record applies
+    to anonymous users; otherwise it applies to any authenticated user who
+    has no user-specific record.
+    """
+
+    for_container = models.ForeignKey('ResourceContainer',
+                                      related_name='effective_authorizations',
+                                      blank=True, null=True)
+    for_collection = models.ForeignKey('Collection',
+                                       related_name='effective_authorizations',
+                                       blank=True, null=True)
+    action = models.CharField(max_length=2)
+
+    ALLOW = 'AL'
+    DENY = 'DY'
+    POLICIES = (
+        (ALLOW, 'Allow'),
+        (DENY, 'Deny'),
+    )
+    policy = models.CharField(choices=POLICIES, max_length=2)
+
+    class Meta:
+        index_together = [
+            ['for_container', 'action', 'granted_to'],
+            ['for_collection', 'action', 'granted_to'],
+        ]
+
+
 class Dataset(models.Model):
     created_by = models.ForeignKey(User, related_name='datasets')
     created = models.DateTimeField(auto_now_add=True)
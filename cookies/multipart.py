@@ -0,0 +1,126 @@
+"""
+Streaming ``multipart/form-data`` request bodies.
+
+``requests`` builds a multipart body (given ``files=``\) in memory, which for
+a scan of a few hundred MB means a few hundred MB per worker. A
+:class:`.MultipartEncoder` instead reads files in chunks as the body is
+sent, and can report progress along the way.
+
+.. code-block:: python
+
+   >>> with open(path, 'rb') as f:
+   ...     body = MultipartEncoder([('access', 'PRIVATE')],
+   ...                             [('files', 'scan.pdf', f, 'application/pdf')])
+   ...     requests.post(url, data=body,
+   ...                   headers={'Content-Type': body.content_type})
+
+"""
+
+from requests.packages.urllib3.fields import format_header_param
+
+from uuid import uuid4
+import os
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _file_length(fileobj):
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, IOError, OSError):
+        position = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        length = fileobj.tell() - position
+        fileobj.seek(position)
+        return length
+
+
+class MultipartEncoder(object):
+    """
+    A file-like ``multipart/form-data`` body.
+
+    Parameters
+    ----------
+    fields : list
+        ``(name, value)`` tuples.
+    files : list
+        ``(name, filename, fileobj, content_type)`` tuples. Each ``fileobj``
+        is read from its current position to the end.
+    callback : callable
+        (optional) Called with the number of bytes read so far and the total
+        length of the body, each time a chunk is read.
+    boundary : str
+        (optional) Generated if not provided.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields=(), files=(), callback=None, boundary=None):
+        self.boundary = boundary or uuid4().hex
+        self.callback = callback
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self.bytes_read = 0
+
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(self._header(name) + b'\r\n' + _encode(value) + b'\r\n')
+        for name, filename, fileobj, content_type in files:
+            self._parts.append(self._header(name, filename, content_type) + b'\r\n')
+            self._parts.append(fileobj)
+            self._parts.append(b'\r\n')
+        self._parts.append(b'--%s--\r\n' % self.boundary)
+
+        self.len = sum(_file_length(part) if hasattr(part, 'read') else len(part)
+                       for part in self._parts)
+        self._chunks = self._iter_parts()
+        self._buffer = b''
+
+    def _header(self, name, filename=None, content_type=None):
+        disposition = 'form-data; ' + format_header_param('name', name)
+        if filename is not None:
+            disposition += '; ' + format_header_param('filename', filename)
+        lines = ['--%s' % self.boundary,
+                 'Content-Disposition: %s' % disposition]
+        if content_type is not None:
+            lines.append('Content-Type: %s' % content_type)
+        return b'\r\n'.join(_encode(line) for line in lines) + b'\r\n'
+
+    def _iter_parts(self):
+        for part in self._parts:
+            if not hasattr(part, 'read'):
+                yield part
+                continue
+            while True:
+                chunk = part.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytes_read += len(data)
+        if data and self.callback is not None:
+            self.callback(self.bytes_read, self.len)
+        return data
+
+    def __iter__(self):
+        # requests only streams bodies that are iterable.
+        while True:
+            data = self.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            yield data
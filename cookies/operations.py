@@ -1,5 +1,6 @@
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q, QuerySet
+from django.db.models import Q, QuerySet, F, Count
+from django.db import IntegrityError, transaction
 from django.conf import settings
 
 from cookies.models import *
@@ -14,6 +15,7 @@ import networkx as nx
 import os
 
 from cookies.exceptions import *
+from cookies.sessions import Client
 
 logger = settings.LOGGER
 
@@ -258,6 +260,9 @@ def merge_resources(resources, master_id=None, delete=True, user=None):
     for resource in to_merge:
         _transfer_all_relations(resource, master, resource_type)
         resource.content.all().update(for_resource=master)
+        # QuerySet.update() bypasses the signal handlers that maintain counts.
+        move_container_counts(resource.container, resource.container.part_of_id,
+                              master.container.part_of_id, content_only=True)
         for rel in ['resource_set', 'conceptentity_set', 'relation_set', 'content_relations', 'value_set']:
             getattr(resource.container, rel).update(container_id=master.container.id)
         # for collection in resource.part_of.all():
@@ -444,7 +449,139 @@ def ping_remote_resource(path):
     Check whether a remote resource is accessible.
     """
     try:
-        response = requests.head(path)
+        response = Client('web').head(path)
     except requests.exceptions.ConnectTimeout:
         return False, {}
     return response.status_code == requests.codes.ok, response.headers
+
+
+def container_content_counts(container):
+    """
+    Count the (non-deleted) content resources of each content type in a
+    :class:`.ResourceContainer`\.
+
+    Parameters
+    ----------
+    container : :class:`.ResourceContainer` or int
+
+    Returns
+    -------
+    dict
+        Content type -> number of :class:`.ContentRelation`\s.
+    """
+    qs = ContentRelation.objects.filter(container=container, is_deleted=False)\
+                                .exclude(content_type__isnull=True)\
+                                .exclude(content_type=CollectionCount.RESOURCES)\
+                                .values_list('content_type')\
+                                .annotate(n=Count('id'))
+    return dict(qs)
+
+
+def adjust_collection_counts(collection_id, deltas, direct=True):
+    """
+    Add ``deltas`` to the :class:`.CollectionCount`\s of a collection and of
+    all of the collections of which it is a part.
+
+    Parameters
+    ----------
+    collection_id : int
+    deltas : dict
+        Content type (or ``CollectionCount.RESOURCES``) -> change in count.
+    direct : bool
+        If ``False``, ``direct_count`` is left alone (e.g. when a
+        subcollection is moved into or out of the collection).
+    """
+    deltas = {content_type: n for content_type, n in deltas.items() if n}
+    if collection_id is None or not deltas:
+        return
+    path = Collection.objects.filter(pk=collection_id)\
+                             .values_list('path', flat=True).first()
+    if not path:    # The collection is being deleted.
+        return
+    ancestor_ids = [int(pk) for pk in path.split('/') if pk]
+
+    with transaction.atomic():
+        for content_type, n in deltas.items():
+            counts = CollectionCount.objects.filter(collection_id__in=ancestor_ids,
+                                                    content_type=content_type)
+            existing = set(counts.values_list('collection_id', flat=True))
+            missing = [CollectionCount(collection_id=pk, content_type=content_type)
+                       for pk in ancestor_ids if pk not in existing]
+            if missing:
+                try:
+                    with transaction.atomic():
+                        CollectionCount.objects.bulk_create(missing)
+                except IntegrityError:    # Created concurrently.
+                    pass
+            counts.update(count=F('count') + n)
+            if direct:
+                counts.filter(collection_id=collection_id)\
+                      .update(direct_count=F('direct_count') + n)
+
+
+def move_container_counts(container, from_collection_id, to_collection_id,
+                          content_only=False):
+    """
+    Update :class:`.CollectionCount`\s when a :class:`.ResourceContainer` is
+    moved from one collection to another.
+
+    If ``content_only`` is ``True``, only the content of ``container`` is being
+    moved (e.g. when resources are merged).
+    """
+    if from_collection_id == to_collection_id:
+        return
+    deltas = container_content_counts(container)
+    if not content_only:
+        deltas[CollectionCount.RESOURCES] = 1
+    adjust_collection_counts(from_collection_id,
+                             {content_type: -n for content_type, n in deltas.items()})
+    adjust_collection_counts(to_collection_id, deltas)
+
+
+def move_collection_counts(collection, from_collection_id, to_collection_id):
+    """
+    Update :class:`.CollectionCount`\s when a :class:`.Collection` (and
+    everything in it) is moved from one collection to another.
+    """
+    if from_collection_id == to_collection_id:
+        return
+    deltas = dict(collection.counts.values_list('content_type', 'count'))
+    adjust_collection_counts(from_collection_id,
+                             {content_type: -n for content_type, n in deltas.items()},
+                             direct=False)
+    adjust_collection_counts(to_collection_id, deltas, direct=False)
+
+
+@transaction.atomic
+def rebuild_collection_counts():
+    """
+    Recalculate all :class:`.CollectionCount`\s from scratch.
+    """
+    direct = Counter()
+    for collection_id, n in ResourceContainer.objects.filter(part_of__isnull=False)\
+                                                     .values_list('part_of_id')\
+                                                     .annotate(n=Count('id')):
+        direct[(collection_id, CollectionCount.RESOURCES)] = n
+    relations = ContentRelation.objects.filter(is_deleted=False,
+                                               container__part_of__isnull=False)\
+                                       .exclude(content_type__isnull=True)\
+                                       .exclude(content_type=CollectionCount.RESOURCES)
+    for collection_id, content_type, n in relations.values_list('container__part_of_id', 'content_type')\
+                                                   .annotate(n=Count('id')):
+        direct[(collection_id, content_type)] = n
+
+    # Roll the direct counts up the tree.
+    paths = dict(Collection.objects.values_list('id', 'path'))
+    subtree = Counter()
+    for (collection_id, content_type), n in direct.items():
+        for pk in paths[collection_id].split('/'):
+            if pk:
+                subtree[(int(pk), content_type)] += n
+
+    CollectionCount.objects.all().delete()
+    CollectionCount.objects.bulk_create([
+        CollectionCount(collection_id=collection_id, content_type=content_type,
+                        direct_count=direct[(collection_id, content_type)],
+                        count=n)
+        for (collection_id, content_type), n in subtree.items()
+    ])
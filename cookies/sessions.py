@@ -0,0 +1,205 @@
+"""
+Shared HTTP sessions for talking to remote services.
+
+Calling ``requests.get()`` and friends directly opens a new connection (and,
+for HTTPS, does a new TLS handshake) for every request. Instead, each
+process keeps one :class:`requests.Session` per service (``'giles'``\,
+``'hathitrust'``\, ``'web'``\, etc), whose connections are pooled and kept
+alive between requests. Sessions also apply default timeouts
+(``REMOTE_CONNECT_TIMEOUT`` and ``REMOTE_READ_TIMEOUT``\), and retry failed
+connections and idempotent requests that fail with 502, 503 or 504, backing
+off exponentially with jitter (``REMOTE_RETRIES``\, ``REMOTE_RETRY_BACKOFF``\).
+
+.. code-block:: python
+
+   >>> from cookies import sessions
+   >>> response = sessions.get('web').get('https://example.com/')
+   >>> sessions.stats()['web']
+   {'requests': 1, 'connections': 1, 'reused': 0, 'retries': 0}
+
+"""
+
+from django.conf import settings
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from requests.packages.urllib3.util.retry import Retry
+
+from collections import Counter
+import os, random, requests, threading
+
+logger = settings.LOGGER
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class JitteredRetry(Retry):
+    """
+    Backs off exponentially, but waits a random fraction of each interval so
+    that clients that failed together don't all retry together.
+    """
+    def get_backoff_time(self):
+        return random.uniform(0, super(JitteredRetry, self).get_backoff_time())
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Applies default timeouts, and keeps count of requests, retries and new
+    connections in ``metrics``\.
+    """
+    def __init__(self, metrics, lock, timeout=None, **kwargs):
+        self.metrics = metrics
+        self.lock = lock
+        self.timeout = timeout
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.metrics[key] += n
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def _counting(pool_class):
+            def _new_conn(pool):
+                adapter._count('connections')
+                return pool_class._new_conn(pool)
+            return type('Counting%s' % pool_class.__name__, (pool_class,),
+                        {'_new_conn': _new_conn})
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting(HTTPConnectionPool),
+            'https': _counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        self._count('requests')
+        response = super(PooledAdapter, self).send(request, **kwargs)
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            self._count('retries', len(retries.history))
+        return response
+
+
+class SessionRegistry(object):
+    """
+    Sessions for the current process, by name. Sessions are not shared with
+    forked processes (e.g. Celery workers), since their connections would be.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._sessions = {}
+        self._metrics = {}
+
+    def _create(self, name, **options):
+        metrics = self._metrics.setdefault(name, Counter())
+        pool_maxsize = options.get('pool_maxsize', _setting('REMOTE_POOL_MAXSIZE', 10))
+        retries = JitteredRetry(
+            total=options.get('retries', _setting('REMOTE_RETRIES', 3)),
+            backoff_factor=options.get('backoff', _setting('REMOTE_RETRY_BACKOFF', 0.5)),
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,    # Callers decide what to make of those.
+        )
+        adapter = PooledAdapter(
+            metrics, self._lock,
+            timeout=(options.get('connect_timeout', _setting('REMOTE_CONNECT_TIMEOUT', 10)),
+                     options.get('read_timeout', _setting('REMOTE_READ_TIMEOUT', 60))),
+            pool_connections=options.get('pool_connections', _setting('REMOTE_POOL_CONNECTIONS', 10)),
+            pool_maxsize=pool_maxsize,
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, name, **options):
+        """
+        Get the :class:`requests.Session` for ``name``\, creating it if need
+        be.
+
+        Parameters
+        ----------
+        name : str
+            E.g. ``'giles'``\.
+        options : kwargs
+            Override the ``REMOTE_*`` settings for a new session:
+            ``pool_connections``\, ``pool_maxsize``\, ``connect_timeout``\,
+            ``read_timeout``\, ``retries`` and ``backoff``\.
+
+        Returns
+        -------
+        :class:`requests.Session`
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if name not in self._sessions:
+                self._sessions[name] = self._create(name, **options)
+            return self._sessions[name]
+
+    def stats(self):
+        """
+        Connection reuse for each session in this process.
+
+        Returns
+        -------
+        dict
+            Maps session names onto ``requests``\, ``connections`` (opened),
+            ``reused`` (requests that didn't need a new connection) and
+            ``retries``\.
+        """
+        with self._lock:
+            return {
+                name: {
+                    'requests': metrics['requests'],
+                    'connections': metrics['connections'],
+                    'reused': max(metrics['requests'] - metrics['connections'], 0),
+                    'retries': metrics['retries'],
+                } for name, metrics in self._metrics.items()
+            }
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._reset()
+
+
+class Client(object):
+    """
+    Calls through to the current :class:`requests.Session` for ``name``\, so
+    that it can be bound at import time (e.g. ``GET = Client('giles').get``\).
+    """
+    def __init__(self, name, registry=None):
+        self.name = name
+        self.registry = registry or sessions
+
+    def request(self, method, url, **kwargs):
+        return self.registry.get(self.name).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+
+sessions = SessionRegistry()
+get = sessions.get
+stats = sessions.stats
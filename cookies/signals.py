@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, post_init
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
@@ -8,7 +8,10 @@ from django.conf import settings
 from cookies.models import *
 from cookies import giles
 from cookies import content
+from cookies import authorization
+from cookies import operations
 from cookies.tasks import handle_content, send_to_giles
+from cookies.tokens import giles_tokens
 from cookies.exceptions import *
 logger = settings.LOGGER
 
@@ -25,6 +28,18 @@ def new_users_are_inactive_by_default(sender, **kwargs):
         instance.save()
 
 
+@receiver(post_save, sender=GilesToken)
+@receiver(post_delete, sender=GilesToken)
+def invalidate_cached_giles_token(sender, **kwargs):
+    """
+    Tokens saved or deleted outside of :class:`cookies.tokens.TokenStore`
+    (e.g. when a user is deleted) shouldn't linger in the cache.
+    """
+    instance = kwargs.get('instance', None)
+    if instance and instance.for_user_id:
+        giles_tokens.invalidate(instance.for_user_id)
+
+
 @receiver(post_save, sender=ContentRelation)
 def send_all_files_to_giles(sender, **kwargs):    # Hey, that rhymes!
     """
@@ -43,6 +58,114 @@ def send_all_files_to_giles(sender, **kwargs):    # Hey, that rhymes!
                               delete_on_complete=settings.DELETE_LOCAL_FILES)
 
 
+@receiver(post_init, sender=ResourceContainer)
+@receiver(post_init, sender=Collection)
+def remember_original_state(sender, **kwargs):
+    """
+    Keep track of the fields that determine which policies apply to a
+    container or collection (and which collections it counts towards), so
+    that we can tell whether they have changed.
+    """
+    instance = kwargs.get('instance', None)
+    instance._original_state = (instance.part_of_id, instance.created_by_id)
+
+
+@receiver(post_save, sender=ResourceContainer)
+@receiver(post_save, sender=Collection)
+def update_on_move(sender, **kwargs):
+    """
+    Re-resolve the :class:`.EffectiveAuthorization`\s for a container or
+    collection when it is created, moved to another collection, or changes
+    hands, and update the :class:`.CollectionCount`\s when it is moved.
+    """
+    instance = kwargs.get('instance', None)
+    created = kwargs.get('created', False)
+    state = (instance.part_of_id, instance.created_by_id)
+    if created or state != instance._original_state:
+        authorization.update_effective_authorizations(instance)
+
+    original_part_of_id = None if created else instance._original_state[0]
+    if sender is ResourceContainer:
+        operations.move_container_counts(instance, original_part_of_id,
+                                         instance.part_of_id)
+    else:
+        operations.move_collection_counts(instance, original_part_of_id,
+                                          instance.part_of_id)
+    instance._original_state = state
+
+
+@receiver(post_delete, sender=ResourceContainer)
+def update_counts_on_container_delete(sender, **kwargs):
+    """
+    The container's :class:`.ContentRelation`\s are deleted (and counted)
+    separately, so here we need only account for the container itself.
+    """
+    instance = kwargs.get('instance', None)
+    operations.adjust_collection_counts(instance.part_of_id,
+                                        {CollectionCount.RESOURCES: -1})
+
+
+def _content_relation_counts(container_id, content_type, is_deleted):
+    """
+    The collection and count deltas to which a :class:`.ContentRelation`
+    contributes.
+    """
+    if is_deleted or not content_type or container_id is None:
+        return None, {}
+    collection_id = ResourceContainer.objects.filter(pk=container_id)\
+                                             .values_list('part_of_id', flat=True)\
+                                             .first()
+    return collection_id, {content_type: 1}
+
+
+@receiver(post_init, sender=ContentRelation)
+def remember_content_relation_state(sender, **kwargs):
+    instance = kwargs.get('instance', None)
+    instance._original_state = (instance.container_id, instance.content_type,
+                                instance.is_deleted)
+
+
+@receiver(post_save, sender=ContentRelation)
+@receiver(post_delete, sender=ContentRelation)
+def update_counts_on_content_change(sender, **kwargs):
+    """
+    Update the :class:`.CollectionCount`\s when content is added, removed,
+    or moved to another container.
+    """
+    instance = kwargs.get('instance', None)
+    if kwargs.get('signal') is post_delete:
+        state = (instance.container_id, instance.content_type, True)
+    else:
+        state = (instance.container_id, instance.content_type, instance.is_deleted)
+    original = (None, None, True) if kwargs.get('created', False) else instance._original_state
+    if state == original:
+        return
+
+    collection_id, deltas = _content_relation_counts(*original)
+    operations.adjust_collection_counts(collection_id, {
+        content_type: -n for content_type, n in deltas.items()
+    })
+    operations.adjust_collection_counts(*_content_relation_counts(*state))
+    instance._original_state = state
+
+
+@receiver(post_save, sender=ResourceAuthorization)
+@receiver(post_delete, sender=ResourceAuthorization)
+@receiver(post_save, sender=CollectionAuthorization)
+@receiver(post_delete, sender=CollectionAuthorization)
+def update_authorizations_on_policy_change(sender, **kwargs):
+    """
+    Re-resolve the :class:`.EffectiveAuthorization`\s for the object to which
+    a policy applies (and, for collections, everything beneath it).
+    """
+    instance = kwargs.get('instance', None)
+    target_model = ResourceContainer if sender is ResourceAuthorization else Collection
+    # The target may be going away as well (e.g. in a cascading delete).
+    target = target_model.objects.filter(pk=instance.for_resource_id).first()
+    if target is not None:
+        authorization.update_effective_authorizations(target)
+
+
 # @receiver(post_save, sender=ConceptEntity)
 def conceptentity_post_save(sender, **kwargs):
     """
@@ -8,13 +8,12 @@ from django.utils import timezone
 from django.utils.text import slugify
 
 from cookies import aggregate
-from cookies.filters import ResourceContainerFilter, apply_dataset_filters
+from cookies.filters import ResourceContainerFilter
 
 
-from itertools import chain
 from celery import shared_task, task
 
-from cookies import content, giles, authorization, operations
+from cookies import content, giles, authorization, operations, uploadwindow
 from cookies.models import *
 from concepts import authorities
 from cookies.accession import IngesterFactory
@@ -24,7 +23,6 @@ from cookies.exceptions import *
 logger = settings.LOGGER
 
 import jsonpickle, json, os
-from datetime import timedelta, datetime
 
 # Celery priorities need to be 0-9, 9 being the highest and 0 being the lowest.
 CELERY_PRIORITY_HIGH = 8
@@ -135,13 +133,15 @@ def handle_bulk(self, file_path, form_data, file_name, job=None,
             job.progress += 1./N
             job.save()
     ResourceAuthorization.objects.bulk_create(resource_auths)
+    if resource_auths:    # bulk_create() doesn't send post_save signals.
+        authorization.update_effective_authorizations(collection)
     job.result = jsonpickle.encode({'view': 'collection', 'id': collection.id})
     job.save()
 
     return {'view': 'collection', 'id': collection.id}
 
 
-@shared_task(rate_limit="15/m")
+@shared_task
 def send_to_giles(upload_pk, created_by):
     logger.debug('send upload %i for user %s' % (upload_pk, created_by))
     try:
@@ -150,7 +150,7 @@ def send_to_giles(upload_pk, created_by):
         GilesUpload.objects.filter(pk=upload_pk).update(state=GilesUpload.SEND_ERROR, message=str(e))
 
 
-@shared_task(rate_limit="2/s")
+@shared_task
 def check_giles_upload(upload_id, username):
     logger.debug('check_giles_upload %s for user %s' % (upload_id, username))
     try:
@@ -164,50 +164,128 @@ def search_for_concept(lemma):
     authorities.searchall(lemma)
 
 
+def _claim_uploads(queryset, state, limit):
+    """
+    Move up to ``limit`` uploads from ``queryset`` to ``state``\, skipping
+    any that are locked by a concurrent claim, so that an upload is never
+    claimed twice.
+
+    Returns
+    -------
+    list
+        ``(pk, upload_id, created_by_id, priority)`` for each claimed upload.
+    """
+    if limit <= 0:
+        return []
+    with transaction.atomic():
+        claimed = list(queryset.select_for_update(skip_locked=True)\
+                               .values_list('id', 'upload_id', 'created_by_id', 'priority')[:limit])
+        if claimed:
+            GilesUpload.objects.filter(pk__in=[claim[0] for claim in claimed])\
+                               .update(state=state, updated=timezone.now())
+    return claimed
+
+
 @shared_task
 def check_giles_uploads():
     """
     Periodic task that reviews currently outstanding Giles uploads, and checks
     their status.
-    """
 
-    # for upload_id, username in qs.order_by('updated').values_list('upload_id', 'created_by__username')[:500]:
-    qs = GilesUpload.objects.filter(state=GilesUpload.SENT)
-    _u = 0
-    for upload in qs.order_by('updated')[:100]:
-        upload.state = GilesUpload.ASSIGNED
-        upload.save()
-        check_giles_upload.delay(upload.upload_id, upload.created_by.username)
-        _u += 1
-    logger.debug('assigned %i uploads to check' % _u)
-
-    outstanding = GilesUpload.objects.filter(state__in=GilesUpload.OUTSTANDING)
-    pending = GilesUpload.objects.filter(state=GilesUpload.PENDING)
-
-    # We limit the number of simultaneous requests to Giles.
-    remaining = settings.MAX_GILES_UPLOADS - outstanding.count()
-    logger.debug("there are %i GilesUploads pending and %i outstanding, with %i"
-                 " remaining to be enqueued" %\
-                 (pending.count(), outstanding.count(), remaining))
-    if remaining <= 0 or pending.count() == 0:
+    Uploads are claimed in bulk (see :func:`._claim_uploads`\), so several
+    instances of this task can run at once. The number of outstanding uploads
+    is limited by an adaptive window (see :mod:`cookies.uploadwindow`\), which
+    may briefly be exceeded if they do.
+    """
+    # Uploads are polled on a backoff schedule (see giles.process_upload).
+    due = Q(next_check_at__isnull=True) | Q(next_check_at__lte=timezone.now())
+    to_check = _claim_uploads(GilesUpload.objects.filter(due, state=GilesUpload.SENT)\
+                                                 .order_by('updated'),
+                              GilesUpload.ASSIGNED, 100)
+
+    # We limit the number of simultaneous requests to Giles, depending on how
+    #  well it is keeping up.
+    outstanding = GilesUpload.objects.filter(state__in=GilesUpload.OUTSTANDING).count()
+    remaining = uploadwindow.UploadWindow().update(outstanding) - outstanding
+    to_send = _claim_uploads(GilesUpload.objects.filter(state=GilesUpload.PENDING)\
+                                                .order_by('-priority', 'id'),
+                             GilesUpload.ENQUEUED, remaining)
+    logger.debug("assigned %i uploads to check; there are %i outstanding, and"
+                 " %i uploads were enqueued" % (len(to_check), outstanding,
+                                                len(to_send)))
+    if not (to_check or to_send):
         return
 
-    _e = 0
-    for upload in pending.order_by('priority')[:remaining]:
-        priority = GILESUPLOAD_CELERY_PRIORITY_MAP.get(upload.priority, CELERY_PRIORITY_LOW)
+    user_ids = {claim[2] for claim in to_check + to_send}
+    usernames = dict(User.objects.filter(pk__in=user_ids).values_list('id', 'username'))
+
+    for _, upload_id, user_id, _ in to_check:
+        check_giles_upload.delay(upload_id, usernames[user_id])
+
+    for pk, _, user_id, upload_priority in to_send:
+        priority = GILESUPLOAD_CELERY_PRIORITY_MAP.get(upload_priority, CELERY_PRIORITY_LOW)
         # FIXME: Celery's support for 'priority' on Redis backend isn't clear.
         # Revisit after https://github.com/celery/celery/issues/4028 is
         # resolved and Amphora's celery version is updated.
-        send_to_giles.apply_async(args=(upload.id, upload.created_by),
+        send_to_giles.apply_async(args=(pk, usernames[user_id]),
                                   kwargs={},
                                   priority=priority)
-        upload.state = GilesUpload.ENQUEUED
-        upload.save()
-        _e += 1
-    logger.debug('enqueued %i uploads to send' % _e)
 
 
-    q = Q(last_checked__gte=timezone.now() - timedelta(seconds=300)) | Q(last_checked=None)#.filter(q)
+@task(name='jars.tasks.warm_collection_cache', bind=True)
+def warm_collection_cache(self, collection_id, user_id, job=None, workers=None):
+    """
+    Fill the remote content cache for a :class:`.Collection`\. See
+    :func:`cookies.aggregate.warm_collection`\.
+
+    Parameters
+    ----------
+    collection_id : int
+    user_id : int
+        Only content that this user can view is fetched.
+    job : :class:`.UserJob`
+        Used to update progress.
+    workers : int
+        (optional) Number of concurrent fetches.
+    """
+    if job:
+        job.result_id = self.request.id
+        job.save()
+
+    collection = Collection.objects.get(pk=collection_id)
+    user = User.objects.get(pk=user_id)
+
+    # Saving the job after every item would add a write per page.
+    state = {'saved': 0.}
+    def update_progress(done, total):
+        progress = float(done) / total
+        if job and (progress - state['saved'] >= 0.01 or done == total):
+            job.progress = state['saved'] = progress
+            job.save()
+
+    result = aggregate.warm_collection(user, collection, workers=workers,
+                                       callback=update_progress)
+    logger.debug('warm_collection_cache for collection %i: %s' % (collection_id, str(result)))
+    if job:
+        job.progress = 1.
+        job.result = jsonpickle.encode({'view': 'collection', 'id': collection.id})
+        job.save()
+    return result
+
+
+def _open_for_writing(storage, name):
+    """
+    Open a file in ``storage`` for writing, creating its directory first if
+    the storage is on the local filesystem.
+    """
+    try:
+        directory = os.path.dirname(storage.path(name))
+    except NotImplementedError:    # Remote storage has no directories.
+        pass
+    else:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    return storage.open(name, 'wb')
 
 
 @task(name='jars.tasks.create_snapshot_async', bind=True)
@@ -221,38 +299,12 @@ def create_snapshot_async(self, dataset_id, snapshot_id, export_structure, job=N
     snapshot = DatasetSnapshot.objects.get(pk=snapshot_id)
 
     user = snapshot.created_by
-    if dataset.dataset_type == Dataset.EXPLICIT:
-        containers = authorization.apply_filter(ResourceAuthorization.VIEW, user,
-                                                dataset.resources.all())
-        collections = Collection.objects.none()
-    else:
-        collections, containers = apply_dataset_filters(user, dataset.filter_parameters)
-
     snapshot.state = DatasetSnapshot.IN_PROGRESS
     snapshot.save()
 
-    methods = {
-        'flat': aggregate.export_zip,
-        'collection': aggregate.export_with_collection_structure,
-        'parts': aggregate.export_with_resource_structure,
-    }
-
     with transaction.atomic():
         now = timezone.now().strftime('%Y-%m-%d-%H-%m-%s')
         fname = 'dataset-%s-%s.zip' % (slugify(dataset.name), now)
-        target_path = os.path.join(settings.MEDIA_ROOT, 'upload', fname)
-        object_iterator = chain(containers, (container for collection in collections
-                                             for container in aggregate.get_collection_containers(user, collection)))
-        if snapshot.has_content:
-            methods[export_structure]((obj.primary for obj in object_iterator if obj.primary),
-                                      target_path,
-                                      content_type=snapshot.content_type.split(','),
-                                      has_metadata=snapshot.has_metadata,
-                                     )
-        else:
-            aggregate.export_metadata((obj.primary for obj in object_iterator if obj.primary),
-                                      target_path,
-                                     )
 
         container = ResourceContainer.objects.create(created_by=snapshot.created_by)
         resource = Resource.objects.create(
@@ -278,11 +330,26 @@ def create_snapshot_async(self, dataset_id, snapshot_id, export_structure, job=N
             created_by = snapshot.created_by,
             container = container
         )
+
+        # The archive is written once, directly to its final location.
+        storage = content.file.storage
+        target_path = storage.get_available_name(content.file.field.generate_filename(content, fname))
         logging.debug('tasks.create_snapshot_async: export to %s' % (target_path))
-        with open(target_path, 'r') as f:
-            archive = File(f)
-            content.file = archive
-            content.save()
+        object_iterator = aggregate.get_dataset_containers(user, dataset)
+        with _open_for_writing(storage, target_path) as target:
+            if snapshot.has_content:
+                aggregate.export_zip((obj.primary for obj in object_iterator if obj.primary),
+                                     target,
+                                     fname=aggregate.EXPORT_STRUCTURES.get(export_structure, aggregate.get_filename),
+                                     content_type=snapshot.content_type.split(','),
+                                     has_metadata=snapshot.has_metadata,
+                                    )
+            else:
+                aggregate.export_metadata((obj.primary for obj in object_iterator if obj.primary),
+                                          target,
+                                         )
+        content.file.name = target_path
+        content.save()
         logging.debug('tasks.create_snapshot_async: export complete')
         snapshot.resource = resource
         snapshot.state = DatasetSnapshot.DONE
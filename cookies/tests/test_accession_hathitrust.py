@@ -26,7 +26,7 @@ class TestHathiTrust(unittest.TestCase):
         Relation.objects.all().delete()
         ResourceContainer.objects.all().delete()
 
-    @mock.patch('requests.get')
+    @mock.patch('cookies.accession.hathitrust.session.get')
     def test_get_content_metadata(self, mock_get):
         identifier = 'njp.32101044814968'
         with open('cookies/tests/data/hathitrust_volume_metadata.json') as f:
@@ -37,7 +37,7 @@ class TestHathiTrust(unittest.TestCase):
         self.assertIsInstance(data, dict)
         self.assertEqual(mock_get.call_count, 1)
 
-    @mock.patch('requests.get')
+    @mock.patch('cookies.accession.hathitrust.session.get')
     def test_get_metadata(self, mock_get):
         identifier = 'njp.32101044814968'
         with open('cookies/tests/data/hathitrust_brief_volume_metadata.json') as f:
@@ -48,7 +48,7 @@ class TestHathiTrust(unittest.TestCase):
         self.assertEqual(len(data), 2)
         self.assertEqual(mock_get.call_count, 1)
 
-    @mock.patch('requests.get')
+    @mock.patch('cookies.accession.hathitrust.session.get')
     def test_process_metadata(self, mock_get):
         identifier = 'wu.89069276731'
         with open('cookies/tests/data/hathitrust_brief_volume_metadata.json') as f:
@@ -65,7 +65,7 @@ class TestHathiTrust(unittest.TestCase):
                     'entity_type']:
             self.assertIn(key, data)
 
-    @mock.patch('requests.get')
+    @mock.patch('cookies.accession.hathitrust.session.get')
     def test_process_content_metadata(self, mock_get):
         identifier = 'hvd.32044106431737'
         side_effects = []
@@ -79,7 +79,7 @@ class TestHathiTrust(unittest.TestCase):
         data = ingest.next()
         self.assertIsInstance(data, dict)
 
-    @mock.patch('requests.get')
+    @mock.patch('cookies.accession.hathitrust.session.get')
     def test_ingest(self, mock_get):
         identifier = 'hvd.32044106431737'
         side_effects = []
@@ -1,6 +1,7 @@
 import unittest, mock, shutil, tempfile, os
 from cookies import aggregate
 from cookies.models import *
+from cookies.exceptions import RemoteUnavailable
 from django.db import transaction
 
 
@@ -52,6 +53,21 @@ class TestAggregate(unittest.TestCase):
     #         self.assertIsInstance(obj, Resource)
     #         self.assertTrue(obj.content_resource)
 
+    def test_aggregate_content_resources_order(self):
+        """
+        Content for each resource is followed by the content for its parts,
+        depth-first, using a constant number of queries.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        qs = Resource.objects.filter(is_primary_for__isnull=False).order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            locations = [r.location for r in aggregate.aggregate_content_resources(qs)]
+        expected = ['http://asdf.com/0.txt', 'http://asdf.com/1.txt',
+                    'http://asdf.com/2_0.txt', 'http://asdf.com/2_1.txt']
+        self.assertEqual(locations, expected * 2)
+        self.assertLessEqual(len(queries.captured_queries), 4)
+
     def test_aggregate_content_resources_ctype(self):
         """
         Specifying ``content_type`` will limit to those with the correct
@@ -91,6 +107,27 @@ class TestAggregate(unittest.TestCase):
         for raw in agg:
             self.assertEqual(raw, secret_message[:2])
 
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_warm_collection(self, mock_get):
+        """
+        Only uncached external content is fetched, and progress is reported.
+        """
+        mock_get.return_value = 'content'
+        aggregate.cache.clear()
+        aggregate.cache.set('http://asdf.com/0.txt', 'content')
+        progress = []
+        result = aggregate.warm_collection(self.user, self.collection,
+                                           callback=lambda *args: progress.append(args))
+        self.assertEqual(result, {'total': 4, 'cached': 1, 'fetched': 3, 'failed': 0})
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertTrue(aggregate.cache.has_key('http://asdf.com/2_1.txt'))
+
+        result = aggregate.warm_collection(self.user, self.collection)
+        self.assertEqual(result['cached'], 4)
+        self.assertEqual(mock_get.call_count, 3)
+        aggregate.cache.clear()
+
     @mock.patch('cookies.accession.WebRemote.get')
     def test_export(self, mock_get):
         """
@@ -149,6 +186,127 @@ class TestAggregate(unittest.TestCase):
                              content_type='text/plain')
         # TODO: actually open and evaluate the archive contents.
 
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_stream_zip(self, mock_get):
+        """
+        :func:`.stream_zip` yields a valid archive, in pieces.
+        """
+        import zipfile, cStringIO
+        secret_message = 'nananana, hey hey'
+        mock_get.return_value = secret_message
+        fname = lambda resource: '%i.txt' % resource.id
+
+        qs = Resource.objects.filter(is_primary_for__isnull=False)
+        chunks = list(aggregate.stream_zip(qs, fname=fname, content_type='text/plain'))
+        self.assertGreater(len(chunks), 1)
+        archive = zipfile.ZipFile(cStringIO.StringIO(''.join(chunks)))
+        names = archive.namelist()
+        self.assertIn('amphora/index.csv', names)
+        self.assertIn('amphora/MANIFEST.txt', names)
+        content = [name for name in names if not name.endswith('.csv') and not name.endswith('MANIFEST.txt')]
+        self.assertEqual(len(content), Resource.objects.filter(content_resource=True, content_type='text/plain').count())
+        for name in content:
+            self.assertEqual(archive.read(name), secret_message)
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_stream_zip_without_content(self, mock_get):
+        """
+        Without content, :func:`.stream_zip` yields only metadata.
+        """
+        import zipfile, cStringIO
+        qs = Resource.objects.filter(is_primary_for__isnull=False)
+        data = ''.join(aggregate.stream_zip(qs, has_content=False, has_metadata=True))
+        archive = zipfile.ZipFile(cStringIO.StringIO(data))
+        self.assertEqual(archive.namelist(), ['amphora/metadata.csv'])
+        self.assertFalse(mock_get.called)
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_export_dataset_without_content(self, mock_get):
+        """
+        The streamed dataset export leaves out content if it isn't requested.
+        """
+        import zipfile, cStringIO
+        from django.test import RequestFactory
+        from cookies.views.resource import export_dataset
+        dataset = Dataset.objects.create(name='dataset', created_by=self.user,
+                                         dataset_type=Dataset.EXPLICIT)
+        dataset.resources.add(self.container, self.container2)
+        request = RequestFactory().get('/', {'include_metadata': 'on'})
+        request.user = self.user
+        response = export_dataset(request, dataset.id)
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(cStringIO.StringIO(''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['amphora/metadata.csv'])
+        self.assertFalse(mock_get.called)
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_stream_zip_metadata(self, mock_get):
+        """
+        Metadata for the exported content is written in batches as the
+        archive is written.
+        """
+        import zipfile, cStringIO
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        mock_get.return_value = 'nananana, hey hey'
+        qs = Resource.objects.filter(is_primary_for__isnull=False)
+        with CaptureQueriesContext(connection) as queries:
+            with mock.patch('cookies.aggregate.METADATA_BATCH_SIZE', 3):
+                data = ''.join(aggregate.stream_zip(qs, has_metadata=True))
+        archive = zipfile.ZipFile(cStringIO.StringIO(data))
+
+        content = Resource.objects.filter(content_resource=True).order_by('id')
+        expected = cStringIO.StringIO()
+        aggregate.write_metadata_csv(expected, write_header=True, resources=content)
+        self.assertEqual(sorted(archive.read('amphora/metadata.csv').splitlines()),
+                         sorted(expected.getvalue().splitlines()))
+        loads = [query for query in queries.captured_queries
+                 if 'FROM "cookies_relation"' in query['sql']
+                 and '"source_instance_id" IN' in query['sql']]
+        self.assertEqual(len(loads), (content.count() + 2) // 3)    # One per batch.
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_stream_zip_closed_early(self, mock_get):
+        """
+        The spooled index and metadata are closed if the client goes away
+        before the archive is finished.
+        """
+        import tempfile
+        mock_get.return_value = 'nananana, hey hey'
+        spooled = []
+
+        def spooled_file():
+            spooled.append(tempfile.SpooledTemporaryFile())
+            return spooled[-1]
+
+        qs = Resource.objects.filter(is_primary_for__isnull=False)
+        with mock.patch('cookies.aggregate.spooled_file', spooled_file):
+            chunks = aggregate.stream_zip(qs, has_metadata=True)
+            next(chunks)
+            next(chunks)
+            chunks.close()
+        self.assertEqual(len(spooled), 2)
+        self.assertTrue(all(f.closed for f in spooled))
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_export_spooled_index(self, mock_get):
+        """
+        The index and metadata are complete even if they are spooled to disk.
+        """
+        import zipfile, cStringIO
+        from django.test import override_settings
+        mock_get.return_value = 'nananana, hey hey'
+        fname = lambda resource: '%i.txt' % resource.id
+
+        qs = Resource.objects.filter(is_primary_for__isnull=False)
+        with override_settings(EXPORT_SPOOL_MAX_SIZE=16):
+            data = ''.join(aggregate.stream_zip(qs, fname=fname, has_metadata=True,
+                                                content_type='text/plain'))
+        archive = zipfile.ZipFile(cStringIO.StringIO(data))
+        index = archive.read('amphora/index.csv').splitlines()
+        self.assertEqual(len(index) - 1, Resource.objects.filter(content_resource=True, content_type='text/plain').count())
+        self.assertIn('amphora/metadata.csv', archive.namelist())
+
     @mock.patch('cookies.accession.WebRemote.get')
     def test_export_collection(self, mock_get):
         """
@@ -177,5 +335,227 @@ class TestAggregate(unittest.TestCase):
         # TODO: actually open and evaluate the archive contents.
 
     def tearDown(self):
-        for model in [Resource, Relation, ContentRelation, ResourceContainer, User]:
+        for model in [Dataset, Resource, Relation, ContentRelation, ResourceContainer, User]:
+            model.objects.all().delete()
+
+
+class TestCollectionStructure(unittest.TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='bob')
+        self.root = Collection.objects.create(name='root', created_by=self.user)
+        self.child = Collection.objects.create(name='child', part_of=self.root, created_by=self.user)
+        self.grandchild = Collection.objects.create(name='grandchild', part_of=self.child, created_by=self.user)
+        self.hidden = Collection.objects.create(name='hidden', part_of=self.root, hidden=True, created_by=self.user)
+        self.containers = []
+        for collection in [self.root, self.child, self.grandchild, self.hidden]:
+            container = ResourceContainer.objects.create(created_by=self.user, part_of=collection)
+            container.primary = Resource.objects.create(name='in %s' % collection.name,
+                                                        container=container,
+                                                        created_by=self.user)
+            container.save()
+            self.containers.append(container)
+
+    def test_size(self):
+        self.assertEqual(self.root.size, 4)
+        self.assertEqual(self.child.size, 2)
+        self.assertEqual(set(self.root.children),
+                         {self.root.id, self.child.id, self.grandchild.id, self.hidden.id})
+
+    def test_move(self):
+        """
+        Moving a collection should move its whole subtree.
+        """
+        child = Collection.objects.get(pk=self.child.id)
+        child.part_of = self.hidden
+        child.save()
+        grandchild = Collection.objects.get(pk=self.grandchild.id)
+        self.assertEqual(grandchild.ancestor_ids,
+                         [self.root.id, self.hidden.id, self.child.id, self.grandchild.id])
+        self.assertEqual(Collection.objects.get(pk=self.hidden.id).size, 3)
+
+    def test_descendants_unsaved(self):
+        """
+        A collection without a path yet has no descendants, rather than all
+        of them.
+        """
+        self.assertEqual(Collection(name='new', created_by=self.user).descendants.count(), 0)
+        self.assertEqual(set(self.child.descendants), {self.child, self.grandchild})
+
+    def test_get_collection_containers(self):
+        """
+        Hidden subcollections (and their contents) are skipped.
+        """
+        containers = list(aggregate.get_collection_containers(self.user, self.root))
+        self.assertEqual(containers, self.containers[:3])
+
+    def test_get_collection_name(self):
+        resource = self.containers[2].primary
+        self.assertEqual(aggregate.get_collection_name(resource),
+                         os.path.join('root', 'child', 'grandchild'))
+
+    def tearDown(self):
+        for model in [Resource, ResourceContainer, Collection, User]:
+            model.objects.all().delete()
+
+
+class TestPrefetchContent(unittest.TestCase):
+    @mock.patch('cookies.aggregate.get_content')
+    def test_order(self, mock_get_content):
+        """
+        Content should be yielded in the same order as the resources, even if
+        it arrives out of order.
+        """
+        import random, time
+        def get_content(resource):
+            time.sleep(random.random() / 100.)
+            return 'content %i' % resource
+        mock_get_content.side_effect = get_content
+
+        results = list(aggregate.prefetch_content(iter(range(20)), workers=4))
+        self.assertEqual(results, [('content %i' % i, i) for i in range(20)])
+
+    @mock.patch('cookies.aggregate.get_content')
+    def test_exception(self, mock_get_content):
+        """
+        Unexpected exceptions in worker threads are raised in the consumer.
+        """
+        mock_get_content.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            list(aggregate.prefetch_content(range(3), workers=2))
+
+    def test_throttle(self):
+        """
+        :class:`.SourceThrottle` limits the number of simultaneous requests.
+        """
+        import threading, time
+        throttle = aggregate.SourceThrottle(2)
+        state = {'current': 0, 'max': 0}
+        lock = threading.Lock()
+        def request():
+            with throttle:
+                with lock:
+                    state['current'] += 1
+                    state['max'] = max(state['max'], state['current'])
+                time.sleep(0.01)
+                with lock:
+                    state['current'] -= 1
+        threads = [threading.Thread(target=request) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(state['max'], 2)
+
+
+class TestMetadataRows(unittest.TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='bob')
+        self.collection = Collection.objects.create(name='collection', created_by=self.user)
+        self.type = Type.objects.create(name='Book', uri='http://test/Book')
+        self.title = Field.objects.create(name='title', uri='http://test/title')
+        self.about = Field.objects.create(name='about', uri='http://test/about')
+        self.concept = ConceptEntity.objects.create(name='a concept', created_by=self.user)
+        self.resources = []
+        for i in xrange(4):
+            container = ResourceContainer.objects.create(created_by=self.user,
+                                                         part_of=self.collection)
+            resource = Resource.objects.create(name='resource %i' % i,
+                                               container=container,
+                                               entity_type=self.type,
+                                               created_by=self.user)
+            Relation.objects.create(source=resource, predicate=self.title,
+                                    target=Value.objects.create(name='title %i' % i),
+                                    container=container)
+            Relation.objects.create(source=resource, predicate=self.about,
+                                    target=self.concept, container=container)
+            self.resources.append(resource)
+
+    def test_rows(self):
+        rows = list(aggregate.metadata_rows(self.resources[:1]))
+        self.assertEqual(len(rows), 2)
+        row = dict(zip(aggregate.METADATA_CSV_HEADER, rows[0]))
+        self.assertEqual(row['resource_name'], 'resource 0')
+        self.assertEqual(row['collection_name'], 'collection')
+        self.assertEqual(row['creator_name'], 'bob')
+        self.assertEqual(row['target'], 'title 0')
+        self.assertIsNone(row['target_uri'])
+        row = dict(zip(aggregate.METADATA_CSV_HEADER, rows[1]))
+        self.assertEqual(row['predicate_uri'], 'http://test/about')
+        self.assertEqual(row['target_uri'], self.concept.uri)
+
+    def test_constant_queries(self):
+        """
+        The number of queries doesn't depend on the number of resources.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(list(aggregate.metadata_rows(self.resources[:1]))), 2)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(list(aggregate.metadata_rows(self.resources))), 8)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def tearDown(self):
+        for model in [Relation, Value, ConceptEntity, Resource, ResourceContainer,
+                      Collection, Field, Type, User]:
+            model.objects.all().delete()
+
+
+class TestRemoteFailures(unittest.TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='bob')
+        container = ResourceContainer.objects.create(created_by=self.user)
+        self.content = Resource.objects.create(content_resource=True,
+                                               is_external=True,
+                                               external_source=Resource.WEB,
+                                               location='http://asdf.com/fail.txt',
+                                               content_type='text/plain',
+                                               container=container,
+                                               created_by=self.user)
+        aggregate.cache.clear()
+        aggregate.failure_cache.clear()
+
+    @mock.patch('cookies.accession.WebRemote.get')
+    def test_negative_cache(self, mock_get):
+        """
+        A location that failed isn't requested again until the failure
+        expires.
+        """
+        mock_get.side_effect = IOError('Connection timed out')
+        self.assertIsInstance(aggregate.get_content(self.content), IOError)
+        content = aggregate.get_content(self.content)
+        self.assertIsInstance(content, RemoteUnavailable)
+        self.assertEqual(mock_get.call_count, 1)
+
+        aggregate.failure_cache.clear()
+        mock_get.side_effect = None
+        mock_get.return_value = 'content'
+        self.assertEqual(aggregate.get_content(self.content), 'content')
+
+    def test_circuit_breaker(self):
+        breaker = aggregate.CircuitBreaker(threshold=0.5, min_requests=4,
+                                           window=60, cooldown=0.05)
+        for failed in [False, True, False]:
+            self.assertTrue(breaker.allow())
+            breaker.record(failed)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)    # 2 of 4 failed.
+        self.assertFalse(breaker.allow())
+
+        import time
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())     # Trial request...
+        self.assertFalse(breaker.allow())    # ...and only one.
+        breaker.record(True)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, aggregate.CircuitBreaker.CLOSED)
+
+    def tearDown(self):
+        aggregate.failure_cache.clear()
+        for model in [Resource, ResourceContainer, User]:
             model.objects.all().delete()
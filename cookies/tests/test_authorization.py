@@ -0,0 +1,188 @@
+import unittest
+
+from django.contrib.auth.models import AnonymousUser
+
+from cookies import authorization as auth
+from cookies.models import *
+
+
+class TestEffectiveAuthorization(unittest.TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.user = User.objects.create(username='user')
+        self.other = User.objects.create(username='other')
+        self.supercollection = Collection.objects.create(name='super', created_by=self.owner)
+        self.collection = Collection.objects.create(name='sub', created_by=self.owner,
+                                                    part_of=self.supercollection)
+        self.container = ResourceContainer.objects.create(created_by=self.owner,
+                                                          part_of=self.collection)
+
+    def _grant(self, obj, user, policy=ResourceAuthorization.ALLOW,
+               action=ResourceAuthorization.VIEW):
+        model = auth._get_auth_model(obj)
+        return model.objects.create(granted_by=self.owner, granted_to=user,
+                                    for_resource=obj, action=action,
+                                    policy=policy)
+
+    def test_no_policies(self):
+        """
+        Only the owner can see a resource when there are no policies.
+        """
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.owner, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, AnonymousUser(), self.container))
+
+    def test_inherited_from_ancestor(self):
+        """
+        Policies on any collection up the ``part_of`` chain apply.
+        """
+        self._grant(self.supercollection, self.user)
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertTrue(auth.check_authorization(CollectionAuthorization.VIEW, self.user, self.collection))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.EDIT, self.user, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.other, self.container))
+
+    def test_deny_overrides_inherited(self):
+        """
+        A DENY policy on the object itself overrides inherited ALLOW policies.
+        """
+        self._grant(self.supercollection, None)
+        self._grant(self.container, self.user, policy=ResourceAuthorization.DENY)
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.other, self.container))
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, AnonymousUser(), self.container))
+
+    def test_policy_deleted(self):
+        policy = self._grant(self.supercollection, self.user)
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        policy.delete()
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+
+    def test_container_moved(self):
+        """
+        Moving a container to another collection changes the policies that
+        apply to it.
+        """
+        self._grant(self.collection, self.user)
+        elsewhere = Collection.objects.create(name='elsewhere', created_by=self.other)
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.other, self.container))
+
+        container = ResourceContainer.objects.get(pk=self.container.id)
+        container.part_of = elsewhere
+        container.save()
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.user, container))
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.other, container))
+
+    def test_apply_filter(self):
+        """
+        :func:`.apply_filter` should agree with :func:`.check_authorization`
+        for policies further up the ``part_of`` chain.
+        """
+        resource = Resource.objects.create(name='resource', container=self.container,
+                                           created_by=self.owner)
+        other_container = ResourceContainer.objects.create(created_by=self.owner,
+                                                           part_of=self.collection)
+        self._grant(self.supercollection, self.user)
+        self._grant(other_container, self.user, policy=ResourceAuthorization.DENY)
+
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, self.user, ResourceContainer.objects.all())
+        self.assertEqual(set(qs), {self.container})
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, self.user, Resource.objects.all())
+        self.assertEqual(list(qs), [resource])
+        qs = auth.apply_filter(CollectionAuthorization.VIEW, self.user, Collection.objects.all())
+        self.assertEqual(set(qs), {self.supercollection, self.collection})
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, self.other, ResourceContainer.objects.all())
+        self.assertEqual(qs.count(), 0)
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, AnonymousUser(), ResourceContainer.objects.all())
+        self.assertEqual(qs.count(), 0)
+
+        self._grant(self.supercollection, None)
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, self.other, ResourceContainer.objects.all())
+        self.assertEqual(qs.count(), 2)
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, self.user, ResourceContainer.objects.all())
+        self.assertEqual(set(qs), {self.container})
+        qs = auth.apply_filter(ResourceAuthorization.VIEW, AnonymousUser(), ResourceContainer.objects.all())
+        self.assertEqual(qs.count(), 2)
+
+    def test_rebuild(self):
+        self._grant(self.supercollection, self.user)
+        EffectiveAuthorization.objects.all().delete()
+        auth.rebuild_effective_authorizations()
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.other, self.container))
+
+    def test_migration(self):
+        """
+        The migration that adds :class:`.EffectiveAuthorization` resolves
+        existing policies.
+        """
+        from importlib import import_module
+        from django.db import connection
+        from django.db.migrations.loader import MigrationLoader
+        from django.test.utils import override_settings
+        migration = import_module('cookies.migrations.0026_effectiveauthorization')
+        key = ('cookies', '0026_effectiveauthorization')
+        with override_settings(MIGRATION_MODULES={}):    # May be disabled for tests.
+            apps = MigrationLoader(connection).project_state(key).apps
+
+        self._grant(self.supercollection, self.user)
+        self._grant(self.collection, None, action=ResourceAuthorization.EDIT)
+        self._grant(self.container, self.other, policy=ResourceAuthorization.DENY,
+                    action=ResourceAuthorization.EDIT)
+        EffectiveAuthorization.objects.all().delete()
+        migration.populate_effective_authorizations(apps, None)
+        self.assertTrue(auth.check_authorization(ResourceAuthorization.VIEW, self.user, self.container))
+        self.assertFalse(auth.check_authorization(ResourceAuthorization.VIEW, self.other, self.container))
+
+        # The migration has its own copy of the rules; it should agree.
+        fields = ('for_collection_id', 'for_container_id', 'action',
+                  'granted_to_id', 'anonymous', 'policy')
+        migrated = set(EffectiveAuthorization.objects.values_list(*fields))
+        auth.rebuild_effective_authorizations()
+        self.assertEqual(migrated, set(EffectiveAuthorization.objects.values_list(*fields)))
+
+    def tearDown(self):
+        for model in [ResourceContainer, Collection, User]:
+            model.objects.all().delete()
+
+
+class TestCheckMany(unittest.TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.user = User.objects.create(username='user')
+        self.collection = Collection.objects.create(name='collection', created_by=self.owner)
+        self.containers = [ResourceContainer.objects.create(created_by=self.owner,
+                                                            part_of=self.collection)
+                           for i in xrange(4)]
+        self.resources = [Resource.objects.create(name='resource %i' % i,
+                                                  container=container,
+                                                  created_by=self.owner)
+                          for i, container in enumerate(self.containers)]
+        CollectionAuthorization.objects.create(granted_by=self.owner,
+                                               granted_to=self.user,
+                                               for_resource=self.collection,
+                                               action=CollectionAuthorization.VIEW,
+                                               policy=CollectionAuthorization.ALLOW)
+        ResourceAuthorization.objects.create(granted_by=self.owner,
+                                             granted_to=self.user,
+                                             for_resource=self.containers[0],
+                                             action=ResourceAuthorization.VIEW,
+                                             policy=ResourceAuthorization.DENY)
+
+    def test_check_many(self):
+        """
+        :func:`.check_many` should agree with :func:`.check_authorization`\.
+        """
+        objs = self.resources + self.containers + [self.collection]
+        for user in [self.owner, self.user, AnonymousUser()]:
+            results = auth.check_many(ResourceAuthorization.VIEW, user, objs)
+            self.assertEqual(len(results), len(objs))
+            for obj in objs:
+                self.assertEqual(results[obj],
+                                 auth.check_authorization(ResourceAuthorization.VIEW, user, obj))
+        self.assertFalse(auth.check_many(ResourceAuthorization.VIEW, self.user, self.resources)[self.resources[0]])
+
+    def tearDown(self):
+        for model in [Resource, ResourceContainer, Collection, User]:
+            model.objects.all().delete()
@@ -0,0 +1,164 @@
+import unittest, tempfile, shutil, os, time, hashlib, threading
+import mock
+
+from cookies.contentcache import TieredContentCache
+
+
+class TestTieredContentCache(unittest.TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.cache = TieredContentCache(self.location, {
+            'TIMEOUT': None,
+            'OPTIONS': {
+                'MAX_SIZE': 1000,
+                'MEMORY_MAX_SIZE': 100,
+                'MEMORY_MAX_ITEM_SIZE': 50,
+            },
+        })
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('http://example.com/1.txt'))
+        self.cache.set('http://example.com/1.txt', 'content')
+        self.assertEqual(self.cache.get('http://example.com/1.txt'), 'content')
+        self.assertTrue(self.cache.has_key('http://example.com/1.txt'))
+        self.assertFalse(self.cache.add('http://example.com/1.txt', 'other'))
+        self.cache.delete('http://example.com/1.txt')
+        self.assertIsNone(self.cache.get('http://example.com/1.txt'))
+
+    def test_content_addressed(self):
+        """
+        Entries are plain files, named by the hash of the key.
+        """
+        self.cache.set('http://example.com/1.txt', 'content')
+        path = self.cache.path('http://example.com/1.txt')
+        self.assertEqual(os.path.basename(path),
+                         hashlib.sha256(self.cache.make_key('http://example.com/1.txt')).hexdigest())
+        with open(path) as f:
+            self.assertEqual(f.read(), 'content')
+        with self.cache.open('http://example.com/1.txt') as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertEqual(self.cache.mmap('http://example.com/1.txt')[:], 'content')
+        self.assertIsNone(self.cache.open('http://example.com/2.txt'))
+
+    def test_served_from_memory(self):
+        """
+        Small entries are served from memory; large ones are read from disk.
+        """
+        self.cache.set('small', 'x' * 10)
+        self.cache.set('large', 'y' * 60)
+        os.remove(self.cache.path('small'))
+        os.remove(self.cache.path('large'))
+        self.assertEqual(self.cache.get('small'), 'x' * 10)
+        self.assertIsNone(self.cache.get('large'))
+
+    def test_memory_bounded(self):
+        for i in xrange(5):
+            self.cache.set('key %i' % i, str(i) * 40)
+        self.assertLessEqual(self.cache._memory.size, 100)
+
+    def test_disk_bounded(self):
+        """
+        The oldest entries are evicted when the store exceeds ``MAX_SIZE``\.
+        """
+        for i in xrange(12):
+            self.cache.set('key %i' % i, 'z' * 100)
+        self.assertIsNone(self.cache.path('key 0'))
+        self.assertIsNotNone(self.cache.path('key 11'))
+        total = sum(os.path.getsize(os.path.join(root, name))
+                    for root, dirs, files in os.walk(self.location)
+                    for name in files if root != self.location)
+        self.assertLessEqual(total, 1000)
+        self.assertEqual(self.cache.stats()['size'], total)
+
+    def test_running_size(self):
+        """
+        Writes keep a running total rather than summing the index each time.
+        """
+        self.cache.set('key 0', 'z' * 100)
+        with mock.patch.object(self.cache._index, 'total_size',
+                               wraps=self.cache._index.total_size) as total_size:
+            for i in xrange(1, 9):
+                self.cache.set('key %i' % i, 'z' * 100)
+            self.cache.set('key 1', 'z' * 50)    # Replaces an entry.
+            self.assertEqual(total_size.call_count, 0)
+            self.assertEqual(self.cache._size, 850)
+            for i in xrange(9, 12):
+                self.cache.set('key %i' % i, 'z' * 100)
+            self.assertGreater(total_size.call_count, 0)    # After the trim.
+        self.assertEqual(self.cache._size, self.cache._index.total_size())
+        self.assertLessEqual(self.cache._size, 1000)
+
+    def test_stats(self):
+        self.cache.set('key', 'content')
+        self.cache.get('key')
+        self.cache.get('key')
+        self.cache.get('missing')
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['size'], len('content'))
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(self.cache.largest(1)[0][:3], ('key', len('content'), 2))
+
+    def test_trim_lfu(self):
+        """
+        With the LFU policy, frequently-used entries survive a trim.
+        """
+        for i in xrange(5):
+            self.cache.set('key %i' % i, 'z' * 100)
+        for i in xrange(3):
+            self.cache.get('key 0')
+        count, size = self.cache.trim(200, policy='lfu')
+        self.assertEqual((count, size), (3, 300))
+        self.assertIsNotNone(self.cache.path('key 0'))
+        self.assertIsNotNone(self.cache.path('key 4'))
+        self.assertEqual(self.cache.stats()['size'], 200)
+
+    def test_sync(self):
+        self.cache.set('key 0', 'content')
+        self.cache.set('key 1', 'content')
+        os.remove(self.cache.path('key 0'))
+        self.cache._index.clear()
+        self.assertEqual(self.cache.sync(), (1, 0))
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_bytes_only(self):
+        with self.assertRaises(TypeError):
+            self.cache.set('key', {'not': 'bytes'})
+
+    def test_get_or_fetch_coalesced(self):
+        """
+        Concurrent misses for the same key share a single fetch.
+        """
+        calls = []
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'content'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_fetch('key', fetch)))
+                   for i in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['content'] * 5)
+        self.assertEqual(self.cache._key_locks._locks, {})
+
+    def test_get_or_fetch_error(self):
+        """
+        If the fetch fails the error is raised, and the next caller tries
+        again.
+        """
+        def fail():
+            raise IOError('upstream is down')
+        with self.assertRaises(IOError):
+            self.cache.get_or_fetch('key', fail)
+        self.assertEqual(self.cache.get_or_fetch('key', lambda: 'content'), 'content')
+        self.assertIsNone(self.cache.get_or_fetch('other', lambda: None))
+        self.assertIsNone(self.cache.path('other'))
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
@@ -209,22 +209,33 @@ class CreateGilesUpload(unittest.TestCase):
         Sends a file indicated in a :class:`.GilesUpload` to Giles.
         """
         upload_id = "PROGQ3Fm2J"
-        mock_post.return_value = MockDataResponse(200, {
-            "id": upload_id,
-            "checkUrl":"http://giles/giles/rest/files/upload/check/PROGQ3Fm2J"
-        })
+        sent = {}
+
+        def _post(path, headers=None, data=None):
+            sent['headers'] = headers
+            sent['body'] = ''.join(data)    # Streamed, as requests would.
+            return MockDataResponse(200, {
+                "id": upload_id,
+                "checkUrl":"http://giles/giles/rest/files/upload/check/PROGQ3Fm2J"
+            })
+        mock_post.side_effect = _post
+
+        self.content_relation.content_type = 'text/plain'
+        self.content_relation.save()
         pk = giles.create_giles_upload(self.resource.id, self.content_relation.id, self.user.username)
         upload = GilesUpload.objects.get(pk=pk)
+        self.assertEqual(upload.content_type, 'text/plain')
         giles.send_giles_upload(pk, self.user.username)
 
         upload.refresh_from_db()
         self.assertEqual(upload.state, GilesUpload.SENT)
         self.assertEqual(upload.upload_id, upload_id)
+        self.assertEqual(upload.bytes_sent, 4)
         self.assertEqual(mock_post.call_count, 1)
-        args, kwargs = mock_post.call_args
-        self.assertIn('files', kwargs)
-        self.assertIn('data', kwargs)
-        self.assertIn('headers', kwargs)
+        self.assertTrue(sent['headers']['Content-Type'].startswith('multipart/form-data; boundary='))
+        self.assertIn('Authorization', sent['headers'])
+        self.assertIn('Content-Type: text/plain\r\n\r\nasdf\r\n', sent['body'])
+        self.assertIn('name="access"\r\n\r\nPRIVATE\r\n', sent['body'])
 
     @mock.patch('cookies.giles.POST')
     def test_send_to_giles_500(self, mock_post):
@@ -313,6 +324,30 @@ class CreateGilesUpload(unittest.TestCase):
         self.assertIn('headers', kwargs)
         self.assertIn('Authorization', kwargs['headers'])
 
+    @mock.patch('cookies.giles.POST')
+    @mock.patch('cookies.giles.GET')
+    def test_poll_schedule(self, mock_get, mock_post):
+        """
+        The first poll is scheduled after the expected processing time, and
+        the interval doubles each time Giles is still processing the upload.
+        """
+        upload_id = "PROGQ3Fm2J"
+        mock_post.return_value = MockDataResponse(200, {"id": upload_id})
+        mock_get.return_value = MockDataResponse(202, {"msgCode": "010"})
+        pk = giles.create_giles_upload(self.resource.id, self.content_relation.id, self.user.username)
+        giles.send_giles_upload(pk, self.user.username)
+        upload = GilesUpload.objects.get(pk=pk)
+        self.assertEqual(upload.file_size, 4)
+        self.assertEqual((upload.next_check_at - upload.sent).total_seconds(),
+                         giles.estimate_processing_time(4))
+
+        for i in xrange(3):
+            giles.process_upload(upload_id, self.user.username)
+        upload.refresh_from_db()
+        self.assertEqual(upload.check_count, 3)
+        self.assertEqual((upload.next_check_at - upload.last_checked).total_seconds(),
+                         giles.poll_interval(2))
+
 
     @mock.patch('cookies.giles.POST')
     @mock.patch('cookies.giles.GET')
@@ -523,6 +558,62 @@ class CreateGilesUpload(unittest.TestCase):
         for cr in upload.resource.content.all():
             self.assertFalse(cr.content_resource.public)
 
+    @mock.patch('cookies.giles.POST')
+    def test_send_duplicate(self, mock_post):
+        """
+        If Giles has already processed the same file, its response is reused
+        rather than sending the file again.
+        """
+        import hashlib, jsonpickle
+        from django.core.files import File
+        from cookies.management.commands import benchmark_giles_pages
+        for uri in benchmark_giles_pages.TYPES:
+            Type.objects.get_or_create(uri=uri)
+        for uri in benchmark_giles_pages.FIELDS:
+            Field.objects.get_or_create(uri=uri)
+
+        mock_post.return_value = MockDataResponse(200, {'id': 'PROGfirst'})
+        pk = giles.create_giles_upload(self.resource.id, self.content_relation.id, self.user.username)
+        self.assertIsNone(GilesUpload.objects.get(pk=pk).content_sha256)
+        giles.send_giles_upload(pk, self.user.username)    # Hashed by the worker.
+        first = GilesUpload.objects.get(pk=pk)
+        self.content_resource.refresh_from_db()
+        self.assertEqual(self.content_resource.content_sha256, hashlib.sha256('asdf').hexdigest())
+        self.assertEqual(first.content_sha256, self.content_resource.content_sha256)
+        self.assertEqual(mock_post.call_count, 1)
+        data = benchmark_giles_pages.synthetic_giles_response('DOCfirst', 3)
+        first.upload_id = data['uploadId']
+        first.state = GilesUpload.DONE
+        first.message = jsonpickle.encode(data)
+        first.save()
+
+        resource = Resource.objects.create(name='copy', created_by=self.user)
+        container = ResourceContainer.objects.create(primary=resource, created_by=self.user)
+        resource.container = container
+        resource.save()
+        with open(self.file_path, 'r') as f:
+            content_resource = Resource.objects.create(content_resource=True, file=File(f), created_by=self.user, container=container)
+        content_relation = ContentRelation.objects.create(for_resource=resource, content_resource=content_resource, created_by=self.user, container=container)
+        pk = giles.create_giles_upload(resource.id, content_relation.id, self.user.username)
+        fpath = GilesUpload.objects.get(pk=pk).file_path
+        giles.send_giles_upload(pk, self.user.username)
+
+        self.assertEqual(mock_post.call_count, 1)
+        upload = GilesUpload.objects.get(pk=pk)
+        self.assertEqual(upload.state, GilesUpload.DONE)
+        self.assertEqual(upload.duplicate_of, first)
+        self.assertEqual(resource.parts.count(), 3)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, fpath)))
+
+        # Another user's upload of the same file is sent as usual.
+        other = User.objects.create(username='Alice')
+        GilesToken.objects.create(for_user=other, token='qwer5678')
+        upload.pk = None
+        upload.created_by = other
+        upload.state = GilesUpload.PENDING
+        upload.duplicate_of = None
+        upload.save()
+        self.assertIsNone(giles.find_processed_duplicate(upload))
 
     def tearDown(self):
         Resource.objects.all().delete()
@@ -589,6 +680,228 @@ class TestHandleStatusException(unittest.TestCase):
         Field.objects.all().delete()
 
 
+class TestPollSchedule(unittest.TestCase):
+    def setUp(self):
+        GilesObservation.objects.all().delete()
+
+    def test_estimate_processing_time(self):
+        with self.settings(GILES_POLL_MIN=15, GILES_POLL_MAX=3600, GILES_POLL_DEFAULT=60):
+            self.assertEqual(giles.estimate_processing_time(20000), 60)
+            GilesObservation.objects.create(kind=GilesObservation.PROCESSED,
+                                            duration=100., size=1000)
+            self.assertEqual(giles.estimate_processing_time(20000), 2000)
+            self.assertEqual(giles.estimate_processing_time(10), 15)
+            self.assertEqual(giles.estimate_processing_time(10 ** 6), 3600)
+            self.assertEqual(giles.estimate_processing_time(None), 60)
+
+    def test_estimate_recent(self):
+        """
+        Only recent processing times are used.
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+        with self.settings(GILES_POLL_MIN=15, GILES_POLL_MAX=3600,
+                           GILES_POLL_ESTIMATE_PERIOD=3600):
+            old = GilesObservation.objects.create(kind=GilesObservation.PROCESSED,
+                                                  duration=1000., size=1000)
+            old.created = timezone.now() - timedelta(hours=2)
+            old.save()
+            GilesObservation.objects.create(kind=GilesObservation.PROCESSED,
+                                            duration=100., size=1000)
+            self.assertEqual(giles.estimate_processing_time(2000), 200)
+
+    def test_processing_time(self):
+        """
+        A late poll doesn't inflate the recorded processing time, so the
+        estimate can come down again.
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+        sent = timezone.now()
+        # The first poll (after 120s) found the upload done.
+        self.assertEqual(giles.processing_time(sent, None, sent + timedelta(seconds=120)), 60)
+        # Giles was still processing at 120s, and done at 150s.
+        self.assertEqual(giles.processing_time(sent, sent + timedelta(seconds=120),
+                                               sent + timedelta(seconds=150)), 135)
+
+    def test_poll_interval(self):
+        with self.settings(GILES_POLL_MIN=15, GILES_POLL_MAX=3600):
+            self.assertEqual([giles.poll_interval(i) for i in xrange(4)],
+                             [15, 30, 60, 120])
+            self.assertEqual(giles.poll_interval(20), 3600)
+
+    def settings(self, **kwargs):
+        from django.test.utils import override_settings
+        return override_settings(**kwargs)
+
+    def tearDown(self):
+        GilesObservation.objects.all().delete()
+
+
+class TestCheckGilesUploads(unittest.TestCase):
+    def setUp(self):
+        from cookies import uploadwindow
+        from django.core.cache import caches
+        caches['default'].delete(uploadwindow.CACHE_KEY)
+        GilesUpload.objects.all().delete()
+        self.user = User.objects.create(username='Bob')
+        for i in xrange(3):
+            GilesUpload.objects.create(upload_id='sent %i' % i, created_by=self.user,
+                                       state=GilesUpload.SENT)
+        for priority in [GilesUpload.PRIORITY_LOW, GilesUpload.PRIORITY_HIGH,
+                         GilesUpload.PRIORITY_MEDIUM]:
+            GilesUpload.objects.create(created_by=self.user, priority=priority,
+                                       state=GilesUpload.PENDING)
+
+    @mock.patch('cookies.tasks.send_to_giles.apply_async')
+    @mock.patch('cookies.tasks.check_giles_upload.delay')
+    def test_check_giles_uploads(self, mock_delay, mock_apply_async):
+        """
+        Uploads are claimed in bulk, in a constant number of queries, and
+        pending uploads are sent up to ``MAX_GILES_UPLOADS``\.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext, override_settings
+        from cookies.tasks import check_giles_uploads
+
+        with override_settings(MAX_GILES_UPLOADS=5):
+            with CaptureQueriesContext(connection) as queries:
+                check_giles_uploads()
+        statements = [query['sql'] for query in queries.captured_queries
+                      if not query['sql'].split()[0] in ('SAVEPOINT', 'RELEASE')]
+        self.assertLessEqual(len(statements), 20)    # Regardless of the number of uploads.
+
+        self.assertEqual(GilesUpload.objects.filter(state=GilesUpload.ASSIGNED).count(), 3)
+        self.assertEqual(sorted(call[0] for call, _ in mock_delay.call_args_list),
+                         ['sent 0', 'sent 1', 'sent 2'])
+        self.assertEqual(mock_delay.call_args[0][1], 'Bob')
+
+        # Only two slots were left; the highest priority uploads go first.
+        enqueued = GilesUpload.objects.filter(state=GilesUpload.ENQUEUED)
+        self.assertEqual(set(enqueued.values_list('priority', flat=True)),
+                         {GilesUpload.PRIORITY_HIGH, GilesUpload.PRIORITY_MEDIUM})
+        self.assertEqual(mock_apply_async.call_count, 2)
+
+        # Uploads aren't polled before they are due.
+        from django.utils import timezone
+        from datetime import timedelta
+        GilesUpload.objects.filter(state=GilesUpload.ASSIGNED)\
+                           .update(state=GilesUpload.SENT,
+                                   next_check_at=timezone.now() + timedelta(minutes=5))
+
+        # Nothing is claimed twice.
+        with override_settings(MAX_GILES_UPLOADS=5):
+            check_giles_uploads()
+        self.assertEqual(mock_delay.call_count, 3)
+        self.assertEqual(mock_apply_async.call_count, 2)
+
+    def tearDown(self):
+        GilesUpload.objects.all().delete()
+        User.objects.all().delete()
+
+
+class TestProcessPages(unittest.TestCase):
+    def setUp(self):
+        from cookies.management.commands import benchmark_giles_pages
+        for uri in benchmark_giles_pages.TYPES:
+            Type.objects.get_or_create(uri=uri)
+        for uri in benchmark_giles_pages.FIELDS:
+            Field.objects.get_or_create(uri=uri)
+        self.user = User.objects.create(username='Bob')
+        self.resource = Resource.objects.create(name='document', created_by=self.user)
+        self.container = ResourceContainer.objects.create(primary=self.resource,
+                                                          created_by=self.user)
+        self.resource.container = self.container
+        self.resource.save()
+        self.data = benchmark_giles_pages.synthetic_giles_response('DOCtest', 30)
+
+    def _process(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            giles._GilesDetailsProcessor(None, self.resource, self.user, self.data).process()
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith('UPDATE "cookies_resource"')]
+
+    def _assert_linked(self):
+        pages = [rel.source for rel in self.resource.parts.order_by('sort_order')]
+        self.assertEqual(len(pages), 30)
+        for page, next_page in zip(pages[:-1], pages[1:]):
+            self.assertEqual(page.next_page_id, next_page.id)
+            for content in page.content.all():
+                fmt = content.content_resource.name.rsplit('(', 1)[1][:-1]
+                self.assertEqual(content.content_resource.next_page,
+                                 next_page.content.get(content_resource__name__endswith='(%s)' % fmt).content_resource)
+        self.assertIsNone(pages[-1].next_page)
+
+    def test_next_page(self):
+        """
+        Pages and their content are linked in a constant number of updates,
+        rather than re-saving every earlier page for each new one.
+        """
+        is_link = lambda sql: sql.startswith('UPDATE "cookies_resource" SET "next_page_id"')
+        updates = self._process()
+        self.assertLessEqual(len(filter(is_link, updates)), 2)
+        self.assertLess(len(updates), 5 * 30)    # Linear in the number of pages.
+        self._assert_linked()
+
+        # Processing the same document again doesn't need to change the links.
+        updates = self._process()
+        self.assertFalse(filter(is_link, updates))
+        self._assert_linked()
+
+    def test_bulk_create(self):
+        """
+        Records are written in a number of queries that doesn't depend on the
+        number of pages, and reprocessing the same response writes nothing.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        collection = Collection.objects.create(name='pages', created_by=self.user)
+        self.container.part_of = collection
+        self.container.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            self._process()
+        statements = [query['sql'] for query in queries.captured_queries
+                      if query['sql'].split()[0] not in ('BEGIN', 'SAVEPOINT', 'RELEASE')]
+        self.assertLess(len(statements), 40)    # Rather than several per record.
+        self._assert_linked()
+
+        page = self.resource.parts.first().source
+        self.assertEqual(page.uri, page.generate_uri())
+        text = page.content.get(content_type='text/plain',
+                                content_resource__name__endswith='(text)').content_resource
+        self.assertEqual(text.uri, '%s/files/FILEDOCtest.0.txt' % settings.GILES)
+        self.assertEqual(text.relations_from.get().target.name,
+                         settings.GILES_RESPONSE_CREATOR_MAP['text'])
+        self.assertEqual(collection.counts.get(content_type='image/tiff').count, 30)
+        self.assertEqual(collection.counts.get(content_type='text/plain').count, 61)
+
+        n_resources = Resource.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self._process()
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if query['sql'].split()[0] in ('INSERT', 'UPDATE')])
+        self.assertEqual(Resource.objects.count(), n_resources)
+        collection.delete()
+
+    def test_benchmark(self):
+        from django.core.management import call_command
+        from StringIO import StringIO
+        out = StringIO()
+        call_command('benchmark_giles_pages', pages=10, stdout=out)
+        self.assertIn('10 pages', out.getvalue())
+        self.assertFalse(Resource.objects.filter(name='benchmark').exists())
+
+    def tearDown(self):
+        Resource.objects.all().delete()
+        ContentRelation.objects.all().delete()
+        Relation.objects.all().delete()
+        User.objects.all().delete()
+        Type.objects.all().delete()
+        Field.objects.all().delete()
+
 
 if __name__ == '__main__':
     unittest.main()
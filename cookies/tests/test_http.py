@@ -0,0 +1,66 @@
+import unittest, tempfile, os
+
+from django.test import RequestFactory
+from django.utils.http import http_date
+
+from cookies.http import serve_file
+
+
+class TestServeFile(unittest.TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write('0123456789' * 10)
+
+    def _serve(self, **headers):
+        request = self.factory.get('/', **headers)
+        return serve_file(request, open(self.path, 'rb'), 'text/plain')
+
+    def test_full(self):
+        response = self._serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response.streaming_content), '0123456789' * 10)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        response = self._serve(HTTP_RANGE='bytes=10-14')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(''.join(response.streaming_content), '01234')
+        self.assertEqual(response['Content-Range'], 'bytes 10-14/100')
+        self.assertEqual(response['Content-Length'], '5')
+
+        response = self._serve(HTTP_RANGE='bytes=-3')
+        self.assertEqual(''.join(response.streaming_content), '789')
+        response = self._serve(HTTP_RANGE='bytes=95-')
+        self.assertEqual(''.join(response.streaming_content), '56789')
+
+    def test_range_not_satisfiable(self):
+        response = self._serve(HTTP_RANGE='bytes=200-300')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_range_invalid(self):
+        """
+        A range that ends before it starts is ignored.
+        """
+        response = self._serve(HTTP_RANGE='bytes=5-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response.streaming_content), '0123456789' * 10)
+
+    def test_conditional(self):
+        etag = self._serve()['ETag']
+        self.assertEqual(self._serve(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self._serve(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        since = http_date(os.path.getmtime(self.path) + 10)
+        self.assertEqual(self._serve(HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+
+        # A stale If-Range gets the whole file.
+        response = self._serve(HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        response = self._serve(HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def tearDown(self):
+        os.remove(self.path)
@@ -0,0 +1,54 @@
+import unittest, tempfile
+
+from cookies.multipart import MultipartEncoder
+
+
+class TestMultipartEncoder(unittest.TestCase):
+    def setUp(self):
+        self.file = tempfile.TemporaryFile()
+        self.file.write('x' * 1000)
+        self.file.seek(0)
+
+    def _encoder(self, **kwargs):
+        return MultipartEncoder(
+            fields=[('access', 'PRIVATE')],
+            files=[('files', u'scan.pdf', self.file, 'application/pdf')],
+            boundary='BOUNDARY', **kwargs)
+
+    def test_body(self):
+        body = self._encoder()
+        self.assertEqual(body.content_type,
+                         'multipart/form-data; boundary=BOUNDARY')
+        expected = '\r\n'.join([
+            '--BOUNDARY',
+            'Content-Disposition: form-data; name="access"',
+            '',
+            'PRIVATE',
+            '--BOUNDARY',
+            'Content-Disposition: form-data; name="files"; filename="scan.pdf"',
+            'Content-Type: application/pdf',
+            '',
+            'x' * 1000,
+            '--BOUNDARY--',
+            '',
+        ])
+        self.assertEqual(len(body), len(expected))
+        self.assertEqual(body.read(), expected)
+        self.assertEqual(body.read(), '')
+
+    def test_chunks(self):
+        """
+        The file is read a chunk at a time, and progress is reported as the
+        body is read.
+        """
+        progress = []
+        body = self._encoder(callback=lambda sent, total: progress.append((sent, total)))
+        body.CHUNK_SIZE = 100
+        chunks = list(body)
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual(len(''.join(chunks)), len(body))
+        self.assertEqual(len(progress), len(chunks))
+        self.assertEqual(progress[-1], (len(body), len(body)))
+
+    def tearDown(self):
+        self.file.close()
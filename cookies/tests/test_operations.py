@@ -1,7 +1,6 @@
 """
 """
 
-from django.contrib.contenttypes.models import ContentType
 
 import unittest, mock, json, os
 import networkx as nx
@@ -498,3 +497,88 @@ class TestConceptSearch(unittest.TestCase):
         mock_search.return_value = None
 
         self.assertEqual(remote.concept_search('Bradshaw'), [])
+
+
+class TestCollectionCounts(unittest.TestCase):
+    """
+    :class:`.CollectionCount`\s should stay in sync as resources and
+    collections are added, moved, and removed.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='bob')
+        self.root = Collection.objects.create(name='root', created_by=self.user)
+        self.child = Collection.objects.create(name='child', part_of=self.root,
+                                               created_by=self.user)
+        self.other = Collection.objects.create(name='other', created_by=self.user)
+
+    def _create_container(self, collection, content_types=[]):
+        container = ResourceContainer.objects.create(created_by=self.user,
+                                                     part_of=collection)
+        resource = Resource.objects.create(name='resource', container=container)
+        for content_type in content_types:
+            content = Resource.objects.create(content_resource=True,
+                                              content_type=content_type,
+                                              container=container)
+            ContentRelation.objects.create(for_resource=resource,
+                                           content_resource=content,
+                                           content_type=content_type,
+                                           container=container)
+        return container
+
+    def _reload(self, collection):
+        return Collection.objects.get(pk=collection.id)
+
+    def test_add(self):
+        self._create_container(self.root, ['text/plain'])
+        self._create_container(self.child, ['text/plain', 'application/pdf'])
+        root, child = self._reload(self.root), self._reload(self.child)
+        self.assertEqual(root.size, 2)
+        self.assertEqual(root.resource_count, 1)
+        self.assertEqual(child.size, 1)
+        self.assertEqual(root.content_type_counts,
+                         {'text/plain': 2, 'application/pdf': 1})
+        self.assertEqual(child.content_type_counts,
+                         {'text/plain': 1, 'application/pdf': 1})
+
+    def test_move_and_delete(self):
+        container = self._create_container(self.child, ['text/plain'])
+        container.part_of = self.other
+        container.save()
+        self.assertEqual(self._reload(self.root).size, 0)
+        self.assertEqual(self._reload(self.root).content_type_counts, {})
+        self.assertEqual(self._reload(self.other).content_type_counts,
+                         {'text/plain': 1})
+
+        relation = container.content_relations.first()
+        relation.is_deleted = True
+        relation.save()
+        self.assertEqual(self._reload(self.other).content_type_counts, {})
+
+        container.delete()
+        self.assertEqual(self._reload(self.other).size, 0)
+
+    def test_move_collection(self):
+        self._create_container(self.child, ['text/plain'])
+        child = self._reload(self.child)
+        child.part_of = self.other
+        child.save()
+        self.assertEqual(self._reload(self.root).size, 0)
+        self.assertEqual(self._reload(self.other).size, 1)
+        self.assertEqual(self._reload(self.other).resource_count, 0)
+        self.assertEqual(self._reload(self.other).content_type_counts,
+                         {'text/plain': 1})
+
+    def test_rebuild(self):
+        self._create_container(self.root, ['text/plain'])
+        self._create_container(self.child, ['text/plain'])
+        expected = sorted(CollectionCount.objects.values_list('collection_id', 'content_type',
+                                                              'direct_count', 'count'))
+        CollectionCount.objects.all().update(count=0)
+        operations.rebuild_collection_counts()
+        self.assertEqual(sorted(CollectionCount.objects.values_list('collection_id', 'content_type',
+                                                                    'direct_count', 'count')),
+                         expected)
+
+    def tearDown(self):
+        for model in [Resource, ResourceContainer, Collection, User]:
+            model.objects.all().delete()
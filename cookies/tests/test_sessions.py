@@ -0,0 +1,100 @@
+import unittest, threading, time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import requests
+
+from cookies.sessions import Client, JitteredRetry, SessionRegistry
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'    # Keep-alive.
+    failures = []    # Status codes to respond with before succeeding.
+    delay = 0.
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        status = self.failures.pop(0) if self.failures else 200
+        body = 'ok' if status == 200 else 'nope'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass    # E.g. the client gave up waiting.
+
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        _Handler.failures = []
+        _Handler.delay = 0.
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%i/' % self.server.server_address[1]
+        self.registry = SessionRegistry()
+
+    def test_reuse(self):
+        """
+        Connections are kept alive, and reused by later requests.
+        """
+        client = Client('test', registry=self.registry)
+        for i in xrange(3):
+            self.assertEqual(client.get(self.url).content, 'ok')
+        self.assertEqual(self.registry.stats()['test'],
+                         {'requests': 3, 'connections': 1, 'reused': 2, 'retries': 0})
+
+    def test_retry(self):
+        """
+        Idempotent requests that fail with 503 are retried.
+        """
+        _Handler.failures = [503, 503]
+        session = self.registry.get('test', backoff=0)
+        self.assertEqual(session.get(self.url).status_code, 200)
+        self.assertEqual(self.registry.stats()['test']['retries'], 2)
+
+        _Handler.failures = [503] * 5
+        session = self.registry.get('other', retries=1, backoff=0)
+        self.assertEqual(session.get(self.url).status_code, 503)
+
+    def test_timeout(self):
+        """
+        Requests time out by default.
+        """
+        _Handler.delay = 0.5
+        session = self.registry.get('test', read_timeout=0.1, retries=0)
+        # Read timeouts are wrapped up in MaxRetryError, which requests
+        #  raises as a ConnectionError.
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.get(self.url)
+
+    def test_fork(self):
+        """
+        Sessions aren't shared with forked processes.
+        """
+        session = self.registry.get('test')
+        self.assertIs(self.registry.get('test'), session)
+        self.registry._pid = -1    # As if we were in a child process.
+        self.assertIsNot(self.registry.get('test'), session)
+
+    def test_jitter(self):
+        retry = JitteredRetry(total=5, backoff_factor=1)
+        for i in xrange(3):
+            retry = retry.increment(method='GET', url='/')
+        for i in xrange(20):
+            self.assertTrue(0 <= retry.get_backoff_time() <= 4)
+
+    def tearDown(self):
+        self.registry.close()
+        self.server.shutdown()
+        self.server.server_close()
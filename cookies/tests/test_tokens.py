@@ -0,0 +1,80 @@
+import unittest, mock, time
+
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+
+from cookies.models import GilesToken
+from cookies.tokens import TokenStore
+
+
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.settings = override_settings(GILES_TOKEN_EXPIRATION=120,
+                                          GILES_TOKEN_REFRESH_MARGIN=10)
+        self.settings.enable()
+        User.objects.all().delete()
+        self.user = User.objects.create(username='tokens')
+        self.store = TokenStore()
+        self.store.clear(self.user)
+        self.store.cache.delete(self.store._lock_key(self.user))
+
+    def _age(self, token, minutes):
+        """
+        Pretend that ``token`` was obtained ``minutes`` ago.
+        """
+        self.store._cache(self.user, (token, time.time() - minutes * 60))
+
+    def test_shared(self):
+        """
+        A token obtained by one worker is used by the others.
+        """
+        fetch = mock.Mock(return_value='abc')
+        self.assertEqual(self.store.get(self.user, fetch), 'abc')
+        self.assertEqual(TokenStore().get(self.user, fetch), 'abc')
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(GilesToken.objects.get(for_user=self.user).token, 'abc')
+
+    def test_refresh_before_expiry(self):
+        """
+        Tokens are refreshed within ``GILES_TOKEN_REFRESH_MARGIN`` of expiring.
+        """
+        self._age('old', 100)
+        fetch = mock.Mock(return_value='new')
+        self.assertEqual(self.store.get(self.user, fetch), 'old')
+        self._age('old', 115)
+        self.assertEqual(self.store.get(self.user, fetch), 'new')
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_refresh_in_progress(self):
+        """
+        While another worker is refreshing, a token that hasn't quite expired
+        is still used.
+        """
+        self._age('old', 115)
+        self.store.cache.add(self.store._lock_key(self.user), 1, 30)
+        fetch = mock.Mock(return_value='new')
+        self.assertEqual(self.store.get(self.user, fetch), 'old')
+        self.assertFalse(fetch.called)
+
+    def test_newer_than(self):
+        """
+        A token that Giles has rejected is replaced, even if it should still
+        be good.
+        """
+        self._age('old', 1)
+        fetch = mock.Mock(return_value='new')
+        self.assertEqual(self.store.get(self.user, fetch, newer_than=time.time()), 'new')
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_deleted(self):
+        """
+        Deleting a :class:`.GilesToken` also drops it from the cache.
+        """
+        self.store.get(self.user, lambda: 'abc')
+        GilesToken.objects.filter(for_user=self.user).delete()
+        self.assertIsNone(self.store.peek(self.user))
+
+    def tearDown(self):
+        self.store.clear(self.user)
+        User.objects.all().delete()
+        self.settings.disable()
@@ -0,0 +1,74 @@
+import unittest
+
+from django.test.utils import override_settings
+
+from cookies import uploadwindow
+from cookies.models import GilesObservation
+from cookies.uploadwindow import UploadWindow
+
+
+class TestUploadWindow(unittest.TestCase):
+    def setUp(self):
+        self.settings = override_settings(GILES_WINDOW_MIN=5, MAX_GILES_UPLOADS=100,
+                                          GILES_WINDOW_INITIAL=20, GILES_WINDOW_INCREASE=10,
+                                          GILES_WINDOW_DECREASE=0.5, GILES_WINDOW_MIN_SAMPLES=5,
+                                          GILES_TARGET_LATENCY=10, GILES_MAX_ERROR_RATE=0.1)
+        self.settings.enable()
+        GilesObservation.objects.all().delete()
+        self.window = UploadWindow()
+        self.window.cache.delete(uploadwindow.CACHE_KEY)
+
+    def _record(self, n, kind=GilesObservation.POLL, duration=1., status_code=200):
+        for i in xrange(n):
+            uploadwindow.record(kind, duration, status_code)
+
+    def test_increase(self):
+        """
+        The window grows only while it is full and Giles is keeping up.
+        """
+        self._record(10)
+        self.assertEqual(self.window.size, 20)
+        self.assertEqual(self.window.update(outstanding=20), 30)
+        self.assertEqual(self.window.update(outstanding=10), 30)
+        for i in xrange(10):
+            self.window.update(outstanding=1000)
+        self.assertEqual(self.window.size, 100)
+
+    def test_decrease_on_errors(self):
+        """
+        The window is halved when too many requests fail, and isn't cut again
+        for the same observations.
+        """
+        self._record(8)
+        self._record(2, status_code=503)
+        self.assertEqual(self.window.update(outstanding=20), 10)
+        self.assertEqual(self.window.update(outstanding=20), 10)
+        state = self.window.state()
+        self.assertEqual(state['observations']['errors'], 2)
+        self.assertTrue(state['reason'].startswith('Holding'))
+
+    def test_decrease_on_latency(self):
+        self._record(5, duration=30.)
+        self.assertEqual(self.window.update(outstanding=0), 10)
+
+    def test_decrease_on_processing_time(self):
+        self._record(5, kind=GilesObservation.PROCESSED, duration=60.)
+        self.assertEqual(self.window.update(outstanding=0), 20)
+        self._record(5, kind=GilesObservation.PROCESSED, duration=600.)
+        self.assertEqual(self.window.update(outstanding=0), 10)
+
+    def test_observe(self):
+        class GilesDown(Exception):
+            status_code = 502
+        with self.assertRaises(GilesDown):
+            with uploadwindow.observe(GilesObservation.SEND):
+                raise GilesDown()
+        with uploadwindow.observe(GilesObservation.SEND) as observation:
+            observation['status_code'] = 200
+        self.assertEqual(sorted(GilesObservation.objects.values_list('status_code', flat=True)),
+                         [200, 502])
+
+    def tearDown(self):
+        GilesObservation.objects.all().delete()
+        self.window.cache.delete(uploadwindow.CACHE_KEY)
+        self.settings.disable()
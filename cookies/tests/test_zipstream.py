@@ -0,0 +1,62 @@
+import unittest, zipfile
+from cStringIO import StringIO
+
+from cookies.zipstream import ZipStream, ChunkBuffer
+
+
+class NonSeekable(object):
+    """
+    Accepts writes, but can't seek or tell (like an HTTP response).
+    """
+    def __init__(self):
+        self.buffer = StringIO()
+
+    def write(self, data):
+        self.buffer.write(data)
+
+
+class TestZipStream(unittest.TestCase):
+    def _check(self, data, entries):
+        archive = zipfile.ZipFile(StringIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), [name for name, _ in entries])
+        for name, content in entries:
+            self.assertEqual(archive.read(name), content)
+
+    def test_stored(self):
+        entries = [('amphora/a.txt', 'first'), ('amphora/b.txt', 'second' * 1000),
+                   ('amphora/empty.txt', '')]
+        target = NonSeekable()
+        with ZipStream(target) as archive:
+            for name, content in entries:
+                archive.writestr(name, content)
+        self._check(target.buffer.getvalue(), entries)
+
+    def test_deflated(self):
+        target = NonSeekable()
+        with ZipStream(target, compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write_iter('big.txt', ('chunk %i\n' % i for i in xrange(1000)))
+        self._check(target.buffer.getvalue(),
+                    [('big.txt', ''.join('chunk %i\n' % i for i in xrange(1000)))])
+
+    def test_unicode_name(self):
+        target = NonSeekable()
+        with ZipStream(target) as archive:
+            archive.writestr(u'amphora/caf\xe9.txt', 'content')
+        archive = zipfile.ZipFile(StringIO(target.buffer.getvalue()))
+        self.assertEqual(archive.namelist(), [u'amphora/caf\xe9.txt'])
+
+    def test_chunk_buffer(self):
+        """
+        Draining the buffer after each entry yields the archive in pieces.
+        """
+        buffer = ChunkBuffer()
+        archive = ZipStream(buffer)
+        chunks = []
+        for i in xrange(3):
+            archive.writestr('%i.txt' % i, 'content %i' % i)
+            chunks.append(buffer.drain())
+        archive.close()
+        chunks.append(buffer.drain())
+        self.assertTrue(all(chunks))
+        self._check(''.join(chunks), [('%i.txt' % i, 'content %i' % i) for i in xrange(3)])
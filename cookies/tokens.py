@@ -0,0 +1,142 @@
+"""
+Giles access tokens, shared by all of the processes talking to Giles.
+
+Tokens are kept in the default cache, so that each Giles request doesn't
+have to read one from the database. A token is refreshed a little before it
+expires (``GILES_TOKEN_REFRESH_MARGIN``\), while it can still be used, and
+only one worker refreshes the token for a given user at a time: the others
+keep using the current token or, if there is no usable token, wait for the
+new one. Tokens are also stored as :class:`.GilesToken` instances, so that
+they survive the cache being cleared.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+
+from cookies.models import GilesToken
+
+import calendar, time
+
+logger = settings.LOGGER
+
+
+class TokenStore(object):
+    """
+    Parameters
+    ----------
+    cache : cache backend
+        Defaults to ``caches['default']``\.
+    """
+    LOCK_TIMEOUT = 30       # Seconds; in case a refreshing worker dies.
+    POLL_INTERVAL = 0.1     # Seconds.
+
+    def __init__(self, cache=None):
+        self.cache = cache or caches['default']
+
+    @property
+    def lifetime(self):
+        return int(settings.GILES_TOKEN_EXPIRATION) * 60.
+
+    @property
+    def margin(self):
+        return int(getattr(settings, 'GILES_TOKEN_REFRESH_MARGIN', 10)) * 60.
+
+    def _key(self, user):
+        return 'giles-token:%i' % getattr(user, 'id', user)
+
+    def _lock_key(self, user):
+        return 'giles-token-lock:%i' % user.id
+
+    def peek(self, user):
+        """
+        The stored ``(token, created)`` for ``user``\, or ``None``\.
+        ``created`` is a Unix timestamp.
+        """
+        entry = self.cache.get(self._key(user))
+        if entry is not None:
+            return entry
+        try:    # The cache may have been cleared.
+            stored = GilesToken.objects.get(for_user_id=user.id)
+        except ObjectDoesNotExist:
+            return None
+        entry = (stored.token, calendar.timegm(stored.created.utctimetuple()))
+        self._cache(user, entry)
+        return entry
+
+    def _cache(self, user, entry):
+        timeout = max(int(entry[1] + self.lifetime - time.time()), 1)
+        self.cache.set(self._key(user), entry, timeout)
+
+    def _store(self, user, token):
+        entry = (token, time.time())
+        GilesToken.objects.filter(for_user_id=user.id).delete()
+        GilesToken.objects.create(for_user=user, token=token)
+        self._cache(user, entry)
+        return entry
+
+    def get(self, user, fetch, newer_than=None):
+        """
+        Get a usable access token for ``user``\.
+
+        Parameters
+        ----------
+        user : :class:`django.contrib.auth.models.User`
+        fetch : callable
+            Retrieves a new token from Giles. Only called if the stored token
+            is expired (or about to be), and no other worker is already
+            refreshing it.
+        newer_than : float
+            (optional) Don't accept tokens created before this Unix timestamp,
+            e.g. because Giles rejected a request made after it.
+
+        Returns
+        -------
+        str
+        """
+        entry = self.peek(user)
+        now = time.time()
+
+        def usable(entry, margin=0.):
+            return entry is not None \
+                and entry[1] + self.lifetime - margin > time.time() \
+                and (newer_than is None or entry[1] >= newer_than)
+
+        if usable(entry, self.margin):
+            return entry[0]
+
+        deadline = now + self.LOCK_TIMEOUT
+        locked = False
+        while True:
+            locked = self.cache.add(self._lock_key(user), 1, self.LOCK_TIMEOUT)
+            if locked or time.time() > deadline:
+                break
+            # Someone else is refreshing. If the current token is still good,
+            #  keep using it in the meantime.
+            entry = self.peek(user)
+            if usable(entry):
+                return entry[0]
+            time.sleep(self.POLL_INTERVAL)
+        try:
+            entry = self.peek(user)
+            if usable(entry, self.margin):    # Refreshed while we waited.
+                return entry[0]
+            logger.debug('refreshing Giles token for %s' % user.username)
+            return self._store(user, fetch())[0]
+        finally:
+            if locked:
+                self.cache.delete(self._lock_key(user))
+
+    def invalidate(self, user):
+        """
+        Drop the cached token for ``user`` (a :class:`.User` or its id), so
+        that it is read from the database next time.
+        """
+        self.cache.delete(self._key(user))
+
+    def clear(self, user):
+        GilesToken.objects.filter(for_user_id=user.id).delete()
+        self.invalidate(user)
+
+
+giles_tokens = TokenStore()
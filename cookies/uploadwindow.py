@@ -0,0 +1,235 @@
+"""
+Adaptive limit on the number of outstanding Giles uploads.
+
+The window (the number of uploads that may be enqueued, sent, or waiting on
+Giles at once) is adjusted by :func:`.check_giles_uploads` on each tick,
+additive-increase/multiplicative-decrease (AIMD) style:
+
+* If Giles looks congested -- too many failed requests (HTTP 5xx or 429, or
+  no response), slow responses, or uploads taking much longer than usual to
+  get from SENT to DONE -- the window is cut by ``GILES_WINDOW_DECREASE``\.
+  It won't be cut again until the observations that caused it have aged out.
+* Otherwise, if the window was full, it grows by ``GILES_WINDOW_INCREASE``\.
+
+The window stays between ``GILES_WINDOW_MIN`` and ``MAX_GILES_UPLOADS``\.
+Observations are recorded as :class:`.GilesObservation` instances (see
+:func:`.observe`), so that they are shared by all of the workers talking to
+Giles. The window itself, and the observations used to set it, are kept in
+the default cache.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Avg, Case, Count, IntegerField, Q, Sum, When
+from django.utils import timezone
+
+from cookies.models import GilesObservation
+
+from contextlib import contextmanager
+from datetime import timedelta
+import time
+
+logger = settings.LOGGER
+
+CACHE_KEY = 'giles-upload-window'
+
+
+def record(kind, duration, status_code=None, size=None):
+    """
+    Record a :class:`.GilesObservation`\.
+    """
+    GilesObservation.objects.create(kind=kind, duration=duration,
+                                    status_code=status_code, size=size)
+
+
+@contextmanager
+def observe(kind):
+    """
+    Time a request to Giles, and record its outcome.
+
+    Set ``status_code`` on the yielded dict once the response is in. If an
+    exception is raised, its ``status_code`` (if any) is recorded instead.
+
+    .. code-block:: python
+
+       >>> with observe(GilesObservation.SEND) as observation:
+       ...     code, result = send_to_giles(username, path)
+       ...     observation['status_code'] = code
+
+    """
+    observation = {'status_code': None}
+    start = time.time()
+    try:
+        yield observation
+    except Exception as E:
+        observation['status_code'] = getattr(E, 'status_code', 0)
+        raise
+    finally:
+        try:
+            record(kind, time.time() - start, observation['status_code'])
+        except Exception as E:    # Never let bookkeeping break an upload.
+            logger.error('Could not record Giles observation: %s' % str(E))
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class UploadWindow(object):
+    """
+    The current window, and the logic for adjusting it.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache or caches['default']
+        self.minimum = _setting('GILES_WINDOW_MIN', 5)
+        self.maximum = _setting('MAX_GILES_UPLOADS', 200)
+        self.initial = _setting('GILES_WINDOW_INITIAL', 50)
+        self.increase = _setting('GILES_WINDOW_INCREASE', 10)
+        self.decrease = _setting('GILES_WINDOW_DECREASE', 0.5)
+        self.period = _setting('GILES_WINDOW_PERIOD', 300)
+        self.min_samples = _setting('GILES_WINDOW_MIN_SAMPLES', 5)
+        self.target_latency = _setting('GILES_TARGET_LATENCY', 10.)
+        self.max_error_rate = _setting('GILES_MAX_ERROR_RATE', 0.05)
+        self.max_slowdown = _setting('GILES_MAX_PROCESSING_SLOWDOWN', 2.)
+
+    def state(self):
+        """
+        The current window, along with the observations and the reason for
+        the last adjustment.
+        """
+        state = self.cache.get(CACHE_KEY)
+        if state is None:
+            state = {
+                'window': self._clamp(self.initial),
+                'updated': None,
+                'last_decrease': None,
+                'baseline_processing': None,
+                'observations': {},
+                'reason': 'Initial window',
+            }
+        return state
+
+    @property
+    def size(self):
+        return self.state()['window']
+
+    def _clamp(self, window):
+        return int(max(self.minimum, min(self.maximum, window)))
+
+    def observations(self):
+        """
+        Summarize the :class:`.GilesObservation`\s from the last
+        ``GILES_WINDOW_PERIOD`` seconds, in one query.
+
+        Returns
+        -------
+        dict
+            ``requests``\, ``errors``\, ``error_rate``\, ``latency`` (mean, in
+            seconds), ``processed``\, and ``processing`` (mean SENT to DONE,
+            in seconds).
+        """
+        since = timezone.now() - timedelta(seconds=self.period)
+        failed = Q(status_code=0) | Q(status_code=429) | Q(status_code__gte=500)
+        rows = GilesObservation.objects.filter(created__gte=since)\
+                                       .values('kind')\
+                                       .annotate(n=Count('id'),
+                                                 errors=Sum(Case(When(failed, then=1),
+                                                                 default=0,
+                                                                 output_field=IntegerField())),
+                                                 duration=Avg('duration'))
+        summary = {'requests': 0, 'errors': 0, 'latency': None,
+                   'processed': 0, 'processing': None}
+        total_duration = 0.
+        for row in rows:
+            if row['kind'] == GilesObservation.PROCESSED:
+                summary['processed'] = row['n']
+                summary['processing'] = row['duration']
+            else:
+                summary['requests'] += row['n']
+                summary['errors'] += row['errors'] or 0
+                total_duration += row['duration'] * row['n']
+        if summary['requests']:
+            summary['latency'] = total_duration / summary['requests']
+        summary['error_rate'] = float(summary['errors']) / summary['requests'] \
+                                if summary['requests'] else 0.
+        return summary
+
+    def _congestion(self, observations, baseline):
+        """
+        The reason to think that Giles is congested, if any.
+        """
+        if observations['requests'] >= self.min_samples:
+            if observations['error_rate'] > self.max_error_rate:
+                return 'Error rate %.0f%%' % (100 * observations['error_rate'])
+            if observations['latency'] > self.target_latency:
+                return 'Mean response time %.1fs' % observations['latency']
+        if observations['processed'] >= self.min_samples and baseline \
+                and observations['processing'] > self.max_slowdown * baseline:
+            return 'Mean processing time %.0fs (usually %.0fs)' % (observations['processing'], baseline)
+        return None
+
+    def update(self, outstanding):
+        """
+        Adjust the window based on recent observations.
+
+        Parameters
+        ----------
+        outstanding : int
+            Number of uploads currently outstanding.
+
+        Returns
+        -------
+        int
+            The new window.
+        """
+        state = self.state()
+        now = time.time()
+        observations = self.observations()
+        window = state['window']
+        baseline = state['baseline_processing']
+
+        reason = self._congestion(observations, baseline)
+        if reason is not None:
+            last_decrease = state['last_decrease']
+            if last_decrease is None or now - last_decrease > self.period:
+                window = self._clamp(window * self.decrease)
+                state['last_decrease'] = now
+                reason = 'Decreased: %s' % reason
+            else:
+                reason = 'Holding: %s' % reason
+        elif outstanding >= window:
+            window = self._clamp(window + self.increase)
+            reason = 'Increased: window was full'
+        else:
+            reason = 'Holding: window was not full'
+
+        # The baseline follows processing times slowly, so that a sudden
+        #  slowdown stands out.
+        if observations['processing'] is not None and observations['processed'] >= self.min_samples:
+            if baseline is None:
+                baseline = observations['processing']
+            else:
+                baseline = 0.9 * baseline + 0.1 * observations['processing']
+
+        if window != state['window']:
+            logger.debug('Giles upload window %i -> %i (%s)' % (state['window'], window, reason))
+        state.update({
+            'window': window,
+            'updated': timezone.now(),
+            'baseline_processing': baseline,
+            'observations': observations,
+            'outstanding': outstanding,
+            'reason': reason,
+        })
+        self.cache.set(CACHE_KEY, state, None)
+
+        # Keep only what the next few ticks need, except for processing times,
+        #  which are also used to schedule polling (see
+        #  :func:`cookies.giles.estimate_processing_time`).
+        now = timezone.now()
+        history = _setting('GILES_PROCESSING_HISTORY', 7 * 24 * 3600)
+        expired = Q(created__lt=now - timedelta(seconds=history)) \
+                  | (Q(created__lt=now - timedelta(seconds=2 * self.period))
+                     & ~Q(kind=GilesObservation.PROCESSED))
+        GilesObservation.objects.filter(expired).delete()
+        return window
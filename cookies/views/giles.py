@@ -12,6 +12,7 @@ from cookies import authorization as auth
 from cookies.models import *
 from cookies.forms import ChooseCollectionForm, GilesLogForm, GilesLogItemForm
 from cookies import giles
+from cookies.uploadwindow import UploadWindow
 from cookies.filters import GilesUploadFilter
 
 import pytz
@@ -140,11 +141,12 @@ def test_giles_configuration(request):
 
 @staff_member_required
 def test_giles_is_up(request):
-    import requests
+    from cookies import sessions
     giles = settings.GILES
-    response = requests.head(giles)
+    response = sessions.Client('giles').head(giles)
     context = {
         'response_code': response.status_code,
+        'sessions': sessions.stats(),
     }
     return JsonResponse(context)
 
@@ -316,6 +318,7 @@ def log(request):
         },
         'state_changeable': state_changeable,
         'priority_changeable': priority_changeable,
+        'upload_window': UploadWindow().state(),
     }
     return render(request, 'giles_log.html', context)
 
@@ -3,12 +3,13 @@ from django.contrib.auth.decorators import login_required
 from django.core.cache import caches
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, HttpResponse, JsonResponse, QueryDict
-from django.http import HttpResponseBadRequest, Http404
+from django.http import HttpResponseBadRequest, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, get_list_or_404
 from django.db.models import Q, Max, Count
 from django.db import transaction
 from django.utils.http import urlquote_plus
 from django.utils.encoding import smart_str
+from django.utils.text import slugify
 
 from cookies.models import *
 from cookies.filters import *
@@ -17,11 +18,15 @@ from cookies.tasks import *
 from cookies import giles, operations
 from cookies import authorization as auth
 from cookies.accession import get_remote
+from cookies.exceptions import RemoteUnavailable
+from cookies.contentcache import get_or_fetch
+from cookies.http import serve_file
 from cookies.views_rest import ResourceDetailSerializer, _create_resource_details, _create_resource_file
 from cookies.aggregate import write_metadata_csv, get_collection_containers
+from cookies import aggregate
 
 import hmac, base64, time, urllib, datetime, mimetypes, copy, urlparse
-import os, posixpath
+import os, posixpath, math
 
 from cStringIO import StringIO
 
@@ -751,22 +756,24 @@ def resource_content(request, resource_id):
     else:
         content_type = 'application/octet-stream'
     if resource.file:
-        if not settings.DEVELOP and (content_type in ('application/octet-stream', 'application/zip')):
-            # Serve specific content_type files through Nginx only if the
-            # Django app is not running using 'manage.py runserver'.
-            file_path = resource.file.path
-            file_name = os.path.basename(file_path)
+        file_path = resource.file.path
+        downloads = ('application/octet-stream', 'application/zip')
+        if not settings.DEVELOP and (settings.CONTENT_X_ACCEL or content_type in downloads):
+            # Let Nginx serve the file (including ranges and conditional
+            #  requests) unless the Django app is running using
+            #  'manage.py runserver'.
             response = HttpResponse(content_type=content_type)
-            response['Content-Disposition'] = 'attachment; filename=%s' % (file_name)
-            response['X-Accel-Redirect'] = posixpath.join(settings.MEDIA_URL, smart_str(file_path).lstrip(settings.MEDIA_ROOT))
+            if content_type in downloads:
+                response['Content-Disposition'] = 'attachment; filename=%s' % (os.path.basename(file_path))
+            response['X-Accel-Redirect'] = posixpath.join(settings.MEDIA_URL, smart_str(resource.file.name))
             return response
         else:
             try:
-                with open(resource.file.path, 'rb') as f:
-                    return HttpResponse(f.read(), content_type=content_type)
+                f = open(file_path, 'rb')
             except IOError as e:    # Whoops....
-                logger.exception("Error serving content from '{}': {}".format(resource.file.path, e))
+                logger.exception("Error serving content from '{}': {}".format(file_path, e))
                 return HttpResponse('Hmmm....something went wrong.')
+            return serve_file(request, f, content_type)
     elif resource.location:
         cache = caches['remote_content']
 
@@ -778,11 +785,20 @@ def resource_content(request, resource_id):
         elif resource.external_source == Resource.WEB:
             return HttpResponseRedirect(remote.get(target))
 
-        content = cache.get(resource.location)
-        if not content:
-            content = remote.get(target)
-            if content:
-                cache.set(resource.location, content, None)
+        # Serve straight from the cache file if the backend allows it.
+        cached = cache.open(resource.location) if hasattr(cache, 'open') else None
+        if cached is not None:
+            return serve_file(request, cached, content_type)
+
+        # Only one request fetches a given location at a time; the others
+        #  wait for it to fill the cache.
+        try:
+            content = get_or_fetch(cache, resource.location,
+                                   lambda: aggregate.fetch_remote_content(resource) or None)
+        except RemoteUnavailable as E:
+            response = HttpResponse(E.message, status=503, content_type='text/plain')
+            response['Retry-After'] = int(math.ceil(E.retry_after or 0))
+            return response
         return HttpResponse(content, content_type=resource.content_type)
         # return HttpResponseRedirect(target)
     return HttpResponse('Nope')    # TODO: say something more informative!
@@ -875,11 +891,56 @@ def create_snapshot(request, dataset_id):
 
     context = {
         'dataset': dataset,
-        'form': form
+        'form': form,
+        'can_stream': _dataset_size(request.user, dataset) <= settings.MAX_STREAMING_EXPORT_RESOURCES,
     }
     return render(request, 'create_snapshot.html', context)
 
 
+def _dataset_size(user, dataset):
+    """
+    Number of resources in a dataset that ``user`` can view. Subcollections
+    that are hidden or restricted are included, so this may be an
+    overestimate.
+    """
+    if dataset.dataset_type == Dataset.EXPLICIT:
+        return auth.apply_filter(ResourceAuthorization.VIEW, user,
+                                 dataset.resources.all()).count()
+    collections, containers = apply_dataset_filters(user, dataset.filter_parameters)
+    return containers.count() + sum(collection.size for collection
+                                    in collections.prefetch_related('counts'))
+
+
+@login_required
+def export_dataset(request, dataset_id):
+    """
+    Stream a ZIP archive of the content in a (small) dataset directly to the
+    user, without creating a snapshot. Accepts the same parameters as
+    :func:`.create_snapshot`\.
+
+    Larger datasets are redirected to :func:`.create_snapshot`\.
+    """
+    dataset = get_object_or_404(Dataset, pk=dataset_id)
+    if _dataset_size(request.user, dataset) > settings.MAX_STREAMING_EXPORT_RESOURCES:
+        return HttpResponseRedirect(reverse('snapshot-dataset', args=(dataset.id,)))
+
+    form = SnapshotForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest('Invalid export parameters')
+    content_type = form.cleaned_data.get('content_type', None) or None
+    export_structure = form.cleaned_data.get('export_structure')
+
+    containers = aggregate.get_dataset_containers(request.user, dataset)
+    archive = aggregate.stream_zip((obj.primary for obj in containers if obj.primary),
+                                   fname=aggregate.EXPORT_STRUCTURES.get(export_structure, aggregate.get_filename),
+                                   content_type=content_type,
+                                   has_content=form.cleaned_data.get('include_content'),
+                                   has_metadata=form.cleaned_data.get('include_metadata'))
+    response = StreamingHttpResponse(archive, content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="dataset-%s.zip"' % slugify(dataset.name)
+    return response
+
+
 
 def dataset(request, dataset_id):
     """
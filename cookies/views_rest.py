@@ -15,7 +15,7 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework import pagination
 import django_filters
 
-from django.db.models import Q
+from django.db.models import Q, Manager
 from django.core.exceptions import ObjectDoesNotExist
 
 from cookies.http import HttpResponseUnacceptable, IgnoreClientContentNegotiation
@@ -27,7 +27,7 @@ from collections import OrderedDict
 import cookies.models
 from cookies import authorization, tasks, giles
 from cookies.accession import get_remote
-from cookies.aggregate import aggregate_content_resources, aggregate_content_resources_fast
+from cookies.aggregate import aggregate_content_resources
 from cookies.models import *
 from concepts.models import *
 from cookies.exceptions import *
@@ -67,6 +67,21 @@ class ContentResourceSerializerLight(serializers.HyperlinkedModelSerializer):
             return u""
 
 
+class ContentResourceListSerializer(serializers.ListSerializer):
+    """
+    Resolves authorizations for the whole list up front, so that
+    :meth:`.ContentResourceSerializer.get_content_location` doesn't have to
+    check each item separately.
+    """
+    def to_representation(self, data):
+        request = self.context.get('request')
+        if request is not None:
+            data = list(data.all() if isinstance(data, Manager) else data)
+            self.context['authorizations'] = authorization.check_many(
+                ResourceAuthorization.VIEW, request.user, data)
+        return super(ContentResourceListSerializer, self).to_representation(data)
+
+
 class ContentResourceSerializer(serializers.HyperlinkedModelSerializer):
     content_location = serializers.SerializerMethodField()
     content_for = serializers.SerializerMethodField()
@@ -136,7 +151,12 @@ class ContentResourceSerializer(serializers.HyperlinkedModelSerializer):
             return obj.content_location
 
         url = request.build_absolute_uri(obj.content_location)
-        if authorization.check_authorization(ResourceAuthorization.VIEW, request.user, obj):
+        authorizations = self.context.get('authorizations', {})
+        if obj in authorizations:
+            authorized = authorizations[obj]
+        else:
+            authorized = authorization.check_authorization(ResourceAuthorization.VIEW, request.user, obj)
+        if authorized:
             if obj.external_source == Resource.GILES:
                 remote = get_remote(obj.external_source, obj.created_by)
                 url = remote.sign_uri(obj.location)
@@ -150,6 +170,7 @@ class ContentResourceSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('url', 'id', 'uri', 'name', 'public', 'content_location',
                   'is_external', 'external_source',
                   'content_type', 'content_for', 'next', 'previous')
+        list_serializer_class = ContentResourceListSerializer
 
 
 class ContentRelationListSerializer(serializers.ListSerializer):
@@ -253,12 +274,15 @@ class ResourceDetailSerializer(serializers.HyperlinkedModelSerializer):
         Pulls together all content associated with a resource.
         """
         context = {'request': self.context['request']}
+        by_content_type = OrderedDict()
+        for content in aggregate_content_resources([obj]):
+            by_content_type.setdefault(content.content_type, []).append(content)
         data = [
             {
                 'content_type': content_type,
                 'resources': map(lambda o: ContentResourceSerializerLight(o, context=context).data,
-                                 aggregate_content_resources_fast(obj.container, content_type=content_type))
-            } for content_type in obj.container.content_relations.values_list('content_type', flat=True).distinct('content_type')
+                                 resources)
+            } for content_type, resources in by_content_type.items()
         ]
         return data
 
@@ -350,7 +374,9 @@ class ConceptViewSet(viewsets.ModelViewSet):
 
 class CollectionViewSet(viewsets.ModelViewSet):
     parser_classes = (JSONParser,)
-    queryset = Collection.objects.filter(content_resource=False, hidden=False, part_of__isnull=True)
+    queryset = Collection.objects.filter(content_resource=False, hidden=False, part_of__isnull=True)\
+                                 .select_related('created_by')\
+                                 .prefetch_related('counts')
     serializer_class = CollectionSerializer
     permission_classes = (CollectionPermission,)
 
@@ -368,7 +394,9 @@ class CollectionViewSet(viewsets.ModelViewSet):
         if pk is None:
             queryset = self.get_queryset()
         else:
-            queryset = Collection.objects.filter(content_resource=False, hidden=False)    #
+            queryset = Collection.objects.filter(content_resource=False, hidden=False)\
+                                         .prefetch_related('collection_set__created_by',
+                                                           'collection_set__counts')
         collection = get_object_or_404(queryset, pk=pk)
         if not authorization.check_authorization(CollectionAuthorization.VIEW, request.user, collection):
             return HttpResponseForbidden('Nope')
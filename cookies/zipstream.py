@@ -0,0 +1,223 @@
+"""
+Sequential (streaming) ZIP archive writer.
+
+:class:`zipfile.ZipFile` needs to seek back to each local file header once the
+size and checksum of an entry are known, so in Python 2 it can't write to a
+socket or an HTTP response. :class:`.ZipStream` writes entries one after
+another using data descriptors (general purpose flag bit 3) instead, and
+writes the central directory at the end, so that the target only needs a
+``write()`` method.
+
+Archives larger than 4GB (or with more than 65535 entries) use the Zip64
+extensions, like ``zipfile.ZipFile(..., allowZip64=True)``.
+"""
+
+import struct, time, zlib, zipfile
+
+_DATA_DESCRIPTOR = 1 << 3
+_UTF8 = 1 << 11
+_ZIP32_LIMIT = 0xFFFFFFFF
+_COUNT_LIMIT = 0xFFFF
+
+_stringDataDescriptor = 'PK\x07\x08'
+_structDataDescriptor = '<4sLLL'
+_structDataDescriptor64 = '<4sLQQ'
+
+
+class _Entry(object):
+    def __init__(self, arcname, date_time, compress_type, offset):
+        self.arcname = arcname
+        self.date_time = date_time
+        self.compress_type = compress_type
+        self.offset = offset
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+    @property
+    def filename(self):
+        if isinstance(self.arcname, unicode):
+            return self.arcname.encode('utf-8')
+        return self.arcname
+
+    @property
+    def flags(self):
+        if isinstance(self.arcname, unicode):
+            return _DATA_DESCRIPTOR | _UTF8
+        return _DATA_DESCRIPTOR
+
+    @property
+    def dostime(self):
+        dt = self.date_time
+        return (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2], \
+               dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+
+
+class ZipStream(object):
+    """
+    Write a ZIP archive to a file-like object, without seeking.
+
+    Parameters
+    ----------
+    fileobj : file-like
+        Anything with a ``write()`` method.
+    compression : int
+        ``zipfile.ZIP_STORED`` (default) or ``zipfile.ZIP_DEFLATED``\.
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+       >>> with ZipStream(response) as archive:
+       ...     archive.writestr('amphora/index.csv', index)
+       ...     archive.write_iter('amphora/big.txt', chunks)
+
+    """
+    def __init__(self, fileobj, compression=zipfile.ZIP_STORED):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.entries = []
+        self.offset = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def write_iter(self, arcname, chunks, date_time=None):
+        """
+        Add an entry to the archive from an iterable of byte strings, holding
+        only one chunk in memory at a time.
+
+        Parameters
+        ----------
+        arcname : str or unicode
+            Path of the entry within the archive.
+        chunks : iterable
+        date_time : tuple
+            (optional) ``(year, month, day, hour, minute, second)``\. Defaults
+            to now.
+        """
+        if self.closed:
+            raise ValueError('Attempt to write to a closed ZipStream')
+        if date_time is None:
+            date_time = time.localtime(time.time())[:6]
+        entry = _Entry(arcname, date_time, self.compression, self.offset)
+        filename = entry.filename
+        dosdate, dostime = entry.dostime
+
+        # CRC and sizes go in the data descriptor, after the data.
+        self._write(struct.pack(zipfile.structFileHeader,
+                                zipfile.stringFileHeader, 45, 0, entry.flags,
+                                entry.compress_type, dostime, dosdate, 0, 0, 0,
+                                len(filename), 0))
+        self._write(filename)
+
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+        else:
+            compressor = None
+        for chunk in chunks:
+            if not chunk:
+                continue
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            entry.compress_size += len(chunk)
+            self._write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            entry.compress_size += len(chunk)
+            self._write(chunk)
+        entry.crc &= 0xFFFFFFFF
+
+        if entry.file_size > _ZIP32_LIMIT or entry.compress_size > _ZIP32_LIMIT:
+            fmt = _structDataDescriptor64
+        else:
+            fmt = _structDataDescriptor
+        self._write(struct.pack(fmt, _stringDataDescriptor, entry.crc,
+                                entry.compress_size, entry.file_size))
+        self.entries.append(entry)
+
+    def writestr(self, arcname, data, date_time=None):
+        """
+        Add an entry to the archive from a byte string.
+        """
+        self.write_iter(arcname, [data], date_time=date_time)
+
+    def close(self):
+        """
+        Write the central directory. The underlying file-like object is not
+        closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        start = self.offset
+        for entry in self.entries:
+            filename = entry.filename
+            dosdate, dostime = entry.dostime
+            extra = []
+            file_size, compress_size, offset = entry.file_size, entry.compress_size, entry.offset
+            if file_size > _ZIP32_LIMIT or compress_size > _ZIP32_LIMIT:
+                extra += [file_size, compress_size]
+                file_size = compress_size = _ZIP32_LIMIT
+            if offset > _ZIP32_LIMIT:
+                extra.append(offset)
+                offset = _ZIP32_LIMIT
+            extra_data = ''
+            if extra:
+                extra_data = struct.pack('<HH' + 'Q' * len(extra), 1,
+                                         8 * len(extra), *extra)
+            self._write(struct.pack(zipfile.structCentralDir,
+                                    zipfile.stringCentralDir, 45, 3, 45, 0,
+                                    entry.flags, entry.compress_type,
+                                    dostime, dosdate, entry.crc,
+                                    compress_size, file_size, len(filename),
+                                    len(extra_data), 0, 0, 0, 0o600 << 16,
+                                    offset))
+            self._write(filename)
+            self._write(extra_data)
+
+        count, size = len(self.entries), self.offset - start
+        if count > _COUNT_LIMIT or size > _ZIP32_LIMIT or start > _ZIP32_LIMIT:
+            end64 = self.offset
+            self._write(struct.pack(zipfile.structEndArchive64,
+                                    zipfile.stringEndArchive64, 44, 45, 45,
+                                    0, 0, count, count, size, start))
+            self._write(struct.pack(zipfile.structEndArchive64Locator,
+                                    zipfile.stringEndArchive64Locator, 0,
+                                    end64, 1))
+            count = min(count, _COUNT_LIMIT)
+            size = min(size, _ZIP32_LIMIT)
+            start = min(start, _ZIP32_LIMIT)
+        self._write(struct.pack(zipfile.structEndArchive,
+                                zipfile.stringEndArchive, 0, 0, count, count,
+                                size, start, 0))
+
+
+class ChunkBuffer(object):
+    """
+    Minimal file-like object that collects writes until they are
+    :meth:`.drain`\ed, e.g. to feed a
+    :class:`django.http.StreamingHttpResponse`\.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def drain(self):
+        data, self.chunks = ''.join(self.chunks), []
+        return data
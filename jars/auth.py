@@ -3,9 +3,9 @@ from django.contrib.auth import login, authenticate
 from django.core.cache import caches
 from rest_framework import HTTP_HEADER_ENCODING, exceptions
 
-import requests
 from requests.auth import HTTPBasicAuth
 from cookies.models import *
+from cookies.sessions import Client
 from social_django.models import UserSocialAuth
 from django.conf import settings
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
@@ -53,7 +53,7 @@ class GithubAuthenticationBackend(object):
         cache = caches['default']
         data = cache.get('github_auth_%s' % token, None)
         if data is None:
-            response = requests.get(path, headers={'Authorization': 'token %s' % token})
+            response = Client('github').get(path, headers={'Authorization': 'token %s' % token})
             if response.status_code == 404:   # Not a valid token.
                 return
 
@@ -1,4 +1,4 @@
-import os, socket, sys, requests, dj_database_url
+import os, socket, sys, requests, dj_database_url, tempfile
 from urlparse import urlparse, urljoin
 from datetime import timedelta
 
@@ -143,6 +143,9 @@ STATIC_URL = BASE_URL + 'static/'
 STATIC_ROOT = os.environ.get('STATIC_ROOT', '')
 MEDIA_ROOT = os.environ.get('MEDIA_ROOT', '')
 MEDIA_URL = BASE_URL + 'media/'
+# If True, all local content files are served by the front-end server (via
+#  X-Accel-Redirect to MEDIA_URL), not just downloads.
+CONTENT_X_ACCEL = eval(os.environ.get('CONTENT_X_ACCEL', 'False'))
 
 EXPORT_ROOT = os.environ.get('EXPORT_ROOT', os.path.join(MEDIA_ROOT, 'export'))
 
@@ -193,9 +196,76 @@ if GILES.endswith('/'):
 IMAGE_AFFIXES = ['png', 'jpg', 'jpeg', 'tiff', 'tif']
 GILES_APP_TOKEN = os.environ.get('GILES_APP_TOKEN', 'nope')
 GILES_DEFAULT_PROVIDER = os.environ.get('GILES_DEFAULT_PROVIDER', 'github')
-GILES_TOKEN_EXPIRATION = os.environ.get('GILES_TOKEN_EXPIRATION', 120)    # min.
+GILES_TOKEN_EXPIRATION = int(os.environ.get('GILES_TOKEN_EXPIRATION', 120))    # min.
+# Giles tokens are refreshed this many minutes before they expire, by a single
+#  worker, while the others keep using the old token. See cookies.tokens.
+GILES_TOKEN_REFRESH_MARGIN = int(os.environ.get('GILES_TOKEN_REFRESH_MARGIN', 10))
 GILES_CONTENT_FORMAT_STRING = GILES + '/rest/files/{giles_file_id}/content'
-MAX_GILES_UPLOADS = 200
+# The number of outstanding Giles uploads is adjusted between GILES_WINDOW_MIN
+#  and MAX_GILES_UPLOADS, depending on observations from the last
+#  GILES_WINDOW_PERIOD seconds. See cookies.uploadwindow.
+MAX_GILES_UPLOADS = int(os.environ.get('MAX_GILES_UPLOADS', 200))
+GILES_WINDOW_MIN = int(os.environ.get('GILES_WINDOW_MIN', 5))
+GILES_WINDOW_INITIAL = int(os.environ.get('GILES_WINDOW_INITIAL', 50))
+GILES_WINDOW_INCREASE = int(os.environ.get('GILES_WINDOW_INCREASE', 10))
+GILES_WINDOW_DECREASE = float(os.environ.get('GILES_WINDOW_DECREASE', 0.5))
+GILES_WINDOW_PERIOD = int(os.environ.get('GILES_WINDOW_PERIOD', 300))    # sec.
+GILES_TARGET_LATENCY = float(os.environ.get('GILES_TARGET_LATENCY', 10))    # sec.
+GILES_MAX_ERROR_RATE = float(os.environ.get('GILES_MAX_ERROR_RATE', 0.05))
+GILES_MAX_PROCESSING_SLOWDOWN = float(os.environ.get('GILES_MAX_PROCESSING_SLOWDOWN', 2))
+
+# Giles is first polled for an upload after the time it is expected to take
+#  (based on its size, and processing times over the last
+#  GILES_POLL_ESTIMATE_PERIOD seconds), then at exponentially increasing
+#  intervals. All in seconds.
+GILES_POLL_MIN = int(os.environ.get('GILES_POLL_MIN', 15))
+GILES_POLL_MAX = int(os.environ.get('GILES_POLL_MAX', 3600))
+GILES_POLL_DEFAULT = int(os.environ.get('GILES_POLL_DEFAULT', 60))
+GILES_POLL_ESTIMATE_PERIOD = int(os.environ.get('GILES_POLL_ESTIMATE_PERIOD', 24 * 3600))
+# Processing times are kept this long (in seconds).
+GILES_PROCESSING_HISTORY = int(os.environ.get('GILES_PROCESSING_HISTORY', 7 * 24 * 3600))
+
+# Content retrieval for exports. Up to CONTENT_FETCH_WORKERS content resources
+#  are fetched ahead of the one being written; requests to each external source
+#  are further limited by concurrency and rate (requests per second).
+# Worker threads can't see the in-memory SQLite test database.
+CONTENT_FETCH_WORKERS = int(os.environ.get('CONTENT_FETCH_WORKERS', 1 if TEST else 8))
+CONTENT_FETCH_CONCURRENCY = {
+    'GL': int(os.environ.get('GILES_FETCH_CONCURRENCY', 4)),
+}
+CONTENT_FETCH_RATE_LIMIT = {
+    'GL': float(os.environ.get('GILES_FETCH_RATE_LIMIT', 10)),
+}
+
+# Locations that fail are not retried for CONTENT_FAILURE_TTL seconds. If at
+#  least CONTENT_BREAKER_THRESHOLD of the (at least CONTENT_BREAKER_MIN_REQUESTS)
+#  requests to a source in the last CONTENT_BREAKER_WINDOW seconds failed, the
+#  source isn't contacted for CONTENT_BREAKER_COOLDOWN seconds.
+CONTENT_FAILURE_TTL = int(os.environ.get('CONTENT_FAILURE_TTL', 60))
+CONTENT_BREAKER_THRESHOLD = float(os.environ.get('CONTENT_BREAKER_THRESHOLD', 0.5))
+CONTENT_BREAKER_MIN_REQUESTS = int(os.environ.get('CONTENT_BREAKER_MIN_REQUESTS', 10))
+CONTENT_BREAKER_WINDOW = int(os.environ.get('CONTENT_BREAKER_WINDOW', 60))
+CONTENT_BREAKER_COOLDOWN = int(os.environ.get('CONTENT_BREAKER_COOLDOWN', 30))
+
+# Shared HTTP sessions for remote services (see cookies.sessions). Each session
+#  keeps up to REMOTE_POOL_MAXSIZE connections to each of REMOTE_POOL_CONNECTIONS
+#  hosts alive. Timeouts are in seconds; failed connections and 502/503/504
+#  responses to idempotent requests are retried up to REMOTE_RETRIES times,
+#  after about REMOTE_RETRY_BACKOFF * 2^n seconds (with jitter).
+REMOTE_POOL_CONNECTIONS = int(os.environ.get('REMOTE_POOL_CONNECTIONS', 10))
+REMOTE_POOL_MAXSIZE = int(os.environ.get('REMOTE_POOL_MAXSIZE', 10))
+REMOTE_CONNECT_TIMEOUT = float(os.environ.get('REMOTE_CONNECT_TIMEOUT', 10))
+REMOTE_READ_TIMEOUT = float(os.environ.get('REMOTE_READ_TIMEOUT', 60))
+REMOTE_RETRIES = int(os.environ.get('REMOTE_RETRIES', 3))
+REMOTE_RETRY_BACKOFF = float(os.environ.get('REMOTE_RETRY_BACKOFF', 0.5))
+
+# Datasets up to this size can be downloaded directly, without a snapshot.
+MAX_STREAMING_EXPORT_RESOURCES = int(os.environ.get('MAX_STREAMING_EXPORT_RESOURCES', 500))
+
+# Index and metadata CSVs for exports are kept in memory up to this size (in
+#  bytes), and are then spooled to a temporary file in EXPORT_SPOOL_DIR.
+EXPORT_SPOOL_MAX_SIZE = int(os.environ.get('EXPORT_SPOOL_MAX_SIZE', 4 * 1024 * 1024))
+EXPORT_SPOOL_DIR = os.environ.get('EXPORT_SPOOL_DIR', None)
 
 # Defines creators for each type of document keys in Giles response.
 #  - Keys in this map are the keys that may be present in
@@ -254,14 +324,27 @@ HATHITRUST_METADATA_BASE = 'https://catalog.hathitrust.org/api/volumes/brief/hti
 
 
 
+# Remote content is cached on disk, in files named by the hash of their
+#  location. See cookies.contentcache.
+CONTENT_CACHE_DIR = os.environ.get('CONTENT_CACHE_DIR', os.path.join(MEDIA_ROOT, 'content_cache'))
+if TEST:
+    CONTENT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'amphora-test-content-cache')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'content_cache',
     },
     'remote_content': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
-        'LOCATION': 'content_cache',
+        'BACKEND': 'cookies.contentcache.TieredContentCache',
+        'LOCATION': CONTENT_CACHE_DIR,
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_SIZE': int(os.environ.get('CONTENT_CACHE_MAX_SIZE', 10 * 1024 ** 3)),
+            'MEMORY_MAX_SIZE': int(os.environ.get('CONTENT_CACHE_MEMORY_MAX_SIZE', 64 * 1024 ** 2)),
+            'MEMORY_MAX_ITEM_SIZE': int(os.environ.get('CONTENT_CACHE_MEMORY_MAX_ITEM_SIZE', 1024 ** 2)),
+            'EVICTION_POLICY': os.environ.get('CONTENT_CACHE_EVICTION_POLICY', 'lru'),
+        },
     },
     'rest_cache': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
@@ -62,6 +62,7 @@ urlpatterns = [
     url(r'^dataset/$', views.resource.list_datasets, name="list-datasets"),
     url(r'^dataset/([0-9]+)/$', views.resource.dataset, name="dataset"),
     url(r'^dataset/([0-9]+)/snapshot/$', views.resource.create_snapshot, name="snapshot-dataset"),
+    url(r'^dataset/([0-9]+)/export/$', views.resource.export_dataset, name="export-dataset"),
 
     url(r'^dashboard/$', views.dashboard, name="dashboard"),
     url(r'^inactive/$', views.inactive, name="inactive"),